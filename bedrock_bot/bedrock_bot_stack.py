@@ -1,6 +1,8 @@
 from aws_cdk import (
     Duration,
+    RemovalPolicy,
     Stack,
+    aws_dynamodb as dynamodb,
     aws_sqs as sqs,
     aws_apigateway as apigateway,
     aws_lambda_python_alpha as lambda_python_alpha,
@@ -9,6 +11,7 @@ from aws_cdk import (
     aws_iam as iam,
     aws_ssm as ssm,
     Aws,
+    CfnOutput,
 )
 from constructs import Construct
 
@@ -18,13 +21,59 @@ class BedrockBotStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        # 両Lambdaのログレベル(DEBUGにするとイベント全体を出力する)
+        log_level = self.get_context("log_level", "INFO")
+
+        # 両Lambdaのアーキテクチャ・メモリ・タイムアウトとバッチ設定
+        # (tests/load/power_tuning.pyの結果を見て、メッセージあたりのコストで選ぶ)
+        architecture = self.get_architecture()
+        api_memory_size = int(self.get_context("api_memory_size", 256))
+        api_timeout_seconds = int(self.get_context("api_timeout_seconds", 10))
+        worker_memory_size = self.get_optional_int_context("worker_memory_size")
+        worker_timeout_seconds = int(self.get_context("worker_timeout_seconds", 300))
+        worker_batch_size = int(self.get_context("worker_batch_size", 10))
+        worker_batching_window_seconds = int(
+            self.get_context("worker_batching_window_seconds", 0)
+        )
+        # 処理中のメッセージが再配信されないよう、可視性タイムアウトはワーカーのタイムアウト以上にする
+        visibility_timeout = Duration.seconds(max(300, worker_timeout_seconds))
+
+        # DLQの作成
+        dead_letter_queue = sqs.Queue(
+            self,
+            "DeadLetterQueue",
+            retention_period=Duration.days(1),
+        )
+
+        # ワーカーへの受け渡し方法(sqs: 既定, lambda: 非同期の直接起動)
+        dispatch_mode = self.get_context("dispatch_mode", "sqs")
+        if dispatch_mode not in ("sqs", "lambda"):
+            raise ValueError(f"Unknown dispatch_mode: {dispatch_mode}")
+
+        # DLQへ移すまでの受信回数(障害で後回しにしたメッセージも、回復を待てる回数にする)
+        max_receive_count = int(self.get_context("max_receive_count", 8))
+
         # SQSキューの作成
         queue = sqs.Queue(
             self,
             "BedrockBotQueue",
-            visibility_timeout=Duration.seconds(
-                300
-            ),  # メッセージの可視性タイムアウトを設定
+            visibility_timeout=visibility_timeout,  # メッセージの可視性タイムアウトを設定
+            # 部分バッチ失敗で再配信され続けないよう、一定回数でDLQへ移す
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=max_receive_count,
+                queue=dead_letter_queue,
+            ),
+        )
+
+        # 優先チャンネル用のSQSキュー(通常のキューとは別のワーカー枠で処理する)
+        priority_queue = sqs.Queue(
+            self,
+            "BedrockBotPriorityQueue",
+            visibility_timeout=visibility_timeout,
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=max_receive_count,
+                queue=dead_letter_queue,
+            ),
         )
 
         # SSMパラメータストアの作成
@@ -42,6 +91,13 @@ class BedrockBotStack(Stack):
             string_value="dummy_verify_token",
         )
 
+        signing_secret_param = ssm.StringParameter(
+            self,
+            "SigningSecretParam",
+            parameter_name="/bedrock_bot/lambda/signing_secret",
+            string_value="dummy_signing_secret",
+        )
+
         flow_identifier_param = ssm.StringParameter(
             self,
             "FlowIdentifierParam",
@@ -56,6 +112,45 @@ class BedrockBotStack(Stack):
             string_value="dummy",
         )
 
+        # イベントの重複排除用のDynamoDBテーブル(両Lambdaで共有)
+        idempotency_table = dynamodb.Table(
+            self,
+            "IdempotencyTable",
+            partition_key=dynamodb.Attribute(
+                name="idempotency_key", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        # ユーザー・チャンネルごとの流量制限(トークンバケット)の状態を保持するテーブル
+        rate_limit_table = dynamodb.Table(
+            self,
+            "RateLimitTable",
+            partition_key=dynamodb.Attribute(
+                name="bucket_key", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        # Lambdaレイヤーの作成(両ハンドラで共有する共通モジュールを含む)
+        lambda_layer = lambda_python_alpha.PythonLayerVersion(
+            self,
+            "MyLayer",
+            entry="lambda_module/layer",
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_12],
+            compatible_architectures=[architecture],
+        )
+
+        # ボット自身のユーザーID(APIでボットの投稿を無視し、ワーカーで質問からメンションを除く)
+        slack_bot_user_id = self.get_context("slack_bot_user_id", "")
+
+        # 優先キューへ送るチャンネル(カンマ区切り)
+        priority_channels = ",".join(self.get_list_context("priority_channels"))
+
         lambda_api_function = lambda_python_alpha.PythonFunction(
             self,
             "APILambda",
@@ -63,59 +158,142 @@ class BedrockBotStack(Stack):
             index="handler.py",
             handler="main",
             runtime=lambda_.Runtime.PYTHON_3_12,
-            timeout=Duration.seconds(10),
-            memory_size=256,
+            architecture=architecture,
+            timeout=Duration.seconds(api_timeout_seconds),
+            memory_size=api_memory_size,
             environment={
                 "SLACK_BOT_VERIFY_TOKEN": verify_token_param.parameter_name,
+                "SLACK_SIGNING_SECRET": signing_secret_param.parameter_name,
+                # 流量制限の通知(chat.postEphemeral)に使うトークン
+                "SLACK_BOT_USER_ACCESS_TOKEN": access_token_param.parameter_name,
                 "SQS_QUEUE_URL": queue.queue_url,  # SQSキューのURLを環境変数に追加
+                # 指定したチャンネルのメッセージは優先キューへ送る
+                "SQS_PRIORITY_QUEUE_URL": priority_queue.queue_url,
+                "PRIORITY_CHANNELS": priority_channels,
+                "DISPATCH_MODE": dispatch_mode,
+                # ボット自身のユーザーID(指定するとボットの投稿を本文をパースせずに無視する)
+                "SLACK_BOT_USER_ID": slack_bot_user_id,
+                # これより大きいキューのメッセージは圧縮する(0で無効)
+                "ENQUEUE_COMPRESS_THRESHOLD_BYTES": str(
+                    self.get_context("enqueue_compress_threshold_bytes", 16384)
+                ),
+                "IDEMPOTENCY_TABLE": idempotency_table.table_name,
+                # 受け付け中の記録はAPIのタイムアウトで期限切れにし、落ちた場合もSlackの再送を処理する
+                "EVENT_CLAIM_TTL_SECONDS": str(api_timeout_seconds),
+                "LOG_LEVEL": log_level,
+                # 流量制限(capacity件まで連続で受け付け、1分あたりper_minute件回復)
+                "RATE_LIMIT_TABLE": rate_limit_table.table_name,
+                "RATE_LIMIT_USER_CAPACITY": str(
+                    self.get_context("rate_limit_user_capacity", 5)
+                ),
+                "RATE_LIMIT_USER_PER_MINUTE": str(
+                    self.get_context("rate_limit_user_per_minute", 5)
+                ),
+                "RATE_LIMIT_CHANNEL_CAPACITY": str(
+                    self.get_context("rate_limit_channel_capacity", 30)
+                ),
+                "RATE_LIMIT_CHANNEL_PER_MINUTE": str(
+                    self.get_context("rate_limit_channel_per_minute", 30)
+                ),
+                "RATE_LIMIT_MAX_DEFER_SECONDS": str(
+                    self.get_context("rate_limit_max_defer_seconds", 60)
+                ),
             },
+            layers=[lambda_layer],
         )
 
         # access_token_paramとverify_token_paramに対してポリシーを設定
         verify_token_param.grant_read(lambda_api_function)
+        access_token_param.grant_read(lambda_api_function)
+        rate_limit_table.grant_read_write_data(lambda_api_function)
+        signing_secret_param.grant_read(lambda_api_function)
+        idempotency_table.grant_read_write_data(lambda_api_function)
+
+        # Flowとモデルを直接呼び出す(Converse)場合のリージョンとモデル
+        flow_region = self.get_context("flow_region", "us-east-1")
+        converse_region = self.get_context("converse_region", "us-east-1")
+        converse_model_id = self.get_context("converse_model_id", "")
 
         # IAM policy statement for Bedrock
         bedrock_policy_statement = iam.PolicyStatement(
             actions=["bedrock:InvokeFlow"],
             resources=[
-                "arn:aws:bedrock:us-east-1:*:flow/*/alias/*",
+                f"arn:aws:bedrock:{flow_region}:*:flow/*/alias/*",
             ],
         )
         # Attach the policies to the lambda function
         lambda_api_function.add_to_role_policy(bedrock_policy_statement)
 
+        # API Lambdaのコールドスタート対策(SnapStartかプロビジョニング済み同時実行のどちらか)
+        api_snapstart = (
+            str(self.get_context("api_snapstart", "false")).lower() == "true"
+        )
+        api_provisioned_concurrency = int(
+            self.get_context("api_provisioned_concurrency", 0)
+        )
+        if api_snapstart and api_provisioned_concurrency:
+            raise ValueError(
+                "api_snapstart and api_provisioned_concurrency cannot be combined"
+            )
+        api_target = lambda_api_function
+        if api_snapstart or api_provisioned_concurrency:
+            # INITが最初のリクエストの前に済むため、クライアントとSSMの取得もINITで行う
+            lambda_api_function.add_environment("WARM_ON_INIT", "true")
+            if api_snapstart:
+                # このCDKのバージョンのPythonFunctionには指定がないため、L1で設定する
+                lambda_api_function.node.default_child.add_property_override(
+                    "SnapStart", {"ApplyOn": "PublishedVersions"}
+                )
+            # どちらも公開バージョンにだけ効くため、API Gatewayからはエイリアスを呼び出す
+            api_target = lambda_.Alias(
+                self,
+                "APILambdaLiveAlias",
+                alias_name="live",
+                version=lambda_api_function.current_version,
+                provisioned_concurrent_executions=api_provisioned_concurrency or None,
+            )
+
         # API Gateway with Lambda Integration
         api = apigateway.LambdaRestApi(
             self,
             "LambdaApi",
-            handler=lambda_api_function,
+            handler=api_target,
             proxy=False,
         )
 
         # POST メソッドのみを許可するためのリソースとメソッドの設定
         resource = api.root
-        resource.add_method("POST", apigateway.LambdaIntegration(lambda_api_function))
+        resource.add_method("POST", apigateway.LambdaIntegration(api_target))
 
         # Lambda functionからこのキューへ送れるように権限追加
         queue_policy_statement = iam.PolicyStatement(
             actions=["sqs:SendMessage"],
-            resources=[queue.queue_arn],
+            resources=[queue.queue_arn, priority_queue.queue_arn],
         )
         lambda_api_function.add_to_role_policy(queue_policy_statement)
 
-        # Lambdaレイヤーの作成
-        lambda_layer = lambda_python_alpha.PythonLayerVersion(
+        # 回答キャッシュ用のDynamoDBテーブル(期限切れの項目はTTLで削除)
+        response_cache_table = dynamodb.Table(
             self,
-            "MyLayer",
-            entry="lambda_module/layer",
-            compatible_runtimes=[lambda_.Runtime.PYTHON_3_12],
+            "ResponseCacheTable",
+            partition_key=dynamodb.Attribute(
+                name="cache_key", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
         )
 
-        # DLQの作成
-        dead_letter_queue = sqs.Queue(
+        # スレッドごとの会話履歴を保持するDynamoDBテーブル
+        history_table = dynamodb.Table(
             self,
-            "DeadLetterQueue",
-            retention_period=Duration.days(1),
+            "HistoryTable",
+            partition_key=dynamodb.Attribute(
+                name="conversation_key", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
         )
 
         # SQSから起動するLambda関数の追加
@@ -126,27 +304,168 @@ class BedrockBotStack(Stack):
             index="handler.py",  # ファイル名
             handler="main",  # ハンドラ関数名
             runtime=lambda_.Runtime.PYTHON_3_12,
-            timeout=Duration.minutes(5),
+            architecture=architecture,
+            timeout=Duration.seconds(worker_timeout_seconds),
+            memory_size=worker_memory_size,
             environment={
+                "LOG_LEVEL": log_level,
                 "SLACK_BOT_USER_ACCESS_TOKEN": access_token_param.parameter_name,
                 "SLACK_BOT_VERIFY_TOKEN": verify_token_param.parameter_name,
                 "FLOW_IDENTIFIER": flow_identifier_param.parameter_name,
                 "FLOW_ALIAS_IDENTIFIER": flow_alias_identifier_param.parameter_name,
+                # バッチ内で並列に呼び出すFlowの上限
+                "FLOW_MAX_CONCURRENCY": str(
+                    self.get_context("flow_max_concurrency", 4)
+                ),
+                # プレースホルダー投稿後にchat.updateで逐次更新するモード
+                "SLACK_STREAMING_MODE": str(
+                    self.get_context("slack_streaming_mode", "false")
+                ).lower(),
+                "SLACK_STREAM_UPDATE_INTERVAL": str(
+                    self.get_context("slack_stream_update_interval", 1.0)
+                ),
+                # 質問からメンションを除くためのボットのユーザーIDと、質問の推定トークン数の上限
+                "SLACK_BOT_USER_ID": slack_bot_user_id,
+                "PROMPT_TOKEN_BUDGET": str(
+                    self.get_context("prompt_token_budget", 2000)
+                ),
+                # 回答の生成に使うバックエンド(flowかconverse)と、Converseに振り分ける条件
+                "MODEL_BACKEND": self.get_context("model_backend", "flow"),
+                "BEDROCK_FLOW_REGION": flow_region,
+                "CONVERSE_REGION": converse_region,
+                "CONVERSE_MODEL_ID": converse_model_id,
+                "CONVERSE_CHANNELS": ",".join(
+                    self.get_list_context("converse_channels")
+                ),
+                "CONVERSE_MAX_PROMPT_TOKENS": str(
+                    self.get_context("converse_max_prompt_tokens", 0)
+                ),
+                # Flowのトレースを取得してノードごとの所要時間を記録する呼び出しの割合
+                "FLOW_TRACE_SAMPLE_RATE": str(
+                    self.get_context("flow_trace_sample_rate", 0.01)
+                ),
+                # 長い回答を分割して投稿する1件あたりの文字数と、ファイルで共有する合計文字数
+                # (ファイルの共有にはボットにfiles:writeのスコープが必要)
+                "SLACK_CHUNK_CHARS": str(self.get_context("slack_chunk_chars", 3000)),
+                "SLACK_FILE_UPLOAD_CHARS": str(
+                    self.get_context("slack_file_upload_chars", 12000)
+                ),
+                "SLACK_BLOCK_KIT": str(
+                    self.get_context("slack_block_kit", "false")
+                ).lower(),
+                # 回答キャッシュ(TTLを0にすると無効)と、キャッシュしないチャンネル
+                "RESPONSE_CACHE_TABLE": response_cache_table.table_name,
+                "RESPONSE_CACHE_TTL": str(self.get_context("response_cache_ttl", 3600)),
+                "RESPONSE_CACHE_OPTOUT_CHANNELS": ",".join(
+                    self.get_list_context("response_cache_optout_channels")
+                ),
+                # 重複配信で同じメンションに2回回答しないための記録
+                "IDEMPOTENCY_TABLE": idempotency_table.table_name,
+                # 会話履歴としてFlowに渡すトークン数の上限(0にすると無効)
+                "HISTORY_TABLE": history_table.table_name,
+                "HISTORY_TOKEN_BUDGET": str(
+                    self.get_context("history_token_budget", 2000)
+                ),
             },
             layers=[lambda_layer],  # レイヤーを追加
             dead_letter_queue=dead_letter_queue,
+            # 予約同時実行数(指定した場合のみ。ワーカー全体の上限になる)
+            reserved_concurrent_executions=self.get_optional_int_context(
+                "worker_reserved_concurrency"
+            ),
         )
 
         # SQSイベントソースをLambdaに接続
         sqs_event_source = lambda_event_sources.SqsEventSource(
             queue,
-            batch_size=10,  # 同時に処理するメッセージの数
+            batch_size=worker_batch_size,  # 同時に処理するメッセージの数
+            max_batching_window=self.get_batching_window(
+                worker_batching_window_seconds
+            ),
+            report_batch_item_failures=True,  # 失敗したメッセージだけを再配信
+            # SQSから同時に起動するワーカーの上限(Bedrockのスロットリング対策)
+            max_concurrency=int(self.get_context("worker_max_concurrency", 5)),
         )
         sqs_lambda_function.add_event_source(sqs_event_source)
 
+        # 優先キューは専用の同時実行枠で処理し、通常キューの滞留の影響を受けないようにする
+        sqs_lambda_function.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                priority_queue,
+                batch_size=worker_batch_size,
+                max_batching_window=self.get_batching_window(
+                    worker_batching_window_seconds
+                ),
+                report_batch_item_failures=True,
+                max_concurrency=int(
+                    self.get_context("priority_worker_max_concurrency", 5)
+                ),
+            )
+        )
+
         # Attach the policies to the lambda function
         access_token_param.grant_read(sqs_lambda_function)
         verify_token_param.grant_read(sqs_lambda_function)
         flow_identifier_param.grant_read(sqs_lambda_function)
         flow_alias_identifier_param.grant_read(sqs_lambda_function)
         sqs_lambda_function.add_to_role_policy(bedrock_policy_statement)
+        if converse_model_id:
+            # 推論プロファイルを指定した場合は、振り分け先の各リージョンのモデルも呼び出す
+            sqs_lambda_function.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=["bedrock:InvokeModelWithResponseStream"],
+                    resources=[
+                        "arn:aws:bedrock:*::foundation-model/*",
+                        f"arn:aws:bedrock:{converse_region}:*:inference-profile/*",
+                    ],
+                )
+            )
+        response_cache_table.grant_read_write_data(sqs_lambda_function)
+        idempotency_table.grant_read_write_data(sqs_lambda_function)
+        history_table.grant_read_write_data(sqs_lambda_function)
+
+        # 直接起動モードではAPI LambdaからワーカーLambdaを非同期で呼び出す
+        if dispatch_mode == "lambda":
+            lambda_api_function.add_environment(
+                "WORKER_FUNCTION_NAME", sqs_lambda_function.function_name
+            )
+            sqs_lambda_function.grant_invoke(lambda_api_function)
+
+        # DLQの再送ツール(invoke redrive)とログの分析(invoke tailf)が対象を見つけるための出力
+        CfnOutput(self, "DeadLetterQueueUrl", value=dead_letter_queue.queue_url)
+        CfnOutput(self, "QueueUrl", value=queue.queue_url)
+        CfnOutput(self, "PriorityQueueUrl", value=priority_queue.queue_url)
+        if priority_channels:
+            # 空の値は出力できないため、チャンネルを指定したときだけ出力する
+            CfnOutput(self, "PriorityChannels", value=priority_channels)
+        CfnOutput(self, "ApiFunctionName", value=lambda_api_function.function_name)
+        CfnOutput(self, "WorkerFunctionName", value=sqs_lambda_function.function_name)
+
+    def get_context(self, key, default):
+        # cdk.jsonや-cで指定されたコンテキスト値(未指定ならdefault)
+        value = self.node.try_get_context(key)
+        return default if value is None else value
+
+    def get_optional_int_context(self, key):
+        # 未指定ならNone(-cで指定した値は文字列になるため数値に変換する)
+        value = self.get_context(key, None)
+        return None if value is None else int(value)
+
+    def get_architecture(self):
+        value = str(self.get_context("lambda_architecture", "x86_64")).lower()
+        if value in ("arm64", "arm_64"):
+            return lambda_.Architecture.ARM_64
+        if value in ("x86_64", "x86"):
+            return lambda_.Architecture.X86_64
+        raise ValueError(f"Unknown lambda_architecture: {value}")
+
+    def get_batching_window(self, seconds):
+        # 0秒(既定)の場合は待たずにすぐワーカーを起動する
+        return Duration.seconds(seconds) if seconds else None
+
+    def get_list_context(self, key):
+        # -c key=a,b のような文字列指定とcdk.jsonの配列指定の両方を受け付ける
+        value = self.get_context(key, [])
+        if isinstance(value, str):
+            value = value.split(",")
+        return [item.strip() for item in value if item.strip()]
@@ -0,0 +1,343 @@
+import argparse
+import collections
+import json
+import math
+import re
+import sys
+import time
+
+from bedrock_bot.stack_outputs import DEFAULT_STACK_NAME, get_stack_outputs
+
+# LambdaのREPORT行(Init Durationはコールドスタートのときだけ付く)
+REPORT_PATTERN = re.compile(
+    r"REPORT RequestId: (?P<request_id>\S+)\s+"
+    r"Duration: (?P<duration_ms>[\d.]+) ms\s+"
+    r"Billed Duration: (?P<billed_ms>[\d.]+) ms\s+"
+    r"Memory Size: (?P<memory_mb>\d+) MB\s+"
+    r"Max Memory Used: (?P<max_memory_mb>\d+) MB"
+    r"(?:\s+Init Duration: (?P<init_ms>[\d.]+) ms)?"
+)
+
+# aws logs tail の出力(時刻 ストリーム名 メッセージ)
+TAIL_PREFIX_PATTERN = re.compile(r"^(\d{4}-\d\d-\d\dT\S+)\s+(\S+)\s+(.*)$")
+
+# 構造化ログのlogger、EMFのFunctionから関数を判別する
+SOURCES = {
+    "bedrock_bot.api": "api",
+    "bedrock_bot.sqs": "worker",
+    "api": "api",
+    "sqs": "worker",
+}
+
+DEFAULT_WINDOW = 500
+DEFAULT_MAX_EVENTS = 10000
+DEFAULT_INTERVAL_SECONDS = 30
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, p):
+    # 最近傍順位法
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(values):
+    summary = {"count": len(values)}
+    for p in PERCENTILES:
+        value = percentile(values, p)
+        summary[f"p{p}"] = None if value is None else round(value, 1)
+    return summary
+
+
+def parse_report(message):
+    match = REPORT_PATTERN.search(message)
+    if not match:
+        return None
+    return {
+        key: (value if key == "request_id" else float(value))
+        for key, value in match.groupdict().items()
+        if value is not None
+    }
+
+
+def parse_message(message):
+    # ("report" | "emf" | "log" | None, 内容)
+    message = message.strip()
+    if message.startswith("REPORT "):
+        report = parse_report(message)
+        if report:
+            return "report", report
+    if message.startswith("{"):
+        try:
+            entry = json.loads(message)
+        except ValueError:
+            return None, message
+        if isinstance(entry, dict):
+            return ("emf" if "_aws" in entry else "log"), entry
+    return None, message
+
+
+def get_source(kind, entry):
+    if kind == "log":
+        return SOURCES.get(entry.get("logger"))
+    if kind == "emf":
+        return SOURCES.get(entry.get("Function"))
+    return None
+
+
+def matches(entry, filters):
+    # key=valueの条件をすべて満たす構造化ログか(値は文字列として比べる)
+    return all(str(entry.get(key)) == value for key, value in filters.items())
+
+
+class LogAnalyzer:
+    # APIとワーカーのログを受け取り、REPORT行の所要時間とevent_tsで突き合わせた全体の所要時間を集計する
+    # (REPORT行には関数名がないため、同じストリームで直前に出た構造化ログの関数とみなす)
+
+    def __init__(self, window=DEFAULT_WINDOW, max_events=DEFAULT_MAX_EVENTS):
+        self.window = window
+        self.max_events = max_events
+        self._stream_sources = {}
+        self._reports = collections.defaultdict(
+            lambda: collections.deque(maxlen=window)
+        )
+        self._events = collections.OrderedDict()
+        self._latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=window)
+        )
+        self.lines = 0
+
+    def add(self, message, source=None, stream=None):
+        self.lines += 1
+        kind, entry = parse_message(message)
+        source = source or get_source(kind, entry)
+        if source:
+            self._stream_sources[stream] = source
+        else:
+            source = self._stream_sources.get(stream)
+
+        if kind == "report" and source:
+            self._reports[source].append(entry)
+        elif kind == "log" and entry.get("event_ts"):
+            self.correlate(entry)
+        return kind, entry
+
+    def correlate(self, entry):
+        event_ts = str(entry["event_ts"])
+        timestamp = entry.get("timestamp")
+        stage = {
+            "Message dispatched": "dispatched",
+            "Processing mention": "started",
+            "Mention processed": "finished",
+        }.get(entry.get("message"))
+        if stage is None or timestamp is None:
+            return
+        event = self._events.setdefault(event_ts, {})
+        event[stage] = timestamp
+        if len(self._events) > self.max_events:
+            self._events.popitem(last=False)
+
+        if stage == "started" and "dispatched" in event:
+            self._latencies["queue_delay_ms"].append(timestamp - event["dispatched"])
+        if stage == "finished":
+            if "started" in event:
+                self._latencies["worker_ms"].append(timestamp - event["started"])
+            try:
+                # event_tsはSlackにメッセージが投稿された時刻(秒)
+                posted_at = float(event_ts) * 1000
+            except ValueError:
+                return
+            self._latencies["end_to_end_ms"].append(timestamp - posted_at)
+            event["end_to_end_ms"] = timestamp - posted_at
+
+    def summary(self):
+        functions = {}
+        for source, reports in self._reports.items():
+            cold_starts = [r["init_ms"] for r in reports if "init_ms" in r]
+            functions[source] = {
+                "invocations": len(reports),
+                "cold_start_rate": round(len(cold_starts) / len(reports), 3),
+                "duration_ms": summarize([r["duration_ms"] for r in reports]),
+                "billed_ms": summarize([r["billed_ms"] for r in reports]),
+                "init_ms": summarize(cold_starts),
+                "max_memory_mb": max(r["max_memory_mb"] for r in reports),
+                "memory_size_mb": reports[-1]["memory_mb"],
+            }
+        slowest = sorted(
+            (
+                (event["end_to_end_ms"], event_ts)
+                for event_ts, event in self._events.items()
+                if "end_to_end_ms" in event
+            ),
+            reverse=True,
+        )[:5]
+        return {
+            "lines": self.lines,
+            "functions": functions,
+            "mentions": {
+                name: summarize(values) for name, values in self._latencies.items()
+            },
+            "slowest": [
+                {"event_ts": event_ts, "end_to_end_ms": round(ms, 1)}
+                for ms, event_ts in slowest
+            ],
+        }
+
+
+def format_summary(summary):
+    def percentiles(values):
+        return " ".join(f"p{p}={values[f'p{p}']}" for p in PERCENTILES)
+
+    lines = [f"--- {summary['lines']} lines"]
+    for source, stats in sorted(summary["functions"].items()):
+        lines.append(
+            f"{source}: n={stats['invocations']} "
+            f"cold={stats['cold_start_rate']:.1%} "
+            f"duration {percentiles(stats['duration_ms'])} "
+            f"maxmem={stats['max_memory_mb']:.0f}/{stats['memory_size_mb']:.0f}MB"
+        )
+    for name, stats in sorted(summary["mentions"].items()):
+        lines.append(f"{name}: n={stats['count']} {percentiles(stats)}")
+    return "\n".join(lines)
+
+
+def parse_filters(values):
+    filters = {}
+    for value in values or []:
+        key, _, expected = value.partition("=")
+        filters[key] = expected
+    return filters
+
+
+def read_log_file(path):
+    # aws logs filter-log-events のJSON出力か、1行1メッセージのテキスト(aws logs tailの出力も可)
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith("{"):
+        try:
+            document = json.loads(text)
+        except ValueError:
+            document = None
+        if isinstance(document, dict) and "events" in document:
+            for event in document["events"]:
+                yield event["message"], event.get("logStreamName")
+            return
+    for line in text.splitlines():
+        match = TAIL_PREFIX_PATTERN.match(line)
+        if match:
+            yield match.group(3), match.group(2)
+        elif line.strip():
+            yield line, path
+
+
+def analyze_files(paths, filters=None, out=sys.stdout, window=DEFAULT_WINDOW):
+    # 保存したログファイルを同じ方法で分析する
+    analyzer = LogAnalyzer(window=window)
+    for path in paths:
+        for message, stream in read_log_file(path):
+            kind, entry = analyzer.add(message, stream=stream)
+            if filters and kind == "log" and matches(entry, filters):
+                out.write(message.strip() + "\n")
+    return analyzer.summary()
+
+
+def get_function_names(stack_name):
+    outputs = get_stack_outputs(stack_name)
+    return [outputs["ApiFunctionName"], outputs["WorkerFunctionName"]]
+
+
+def tail(
+    function_names,
+    filters=None,
+    interval=DEFAULT_INTERVAL_SECONDS,
+    quiet=False,
+    out=sys.stdout,
+    client=None,
+):
+    # 両方の関数のロググループをまとめてライブテールし、一定間隔で集計を出力する
+    import boto3
+
+    client = client or boto3.client("logs")
+    session = boto3.session.Session()
+    account_id = boto3.client("sts").get_caller_identity()["Account"]
+    groups = {
+        f"arn:aws:logs:{session.region_name}:{account_id}:log-group:/aws/lambda/{name}": name
+        for name in function_names
+    }
+    # 1つ目がAPI、2つ目がワーカー
+    sources = dict(zip(groups, ("api", "worker")))
+    analyzer = LogAnalyzer()
+    next_summary = time.monotonic() + interval
+    response = client.start_live_tail(logGroupIdentifiers=list(groups))
+    try:
+        for event in response["responseStream"]:
+            for log_event in event.get("sessionUpdate", {}).get("sessionResults", []):
+                group = log_event.get("logGroupIdentifier")
+                kind, entry = analyzer.add(
+                    log_event["message"],
+                    source=sources.get(group),
+                    stream=log_event.get("logStreamName"),
+                )
+                if filters:
+                    if kind == "log" and matches(entry, filters):
+                        out.write(log_event["message"].strip() + "\n")
+                elif not quiet:
+                    out.write(
+                        f"{log_event['timestamp']} {groups.get(group, group)}: "
+                        f"{log_event['message'].rstrip()}\n"
+                    )
+            if time.monotonic() >= next_summary:
+                out.write(format_summary(analyzer.summary()) + "\n")
+                next_summary = time.monotonic() + interval
+    except client.exceptions.SessionTimeoutException as e:
+        print(f"セッションがタイムアウトしました: {e}")
+    except client.exceptions.SessionStreamingException as e:
+        print(f"ストリーミングエラーが発生しました: {e}")
+    except KeyboardInterrupt:
+        pass
+    return analyzer.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="APIとワーカーのログからREPORT行と構造化ログを集計する"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    tail_parser = subparsers.add_parser("tail", help="ライブテールしながら集計する")
+    tail_parser.add_argument("--stack-name", default=DEFAULT_STACK_NAME)
+    tail_parser.add_argument(
+        "--function-names",
+        help="API,ワーカーの順のカンマ区切り(未指定ならスタックの出力)",
+    )
+    tail_parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL_SECONDS)
+    tail_parser.add_argument("--quiet", action="store_true", help="ログ行を出力しない")
+    analyze_parser = subparsers.add_parser(
+        "analyze", help="保存したログファイルを集計する"
+    )
+    analyze_parser.add_argument("files", nargs="+")
+    for subparser in (tail_parser, analyze_parser):
+        subparser.add_argument(
+            "--filter",
+            action="append",
+            help="key=valueに一致する構造化ログだけを出力する(複数指定可)",
+        )
+    args = parser.parse_args()
+    filters = parse_filters(args.filter)
+
+    if args.command == "analyze":
+        summary = analyze_files(args.files, filters)
+    else:
+        function_names = (
+            args.function_names.split(",")
+            if args.function_names
+            else get_function_names(args.stack_name)
+        )
+        summary = tail(function_names, filters, args.interval, args.quiet)
+    print(format_summary(summary))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
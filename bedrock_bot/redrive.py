@@ -0,0 +1,377 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bedrock_bot.stack_outputs import DEFAULT_STACK_NAME, get_stack_outputs
+
+# Lambdaレイヤーの共通モジュール(キューのメッセージの形式とワーカーへの送り方)を使う
+LAYER_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "lambda_module",
+    "layer",
+)
+if LAYER_DIR not in sys.path:
+    sys.path.insert(0, LAYER_DIR)
+
+from bedrock_bot_common import dispatch, enqueue, rate_limit  # noqa: E402
+
+DEFAULT_RATE = 5.0
+DEFAULT_WORKERS = 4
+
+# 受信したメッセージを処理し終えるまで他の受信者から隠す時間(秒)
+DEFAULT_VISIBILITY_TIMEOUT = 120
+
+TARGET_QUEUE = "queue"
+TARGET_DIRECT = "direct"
+
+
+class LocalQueue:
+    # テストやリハーサル用のSQS
+    # (receive_message/delete_message_batch/change_message_visibility_batch/send_message_batch)
+
+    def __init__(self, bodies=()):
+        self._ids = itertools.count(1)
+        self._messages = {}
+        # 受信してから削除か可視性の変更までの間、他の受信者から隠すメッセージ
+        self._invisible = set()
+        self._lock = threading.Lock()
+        self.sent = []
+        for body in bodies:
+            self.put(body)
+
+    def put(self, body):
+        message_id = f"m{next(self._ids)}"
+        self._messages[message_id] = body
+        return message_id
+
+    @property
+    def messages(self):
+        return list(self._messages.values())
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, **kwargs):
+        with self._lock:
+            visible = [m for m in self._messages if m not in self._invisible]
+            received = visible[:MaxNumberOfMessages]
+            self._invisible.update(received)
+        return {
+            "Messages": [
+                {
+                    "MessageId": message_id,
+                    "ReceiptHandle": message_id,
+                    "Body": self._messages[message_id],
+                }
+                for message_id in received
+            ]
+        }
+
+    @property
+    def visible_messages(self):
+        with self._lock:
+            return [b for m, b in self._messages.items() if m not in self._invisible]
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        with self._lock:
+            for entry in Entries:
+                self._messages.pop(entry["ReceiptHandle"], None)
+                self._invisible.discard(entry["ReceiptHandle"])
+        return {"Successful": [{"Id": e["Id"]} for e in Entries], "Failed": []}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        # 時間の経過は扱わず、0なら直ちに見えるようにし、それ以外は隠したままにする
+        with self._lock:
+            for entry in Entries:
+                if entry["VisibilityTimeout"] == 0:
+                    self._invisible.discard(entry["ReceiptHandle"])
+                elif entry["ReceiptHandle"] in self._messages:
+                    self._invisible.add(entry["ReceiptHandle"])
+        return {"Successful": [{"Id": e["Id"]} for e in Entries], "Failed": []}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        with self._lock:
+            self.sent.extend(entry["MessageBody"] for entry in Entries)
+        return {
+            "Successful": [
+                {"Id": e["Id"], "MessageId": f"sent-{e['Id']}"} for e in Entries
+            ],
+            "Failed": [],
+        }
+
+
+def extract_bodies(message_body):
+    # DLQのメッセージはSQSから移されたイベント本文か、非同期起動に失敗したワーカーのイベント
+    body = enqueue.decode_message(message_body)
+    if "Records" in body:
+        return [enqueue.decode_message(record["body"]) for record in body["Records"]]
+    return [body]
+
+
+def get_dedupe_key(body):
+    event = body.get("event") or {}
+    event_ts = event.get("event_ts")
+    return f"{event.get('channel')}:{event_ts}" if event_ts else None
+
+
+class Pacer:
+    # 全スレッドで合計rate件/秒を超えないように送信を待たせる
+    # (APIの流量制限と同じトークンバケットを使う)
+
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        self.limit = rate_limit.Limit(max(1, int(rate)), rate * 60)
+        self.limiter = rate_limit.InMemoryRateLimiter(clock=clock)
+        self.sleep = sleep
+
+    def wait(self):
+        if not self.limit.enabled:
+            return
+        while True:
+            allowed, retry_after = self.limiter.acquire("redrive", self.limit)
+            if allowed:
+                return
+            self.sleep(retry_after)
+
+
+class Redriver:
+    # DLQを並列に読み出し、event_tsで重複を除いてワーカーへ送り直す
+
+    def __init__(
+        self,
+        sqs_client,
+        dlq_url,
+        dispatcher,
+        rate=DEFAULT_RATE,
+        workers=DEFAULT_WORKERS,
+        dry_run=False,
+        max_messages=None,
+        visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT,
+        pacer=None,
+    ):
+        self.sqs = sqs_client
+        self.dlq_url = dlq_url
+        self.dispatcher = dispatcher
+        self.workers = workers
+        self.dry_run = dry_run
+        self.max_messages = max_messages
+        self.visibility_timeout = visibility_timeout
+        self.pacer = pacer or Pacer(rate)
+        self._seen = set()
+        self._received = 0
+        # ドライランで受信したメッセージ(最後にまとめて見えるように戻す)
+        self._held = []
+        self._lock = threading.Lock()
+        self.report = {
+            "dry_run": dry_run,
+            "received": 0,
+            "redriven": 0,
+            "duplicates": 0,
+            "failed": 0,
+            "unreadable": 0,
+            "events": [],
+        }
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.report[name] += value
+
+    def claim(self, key):
+        with self._lock:
+            if key in self._seen:
+                return False
+            self._seen.add(key)
+            return True
+
+    def receive(self):
+        with self._lock:
+            remaining = (
+                10 if self.max_messages is None else self.max_messages - self._received
+            )
+            if remaining <= 0:
+                return []
+        messages = self.sqs.receive_message(
+            QueueUrl=self.dlq_url,
+            MaxNumberOfMessages=min(10, remaining),
+            VisibilityTimeout=self.visibility_timeout,
+            WaitTimeSeconds=1,
+        ).get("Messages", [])
+        with self._lock:
+            self._received += len(messages)
+        self.count("received", len(messages))
+        return messages
+
+    def delete(self, messages):
+        if self.dry_run or not messages:
+            return
+        self.sqs.delete_message_batch(
+            QueueUrl=self.dlq_url,
+            Entries=[
+                {"Id": str(i), "ReceiptHandle": message["ReceiptHandle"]}
+                for i, message in enumerate(messages)
+            ],
+        )
+
+    def release(self, messages):
+        # ドライランで隠したメッセージを、可視性タイムアウトを待たずにDLQへ戻す
+        for i in range(0, len(messages), 10):
+            self.sqs.change_message_visibility_batch(
+                QueueUrl=self.dlq_url,
+                Entries=[
+                    {
+                        "Id": str(j),
+                        "ReceiptHandle": message["ReceiptHandle"],
+                        "VisibilityTimeout": 0,
+                    }
+                    for j, message in enumerate(messages[i : i + 10])
+                ],
+            )
+
+    def process(self, messages):
+        # 重複だけのメッセージは送らずに消し、送れたメッセージだけをDLQから消す
+        if self.dry_run:
+            with self._lock:
+                self._held.extend(messages)
+        bodies = []
+        owners = []
+        duplicates = []
+        for message in messages:
+            try:
+                message_bodies = extract_bodies(message["Body"])
+            except (ValueError, KeyError, TypeError):
+                self.count("unreadable")
+                continue
+            fresh = []
+            for body in message_bodies:
+                key = get_dedupe_key(body)
+                if key is not None and not self.claim(key):
+                    self.count("duplicates")
+                    continue
+                fresh.append(body)
+            if not fresh:
+                duplicates.append(message)
+                continue
+            bodies.extend(fresh)
+            owners.extend([message] * len(fresh))
+
+        if self.dry_run:
+            with self._lock:
+                self.report["events"].extend(get_dedupe_key(b) for b in bodies)
+            self.count("redriven", len(bodies))
+            return
+
+        for _ in bodies:
+            self.pacer.wait()
+        message_ids = self.dispatcher.dispatch_batch(bodies) if bodies else []
+        failed = {id(m) for m, mid in zip(owners, message_ids) if mid is None}
+        done = [m for m in {id(m): m for m in owners}.values() if id(m) not in failed]
+        self.count("redriven", sum(1 for mid in message_ids if mid is not None))
+        self.count("failed", sum(1 for mid in message_ids if mid is None))
+        self.delete(done + duplicates)
+
+    def drain(self):
+        def worker():
+            while True:
+                messages = self.receive()
+                if not messages:
+                    return
+                self.process(messages)
+
+        # ドライランでは読み出し終えるまで隠しておき(同じメッセージを何度も受信しないように)、
+        # 途中で失敗した場合も含めて最後に見えるように戻す
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for future in [executor.submit(worker) for _ in range(self.workers)]:
+                    future.result()
+        finally:
+            if self._held:
+                self.release(self._held)
+        return self.report
+
+
+def make_dispatcher(
+    target,
+    queue_url=None,
+    function_name=None,
+    sqs_client=None,
+    priority_queue_url=None,
+    priority_channels=(),
+):
+    if target == TARGET_QUEUE:
+        # APIと同じように、優先チャンネルのメッセージは優先キューへ戻す
+        return dispatch.SqsDispatcher(
+            queue_url,
+            client=sqs_client,
+            priority_queue_url=priority_queue_url,
+            priority_channels=priority_channels,
+        )
+    if target == TARGET_DIRECT:
+        # SQSを経由せずにワーカーLambdaを非同期で起動して処理する
+        return dispatch.LambdaDispatcher(function_name)
+    raise ValueError(f"Unknown redrive target: {target}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="DLQのメッセージを重複を除いてワーカーへ送り直し、結果をJSONで出力する"
+    )
+    parser.add_argument("--stack-name", default=DEFAULT_STACK_NAME)
+    parser.add_argument("--dlq-url", help="未指定ならスタックの出力から取得する")
+    parser.add_argument("--queue-url", help="未指定ならスタックの出力から取得する")
+    parser.add_argument(
+        "--priority-queue-url", help="未指定ならスタックの出力から取得する"
+    )
+    parser.add_argument(
+        "--priority-channels", help="カンマ区切り。未指定ならスタックの出力から取得する"
+    )
+    parser.add_argument("--function-name", help="未指定ならスタックの出力から取得する")
+    parser.add_argument(
+        "--target", choices=(TARGET_QUEUE, TARGET_DIRECT), default=TARGET_QUEUE
+    )
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="件/秒")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--max-messages", type=int)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    import boto3
+
+    outputs = {}
+    if args.target == TARGET_QUEUE:
+        given = (
+            args.queue_url
+            and args.priority_queue_url
+            and args.priority_channels is not None
+        )
+    else:
+        given = args.function_name
+    if not (args.dlq_url and given):
+        outputs = get_stack_outputs(args.stack_name)
+    sqs_client = boto3.client("sqs")
+    redriver = Redriver(
+        sqs_client,
+        args.dlq_url or outputs["DeadLetterQueueUrl"],
+        make_dispatcher(
+            args.target,
+            queue_url=args.queue_url or outputs.get("QueueUrl"),
+            function_name=args.function_name or outputs.get("WorkerFunctionName"),
+            sqs_client=sqs_client,
+            priority_queue_url=args.priority_queue_url
+            or outputs.get("PriorityQueueUrl"),
+            priority_channels=dispatch.parse_channels(
+                args.priority_channels
+                if args.priority_channels is not None
+                else outputs.get("PriorityChannels")
+            ),
+        ),
+        rate=args.rate,
+        workers=args.workers,
+        dry_run=args.dry_run,
+        max_messages=args.max_messages,
+    )
+    print(json.dumps(redriver.drain(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+# 運用ツール(invoke redrive / invoke tailf)が対象のキューや関数を見つけるためのスタックの出力
+
+DEFAULT_STACK_NAME = "BedrockBotStack"
+
+
+def get_stack_outputs(stack_name, client=None):
+    import boto3
+
+    client = client or boto3.client("cloudformation")
+    stack = client.describe_stacks(StackName=stack_name)["Stacks"][0]
+    return {o["OutputKey"]: o["OutputValue"] for o in stack.get("Outputs", [])}
@@ -1,50 +1,198 @@
+import base64
+import hashlib
+import hmac
 import json
-import boto3
+import math
 import os
+import time
 import urllib
 from botocore.exceptions import ClientError
+from bedrock_bot_common import (
+    dispatch,
+    enqueue,
+    event_router,
+    idempotency,
+    instrumentation,
+    parameters,
+    rate_limit,
+    slack,
+)
+
+logger = instrumentation.get_logger("api")
+
+# Slackの署名の形式と、リプレイ攻撃を防ぐためのタイムスタンプの許容幅(秒)
+SIGNATURE_VERSION = "v0"
+REPLAY_WINDOW_SECONDS = 60 * 5
+
+# 流量制限に達したときに、SQSの遅延配信で後回しにする待ち時間の上限(秒)
+DEFAULT_RATE_LIMIT_MAX_DEFER_SECONDS = 60
+RATE_LIMITED_MESSAGE = (
+    "ただいま質問が集中しているため、受け付けできませんでした。"
+    "{seconds}秒ほど待ってから、もう一度お試しください。"
+)
+DEFERRED_MESSAGE = "ただいま質問が集中しているため、少し遅れて回答します。"
+
+# INITのうちに取得しておくSSMパラメータ(名前を持つ環境変数)
+WARM_PARAMETER_ENV_NAMES = (
+    "SLACK_BOT_VERIFY_TOKEN",
+    "SLACK_SIGNING_SECRET",
+    "SLACK_BOT_USER_ACCESS_TOKEN",
+)
+
+# 署名シークレットから作ったHMACはコンテナ内で使い回し、リクエストごとにcopy()する
+_signing_hmac = None
+
+
+def is_warm_on_init_enabled():
+    return os.environ.get("WARM_ON_INIT", "false").lower() == "true"
 
 
 def is_verify_token(event):
-    ssm = boto3.client("ssm")
-    verify_token = ssm.get_parameter(
-        Name=os.environ["SLACK_BOT_VERIFY_TOKEN"], WithDecryption=True
-    )["Parameter"]["Value"]
-
-    # トークンをチェック
-    token = event.get("token")
-    if token != verify_token:
+    # ウォームコンテナではキャッシュ済みの値を使い、SSMを呼ばない
+    verify_token = parameters.get_parameter(os.environ["SLACK_BOT_VERIFY_TOKEN"])
+
+    # トークンをチェック(比較は一定時間で行う)
+    token = event.get("token") or ""
+    return hmac.compare_digest(token.encode("utf-8"), verify_token.encode("utf-8"))
+
+
+def get_signing_hmac():
+    global _signing_hmac
+    if _signing_hmac is None:
+        secret = parameters.get_parameter(os.environ["SLACK_SIGNING_SECRET"])
+        _signing_hmac = hmac.new(secret.encode("utf-8"), digestmod=hashlib.sha256)
+    return _signing_hmac.copy()
+
+
+def get_header(event, name):
+    # API Gatewayはヘッダー名の大文字小文字をそのまま渡すため、区別せずに探す
+    headers = event.get("headers") or {}
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def get_raw_body(event):
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        return base64.b64decode(body)
+    return body.encode("utf-8")
+
+
+def is_valid_signature(event, now=None):
+    timestamp = get_header(event, "X-Slack-Request-Timestamp")
+    signature = get_header(event, "X-Slack-Signature")
+    if not timestamp or not signature:
+        return False
+
+    try:
+        request_time = int(timestamp)
+    except ValueError:
         return False
+    if abs((now or time.time()) - request_time) > REPLAY_WINDOW_SECONDS:
+        logger.warning("Request timestamp is outside the replay window.")
+        return False
+
+    mac = get_signing_hmac()
+    mac.update(f"{SIGNATURE_VERSION}:{timestamp}:".encode("utf-8"))
+    mac.update(get_raw_body(event))
+    expected = f"{SIGNATURE_VERSION}={mac.hexdigest()}"
+    return hmac.compare_digest(expected.encode("utf-8"), signature.encode("utf-8"))
 
-    return True
+
+def is_verified_request(event, body):
+    # 署名シークレットが設定されていれば署名を検証し、なければ従来のトークンで検証する
+    if os.environ.get("SLACK_SIGNING_SECRET"):
+        return is_valid_signature(event)
+    return is_verify_token(body)
 
 
 def is_app_mention(event):
     return event.get("event").get("type") == "app_mention"
 
 
+def is_direct_message(event):
+    return event.get("channel_type") == "im"
+
+
 # Slackリトライヘッダーが存在するか確認する関数
 def has_slack_retry_header(event):
     headers = event.get("headers", {})
     if "X-Slack-Retry-Num" in headers:
-        print(f"Retry header found: {headers['X-Slack-Retry-Num']}")
+        logger.info("Retry header found", retry_num=headers["X-Slack-Retry-Num"])
         return True
     return False
 
 
+def get_rate_limit_max_defer_seconds():
+    return float(
+        os.environ.get(
+            "RATE_LIMIT_MAX_DEFER_SECONDS", DEFAULT_RATE_LIMIT_MAX_DEFER_SECONDS
+        )
+    )
+
+
+def post_ephemeral(channel, user, message):
+    # 本人にだけ見えるメッセージで、流量制限にかかったことを伝える
+    try:
+        access_token = parameters.get_parameter(
+            os.environ["SLACK_BOT_USER_ACCESS_TOKEN"]
+        )
+        res = slack.get_slack_client().api_call(
+            "chat.postEphemeral",
+            {"channel": channel, "user": user, "text": message},
+            access_token,
+        )
+        if not res.ok:
+            logger.warning(
+                "Failed to post ephemeral message", status=res.status, response=res.data
+            )
+    except (ClientError, KeyError, OSError) as e:
+        logger.error("Failed to post ephemeral message", error=str(e))
+
+
 def main(event, context):
-    # リトライイベントを無視する
-    if has_slack_retry_header(event):
-        return {"statusCode": 200}
+    metrics = instrumentation.begin("api")
+    try:
+        with metrics.timer("Request"):
+            return handle_request(event)
+    finally:
+        metrics.flush()
 
-    # イベントの内容をログに出力
-    print("Received event:", event)
-    body = json.loads(event.get("body", "{}"))
-    text = body.get("event", {}).get("text", "")
+
+def ignore_event(reason):
+    # 対象外のイベントもすぐに200を返し、Slackに再送させない
+    logger.debug("Event ignored", reason=reason)
+    instrumentation.put_metric("IgnoredEvents", 1)
+    instrumentation.get_metrics().set_property("IgnoreReason", reason)
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"message": "Event ignored."}),
+    }
+
+
+def handle_request(event):
+    # リトライは一律に捨てず、下のevent_idによる重複排除で判定する
+    has_slack_retry_header(event)
+
+    raw_body = event.get("body", "{}")
+    instrumentation.put_metric("RequestBodyBytes", len(raw_body or ""), "Bytes")
+
+    # ワークスペース全体のイベントを購読していても、対象外のものは本文をパースせずに返す
+    reason = router.prefilter(raw_body or "")
+    if reason:
+        return ignore_event(reason)
+
+    # イベントの内容はDEBUGレベルでのみ出力する
+    logger.debug("Received event", event=event)
+    with instrumentation.timer("Parse"):
+        body = json.loads(raw_body)
 
     # Slackからのリクエストを解析
     if not body:
-        print("Body is not found.")
+        logger.warning("Body is not found.")
         return {
             "statusCode": 500,
             "headers": {"Content-Type": "text/plain"},
@@ -58,48 +206,149 @@ def main(event, context):
             "headers": {"Content-Type": "text/plain"},
             "body": body["challenge"],
         }
-    elif not text:
-        print("Text is not found.")
+
+    # イベントの種類ごとに登録したハンドラで処理する
+    handler, reason = router.resolve(body)
+    if handler is None:
+        return ignore_event(reason)
+    return handler(event, body)
+
+
+def handle_message(event, body):
+    # トークンが有効かどうかをチェック
+    with instrumentation.timer("Verify"):
+        verified = is_verified_request(event, body)
+    if not verified:
+        logger.warning("Invalid token.")
         return {
-            "statusCode": 500,
+            "statusCode": 403,
             "headers": {"Content-Type": "text/plain"},
-            "body": json.dumps({"message": "Text is not found."}),
+            "body": json.dumps({"message": "Invalid token."}),
         }
 
-    # Slackイベントがapp_mentionかどうかをチェック
-    if is_app_mention(body):
-        # トークンが有効かどうかをチェック
-        if not is_verify_token(body):
-            print("Invalid token.")
+    # 同じevent_idを受け付け済みなら何もしない(初回の配信が失敗していた場合だけ再送を処理する)
+    event_id = body.get("event_id")
+    store = idempotency.get_idempotency_store()
+    if event_id:
+        with instrumentation.timer("Idempotency"):
+            claimed = store.claim(
+                idempotency.make_event_key(event_id),
+                ttl_seconds=idempotency.get_event_claim_ttl(),
+            )
+        if not claimed:
+            logger.info("Duplicate event", event_id=event_id)
             return {
-                "statusCode": 403,
-                "headers": {"Content-Type": "text/plain"},
-                "body": json.dumps({"message": "Invalid token."}),
+                "statusCode": 200,
+                "body": json.dumps({"message": "Duplicate event."}),
             }
-    else:
-        print("Not an app mention.")
+
+    try:
+        return accept_message(body, event_id, store)
+    except Exception:
+        # 受け付けに失敗した場合は記録を消し、Slackの再送で処理し直せるようにする
+        if event_id:
+            store.release(idempotency.make_event_key(event_id))
+        raise
+
+
+def accept_message(body, event_id, store):
+    dispatcher = dispatch.get_dispatcher()
+
+    # ユーザーとチャンネルごとの流量制限(短い待ちで済む場合は先のトークンを予約し、SQSの遅延配信で後回しにする)
+    # (予約の合計が上限の待ち時間を超えたら断るため、連投されても後回しにできる件数は限られる)
+    user = body["event"].get("user")
+    channel = body["event"].get("channel")
+    max_wait = get_rate_limit_max_defer_seconds() if dispatcher.supports_delay else 0
+    with instrumentation.timer("RateLimit"):
+        allowed, wait = rate_limit.check(user, channel, max_wait=max_wait)
+    if not allowed:
+        instrumentation.put_metric("RateLimited", 1)
+        logger.info("Request rate limited", user=user, channel=channel)
+        post_ephemeral(
+            channel,
+            user,
+            RATE_LIMITED_MESSAGE.format(seconds=math.ceil(wait)),
+        )
+        # Slackのリトライで再び制限にかからないよう、受け付け済みとして記録する
+        if event_id:
+            store.complete(idempotency.make_event_key(event_id))
         return {
-            "statusCode": 400,
-            "headers": {"Content-Type": "text/plain"},
-            "body": json.dumps({"message": "Not an app mention."}),
+            "statusCode": 200,
+            "body": json.dumps({"message": "Rate limited."}),
         }
+    delay_seconds = math.ceil(wait)
+    if delay_seconds:
+        instrumentation.put_metric("RateLimitDeferred", 1)
+        logger.info(
+            "Request deferred",
+            user=user,
+            channel=channel,
+            delay_seconds=delay_seconds,
+        )
+        post_ephemeral(channel, user, DEFERRED_MESSAGE)
 
-    # SQSにbodyを送信
-    sqs = boto3.client("sqs")
-    queue_url = os.environ["SQS_QUEUE_URL"]
-
+    # ワーカーへbodyを送信(既定はSQS、DISPATCH_MODE=lambdaの場合は非同期で直接起動)
+    # (ワーカーが使うフィールドだけに絞り、キューへ送るバイト数を減らす)
+    message = enqueue.slim_body(body)
     try:
-        response = sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(body))
-        print(f"Message sent to SQS: {response['MessageId']}")
-    except ClientError as e:
-        print(f"Failed to send message to SQS: {e}")
+        with instrumentation.timer("Dispatch"):
+            if delay_seconds:
+                message_id = dispatcher.dispatch(message, delay_seconds=delay_seconds)
+            else:
+                message_id = dispatcher.dispatch(message)
+        logger.info(
+            "Message dispatched",
+            dispatch_mode=dispatch.get_dispatch_mode(),
+            message_id=message_id,
+            event_id=event_id,
+            event_ts=body["event"].get("event_ts"),
+        )
+    except Exception as e:
+        # BotoCoreErrorなどの接続エラーも含め、送信に失敗したらSlackに再送させる
+        logger.error("Failed to dispatch message", error=str(e))
+        if event_id:
+            store.release(idempotency.make_event_key(event_id))
         return {
             "statusCode": 500,
             "headers": {"Content-Type": "text/plain"},
-            "body": json.dumps({"message": "Failed to send message to SQS."}),
+            "body": json.dumps({"message": "Failed to dispatch message."}),
         }
 
+    if event_id:
+        store.complete(idempotency.make_event_key(event_id))
+
     return {
         "statusCode": 200,
         "body": json.dumps({"message": "Request processed successfully"}),
     }
+
+
+# メンションとボットへのDMをワーカーへ送る
+router = event_router.EventRouter()
+router.register("app_mention", handle_message)
+router.register("message", handle_message, is_direct_message)
+
+
+def warm():
+    # SnapStartやプロビジョニング済み同時実行ではINITが最初のリクエストより前に終わるため、
+    # boto3の読み込み・クライアントの作成・SSMの取得をINITのうちに済ませておく
+    try:
+        names = [
+            os.environ[name]
+            for name in WARM_PARAMETER_ENV_NAMES
+            if os.environ.get(name)
+        ]
+        if names:
+            parameters.get_parameters(names)
+        if os.environ.get("SLACK_SIGNING_SECRET"):
+            get_signing_hmac()
+        dispatch.get_dispatcher()
+        idempotency.get_idempotency_store()
+        rate_limit.get_rate_limiter()
+    except Exception as e:
+        # 失敗しても最初のリクエストで改めて取得する
+        logger.warning("Failed to warm up", error=str(e))
+
+
+if is_warm_on_init_enabled():
+    warm()
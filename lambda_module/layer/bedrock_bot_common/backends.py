@@ -0,0 +1,179 @@
+import os
+import threading
+
+from bedrock_bot_common import clients, history, instrumentation, tokens
+
+FLOW = "flow"
+CONVERSE = "converse"
+
+DEFAULT_REGION = "us-east-1"
+DEFAULT_CONVERSE_MAX_TOKENS = 2048
+
+TEXT = "text"
+TRACE = "trace"
+
+
+def get_default_backend_name():
+    return os.environ.get("MODEL_BACKEND", FLOW).lower()
+
+
+def get_flow_region():
+    return os.environ.get("BEDROCK_FLOW_REGION", DEFAULT_REGION)
+
+
+def get_converse_region():
+    return os.environ.get("CONVERSE_REGION", DEFAULT_REGION)
+
+
+def get_converse_model_id():
+    return os.environ.get("CONVERSE_MODEL_ID", "")
+
+
+def get_converse_channels():
+    value = os.environ.get("CONVERSE_CHANNELS", "")
+    return frozenset(channel.strip() for channel in value.split(",") if channel.strip())
+
+
+def get_converse_max_prompt_tokens():
+    # この推定トークン数以下の質問はFlowを通さずにConverseで答える(0で無効)
+    return int(os.environ.get("CONVERSE_MAX_PROMPT_TOKENS", 0))
+
+
+class FlowBackend:
+    # Prompt Flow(bedrock-agent-runtimeのinvoke_flow)で回答を生成する
+    name = FLOW
+    metric_prefix = "Flow"
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_cache_scope(self, params):
+        return params["flow_identifier"], params["flow_alias_identifier"]
+
+    def invoke(self, params, turns, text, trace=False):
+        response = self.client.invoke_flow(
+            flowIdentifier=params["flow_identifier"],
+            flowAliasIdentifier=params["flow_alias_identifier"],
+            inputs=[
+                {
+                    "content": {"document": history.format_prompt(turns, text)},
+                    "nodeName": "FlowInputNode",
+                    "nodeOutputName": "document",
+                }
+            ],
+            enableTrace=trace,
+        )
+        return self._events(response["responseStream"])
+
+    def _events(self, stream):
+        for event in stream:
+            if "flowOutputEvent" in event:
+                yield TEXT, event["flowOutputEvent"]["content"]["document"]
+            elif "flowTraceEvent" in event:
+                yield TRACE, event["flowTraceEvent"]
+            else:
+                yield None, event
+
+
+class ConverseBackend:
+    # bedrock-runtimeのconverse_streamでモデルを直接呼び出す
+    # (Flowの実行のオーバーヘッドがないため、単純な質問は最初のトークンが早く届く)
+    name = CONVERSE
+    metric_prefix = "Converse"
+
+    def __init__(self, client, model_id, max_tokens=None, system_prompt=None):
+        if not model_id:
+            raise ValueError("CONVERSE_MODEL_ID is not set")
+        self.client = client
+        self.model_id = model_id
+        self.max_tokens = max_tokens or DEFAULT_CONVERSE_MAX_TOKENS
+        self.system_prompt = system_prompt
+
+    def get_cache_scope(self, params):
+        return CONVERSE, self.model_id
+
+    def make_messages(self, turns, text):
+        # 会話履歴はConverseのmessagesとして渡す(userとassistantが交互になるよう連続する発言はまとめる)
+        messages = []
+        for role, turn_text in [*turns, [history.ROLE_USER, text]]:
+            role = "user" if role == history.ROLE_USER else "assistant"
+            if messages and messages[-1]["role"] == role:
+                messages[-1]["content"][0]["text"] += f"\n\n{turn_text}"
+            elif messages or role == "user":
+                messages.append({"role": role, "content": [{"text": turn_text}]})
+        return messages
+
+    def invoke(self, params, turns, text, trace=False):
+        request = {
+            "modelId": self.model_id,
+            "messages": self.make_messages(turns, text),
+            "inferenceConfig": {"maxTokens": self.max_tokens},
+        }
+        if self.system_prompt:
+            request["system"] = [{"text": self.system_prompt}]
+        response = self.client.converse_stream(**request)
+        return self._events(response["stream"])
+
+    def _events(self, stream):
+        text = ""
+        for event in stream:
+            if "contentBlockDelta" in event:
+                text += event["contentBlockDelta"]["delta"].get("text", "")
+                yield TEXT, text
+                continue
+            if "metadata" in event:
+                usage = event["metadata"].get("usage", {})
+                instrumentation.put_metric("InputTokens", usage.get("inputTokens", 0))
+                instrumentation.put_metric("OutputTokens", usage.get("outputTokens", 0))
+            yield None, event
+
+
+def select_backend_name(channel, text):
+    # チャンネルの指定を優先し、次に質問の長さで選ぶ
+    if channel in get_converse_channels():
+        return CONVERSE
+    max_prompt_tokens = get_converse_max_prompt_tokens()
+    if max_prompt_tokens and tokens.estimate_tokens(text) <= max_prompt_tokens:
+        return CONVERSE
+    return get_default_backend_name()
+
+
+_backends = {}
+_lock = threading.Lock()
+
+
+def create_backend(name):
+    if name == CONVERSE:
+        return ConverseBackend(
+            clients.get_client("bedrock-runtime", region_name=get_converse_region()),
+            get_converse_model_id(),
+            int(os.environ.get("CONVERSE_MAX_TOKENS", DEFAULT_CONVERSE_MAX_TOKENS)),
+            os.environ.get("CONVERSE_SYSTEM_PROMPT") or None,
+        )
+    if name == FLOW:
+        return FlowBackend(
+            clients.get_client("bedrock-agent-runtime", region_name=get_flow_region())
+        )
+    raise ValueError(f"Unknown model backend: {name}")
+
+
+def get_backend(name):
+    backend = _backends.get(name)
+    if backend is None:
+        with _lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = create_backend(name)
+                _backends[name] = backend
+    return backend
+
+
+def set_backend(name, backend):
+    # テストやローカル実行で別の実装(FakeBackendなど)を差し込む
+    with _lock:
+        _backends[name] = backend
+
+
+def reset():
+    with _lock:
+        _backends.clear()
@@ -0,0 +1,148 @@
+# Slackのsectionブロックのテキスト上限(chat.postMessageのtextはこれより長くてもよいが、
+# 4,000文字を超えると読みにくく、40,000文字で切り捨てられる)
+DEFAULT_LIMIT = 3000
+
+FENCE = "```"
+
+
+def is_fence(line):
+    return line.lstrip().startswith(FENCE)
+
+
+def split_segments(text):
+    # コードブロックの外の空行で段落に分け、コードブロックは1つのまとまりとして扱う
+    segments = []
+    current = []
+    in_code = False
+    for line in text.split("\n"):
+        if is_fence(line):
+            if not in_code:
+                if current:
+                    segments.append(("\n".join(current), False))
+                current = [line]
+                in_code = True
+            else:
+                current.append(line)
+                segments.append(("\n".join(current), True))
+                current = []
+                in_code = False
+        elif in_code:
+            current.append(line)
+        elif not line.strip():
+            if current:
+                segments.append(("\n".join(current), False))
+            current = []
+        else:
+            current.append(line)
+    if current:
+        segments.append(("\n".join(current), in_code))
+    return segments
+
+
+def hard_split(line, limit):
+    # 1行が上限を超える場合は空白で、空白がなければ上限の位置で切る
+    while len(line) > limit:
+        cut = line.rfind(" ", 0, limit + 1)
+        if cut <= limit // 2:
+            cut = limit
+        yield line[:cut]
+        line = line[cut:].lstrip(" ")
+    if line:
+        yield line
+
+
+def pack_lines(lines, limit):
+    current = None
+    for line in lines:
+        for piece in hard_split(line, limit) if line else [line]:
+            candidate = piece if current is None else f"{current}\n{piece}"
+            if len(candidate) <= limit:
+                current = candidate
+            else:
+                yield current
+                current = piece
+    if current:
+        yield current
+
+
+def split_segment(text, is_code, limit):
+    if len(text) <= limit:
+        yield text
+        return
+    lines = text.split("\n")
+    if not is_code:
+        yield from pack_lines(lines, limit)
+        return
+    # 長いコードブロックは行単位で分け、各チャンクでフェンスを閉じて開き直す
+    opener = lines[0].strip()
+    closed = len(lines) > 1 and is_fence(lines[-1])
+    body = lines[1:-1] if closed else lines[1:]
+    budget = max(1, limit - len(opener) - len(FENCE) - 2)
+    for piece in pack_lines(body, budget):
+        yield f"{opener}\n{piece}\n{FENCE}"
+
+
+def split_text(text, limit=DEFAULT_LIMIT):
+    # 段落とコードブロックの境界で、limit文字以下のチャンクに分ける
+    chunks = []
+    current = ""
+    for segment, is_code in split_segments(text or ""):
+        for piece in split_segment(segment, is_code, limit):
+            candidate = f"{current}\n\n{piece}" if current else piece
+            if len(candidate) <= limit:
+                current = candidate
+            else:
+                chunks.append(current)
+                current = piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def find_last_boundary(text):
+    # 確定した最後の段落の区切り(コードブロックの外の空行の直前の改行)の位置
+    # (最後の行はまだ途中の可能性があるため対象にしない)
+    in_code = False
+    boundary = -1
+    offset = 0
+    for line in text.split("\n")[:-1]:
+        if is_fence(line):
+            in_code = not in_code
+        elif not in_code and not line.strip() and offset > 0:
+            boundary = offset - 1
+        offset += len(line) + 1
+    return boundary
+
+
+class MessageChunker:
+    # ストリームで届くテキストを受け取り、確定したチャンクから順に返す
+    # (最後のチャンクは次の段落とまとめられる可能性があるため、finishまで保持する)
+
+    def __init__(self, limit=DEFAULT_LIMIT):
+        self.limit = limit
+        self._buffer = ""
+
+    @property
+    def pending(self):
+        return self._buffer
+
+    def feed(self, text):
+        self._buffer += text
+        boundary = find_last_boundary(self._buffer)
+        if boundary <= 0:
+            return []
+        chunks = split_text(self._buffer[:boundary], self.limit)
+        if len(chunks) < 2:
+            return []
+        self._buffer = chunks[-1] + self._buffer[boundary:]
+        return chunks[:-1]
+
+    def finish(self):
+        chunks = split_text(self._buffer, self.limit)
+        self._buffer = ""
+        return chunks
+
+
+def make_blocks(text):
+    # Block Kitで送る場合のsectionブロック(textは通知やプレビューのフォールバックに使われる)
+    return [{"type": "section", "text": {"type": "mrkdwn", "text": text}}]
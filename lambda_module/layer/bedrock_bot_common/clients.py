@@ -0,0 +1,67 @@
+import os
+import threading
+
+# コンテナ内で使い回すboto3クライアント
+# (boto3の読み込みには数百ミリ秒かかるため、最初にクライアントを作るときまで遅らせる)
+_clients = {}
+_lock = threading.Lock()
+
+DEFAULT_MAX_POOL_CONNECTIONS = 20
+
+# サービスごとの追加設定(ストリーミング応答は読み取りタイムアウトを長めにする)
+# (Bedrockの再試行はretry.Retrierが予算と回路の状態を見て行うため、botocoreでは再試行しない)
+SERVICE_CONFIG = {
+    "bedrock-agent-runtime": {
+        "read_timeout": 300,
+        "retries": {"mode": "standard", "max_attempts": 1},
+    },
+    "bedrock-runtime": {
+        "read_timeout": 300,
+        "retries": {"mode": "standard", "max_attempts": 1},
+    },
+}
+
+
+def get_config(service_name):
+    from botocore.config import Config
+
+    options = {
+        "max_pool_connections": int(
+            os.environ.get("BOTO_MAX_POOL_CONNECTIONS", DEFAULT_MAX_POOL_CONNECTIONS)
+        ),
+        "tcp_keepalive": True,
+        "connect_timeout": 5,
+        "retries": {"mode": "standard", "max_attempts": 3},
+    }
+    options.update(SERVICE_CONFIG.get(service_name, {}))
+    return Config(**options)
+
+
+def get_client(service_name, region_name=None):
+    # 初回呼び出し時にだけクライアントを作成する(スレッドセーフ)
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                import boto3
+
+                client = boto3.client(
+                    service_name,
+                    region_name=region_name,
+                    config=get_config(service_name),
+                )
+                _clients[key] = client
+    return client
+
+
+def set_client(service_name, client, region_name=None):
+    # ローカルの代替実装(負荷試験のスタブなど)を差し込む
+    with _lock:
+        _clients[(service_name, region_name)] = client
+
+
+def reset():
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,156 @@
+import json
+import os
+import uuid
+
+from bedrock_bot_common import clients, enqueue
+
+DISPATCH_MODE_SQS = "sqs"
+DISPATCH_MODE_LAMBDA = "lambda"
+
+# SQSを経由せずに直接起動したレコードの識別子
+DIRECT_EVENT_SOURCE = "bedrock-bot:direct"
+
+# SQSのDelaySecondsの上限
+MAX_DELAY_SECONDS = 900
+
+
+def build_worker_event(bodies, event_source=DIRECT_EVENT_SOURCE):
+    # ワーカーはSQSイベントと同じ形のペイロードを受け取る
+    return {
+        "Records": [
+            {
+                "messageId": str(uuid.uuid4()),
+                "eventSource": event_source,
+                "body": enqueue.encode_message(body),
+            }
+            for body in bodies
+        ]
+    }
+
+
+def parse_channels(value):
+    return frozenset(c.strip() for c in (value or "").split(",") if c.strip())
+
+
+def get_priority_channels():
+    # 優先キューへ振り分けるチャンネル(カンマ区切り)
+    return parse_channels(os.environ.get("PRIORITY_CHANNELS", ""))
+
+
+def get_channel(body):
+    return (body.get("event") or {}).get("channel")
+
+
+class SqsDispatcher:
+    # 優先チャンネルのメッセージは別のキュー(別のワーカー枠)へ送り、
+    # 他のチャンネルが混雑していても待たされないようにする
+    supports_delay = True
+
+    def __init__(
+        self, queue_url, client=None, priority_queue_url=None, priority_channels=()
+    ):
+        self.queue_url = queue_url
+        self.client = client or clients.get_client("sqs")
+        self.priority_queue_url = priority_queue_url
+        self.priority_channels = frozenset(priority_channels)
+
+    def is_priority(self, body):
+        return bool(self.priority_queue_url) and (
+            get_channel(body) in self.priority_channels
+        )
+
+    def get_queue_url(self, body):
+        return self.priority_queue_url if self.is_priority(body) else self.queue_url
+
+    def dispatch(self, body, delay_seconds=0):
+        kwargs = {}
+        if delay_seconds:
+            kwargs["DelaySeconds"] = min(int(delay_seconds), MAX_DELAY_SECONDS)
+        response = self.client.send_message(
+            QueueUrl=self.get_queue_url(body),
+            MessageBody=enqueue.encode_message(body),
+            **kwargs,
+        )
+        return response["MessageId"]
+
+    def dispatch_batch(self, bodies, delay_seconds=0):
+        # キューごとにsend_message_batchでまとめて送る(送れなかったものはNone)
+        delay_seconds = min(int(delay_seconds), MAX_DELAY_SECONDS)
+        indexes = {}
+        for index, body in enumerate(bodies):
+            indexes.setdefault(self.get_queue_url(body), []).append(index)
+        message_ids = [None] * len(bodies)
+        for queue_url, queue_indexes in indexes.items():
+            sent = enqueue.send_batch(
+                self.client,
+                queue_url,
+                [enqueue.encode_message(bodies[index]) for index in queue_indexes],
+                delay_seconds,
+            )
+            for index, message_id in zip(queue_indexes, sent):
+                message_ids[index] = message_id
+        return message_ids
+
+
+class LambdaDispatcher:
+    # ワーカーLambdaを非同期(InvocationType=Event)で直接起動する
+    # (起動を遅らせることはできない)
+    supports_delay = False
+
+    def __init__(self, function_name, client=None):
+        self.function_name = function_name
+        self.client = client or clients.get_client("lambda")
+
+    def dispatch(self, body):
+        return self.dispatch_batch([body])[0]
+
+    def dispatch_batch(self, bodies):
+        # SQSのバッチと同じ件数ずつ、1回の起動で複数のレコードを渡す
+        message_ids = []
+        for i in range(0, len(bodies), enqueue.MAX_BATCH_ENTRIES):
+            event = build_worker_event(bodies[i : i + enqueue.MAX_BATCH_ENTRIES])
+            self.client.invoke(
+                FunctionName=self.function_name,
+                InvocationType="Event",
+                Payload=json.dumps(event).encode("utf-8"),
+            )
+            message_ids.extend(record["messageId"] for record in event["Records"])
+        return message_ids
+
+
+class LocalDispatcher:
+    # テストやローカル実行用: ワーカーのハンドラを同じプロセスで呼び出す
+
+    def __init__(self, worker, mode=DISPATCH_MODE_SQS):
+        self.worker = worker
+        self.mode = mode
+        self.supports_delay = mode == DISPATCH_MODE_SQS
+        self.results = []
+        self.delays = []
+
+    def dispatch(self, body, delay_seconds=0):
+        return self.dispatch_batch([body], delay_seconds)[0]
+
+    def dispatch_batch(self, bodies, delay_seconds=0):
+        self.delays.append(delay_seconds)
+        event_source = "aws:sqs" if self.mode == DISPATCH_MODE_SQS else None
+        event = build_worker_event(bodies, event_source or DIRECT_EVENT_SOURCE)
+        self.results.append(self.worker(event, None))
+        return [record["messageId"] for record in event["Records"]]
+
+
+def get_dispatch_mode():
+    return os.environ.get("DISPATCH_MODE", DISPATCH_MODE_SQS).lower()
+
+
+def get_dispatcher():
+    mode = get_dispatch_mode()
+    if mode == DISPATCH_MODE_LAMBDA:
+        return LambdaDispatcher(os.environ["WORKER_FUNCTION_NAME"])
+    if mode == DISPATCH_MODE_SQS:
+        return SqsDispatcher(
+            os.environ["SQS_QUEUE_URL"],
+            priority_queue_url=os.environ.get("SQS_PRIORITY_QUEUE_URL"),
+            priority_channels=get_priority_channels(),
+        )
+    raise ValueError(f"Unknown dispatch mode: {mode}")
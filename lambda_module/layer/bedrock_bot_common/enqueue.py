@@ -0,0 +1,93 @@
+import base64
+import json
+import os
+import zlib
+
+# ワーカーが使うイベントのフィールド(blocksやauthorizationsなどはキューに送らない)
+WORKER_EVENT_FIELDS = (
+    "type",
+    "user",
+    "text",
+    "channel",
+    "channel_type",
+    "thread_ts",
+    "event_ts",
+)
+
+COMPRESSED_ENCODING = "zlib+base64"
+
+# これより大きいメッセージは圧縮して送る(0で無効)
+DEFAULT_COMPRESS_THRESHOLD_BYTES = 16 * 1024
+
+# send_message_batchの1回あたりの上限(件数と合計バイト数)
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+
+
+def get_compress_threshold():
+    return int(
+        os.environ.get(
+            "ENQUEUE_COMPRESS_THRESHOLD_BYTES", DEFAULT_COMPRESS_THRESHOLD_BYTES
+        )
+    )
+
+
+def slim_body(body):
+    # Slackのイベント本文をワーカーが使うフィールドだけにする
+    event = body.get("event") or {}
+    slim = {
+        "event": {
+            key: event[key] for key in WORKER_EVENT_FIELDS if event.get(key) is not None
+        }
+    }
+    if body.get("event_id"):
+        slim["event_id"] = body["event_id"]
+    return slim
+
+
+def encode_message(body, threshold=None):
+    message = json.dumps(body, ensure_ascii=False, separators=(",", ":"))
+    threshold = get_compress_threshold() if threshold is None else threshold
+    if not threshold or len(message.encode("utf-8")) <= threshold:
+        return message
+    data = base64.b64encode(zlib.compress(message.encode("utf-8"))).decode("ascii")
+    return json.dumps({"encoding": COMPRESSED_ENCODING, "data": data})
+
+
+def decode_message(message):
+    body = json.loads(message)
+    if body.get("encoding") == COMPRESSED_ENCODING:
+        return json.loads(zlib.decompress(base64.b64decode(body["data"])))
+    return body
+
+
+def make_batches(messages, max_entries=MAX_BATCH_ENTRIES, max_bytes=MAX_BATCH_BYTES):
+    # (インデックス, メッセージ)を件数とバイト数の上限に収まるようにまとめる
+    batch = []
+    size = 0
+    for index, message in enumerate(messages):
+        message_size = len(message.encode("utf-8"))
+        if batch and (len(batch) >= max_entries or size + message_size > max_bytes):
+            yield batch
+            batch = []
+            size = 0
+        batch.append((index, message))
+        size += message_size
+    if batch:
+        yield batch
+
+
+def send_batch(client, queue_url, messages, delay_seconds=0):
+    # メッセージをsend_message_batchでまとめて送り、送れたもののMessageIdを返す(失敗はNone)
+    message_ids = [None] * len(messages)
+    for batch in make_batches(messages):
+        entries = []
+        for index, message in batch:
+            entry = {"Id": str(index), "MessageBody": message}
+            if delay_seconds:
+                entry["DelaySeconds"] = delay_seconds
+            entries.append(entry)
+        response = client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        for result in response.get("Successful", []):
+            message_ids[int(result["Id"])] = result["MessageId"]
+    return message_ids
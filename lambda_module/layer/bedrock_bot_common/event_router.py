@@ -0,0 +1,71 @@
+import os
+import re
+
+# 本文をパースする前に、生のJSONから判定に使う値だけを取り出す
+# (文字列の値の中の"はエスケープされるため、キーと誤って一致することはない)
+TYPE_PATTERN = re.compile(r'"type"\s*:\s*"([a-z_]+)"')
+SUBTYPE_PATTERN = re.compile(r'"subtype"\s*:\s*"([a-z_]+)"')
+BOT_ID_PATTERN = re.compile(r'"bot_id"\s*:\s*"')
+
+# 人が投稿したメッセージとして扱うサブタイプ(編集・削除・参加などは無視する)
+ALLOWED_SUBTYPES = frozenset(["thread_broadcast", "file_share"])
+
+URL_VERIFICATION = "url_verification"
+
+
+def get_bot_user_id():
+    # ボット自身のユーザーID(指定した場合は、ボットの投稿を本文をパースせずに無視する)
+    return os.environ.get("SLACK_BOT_USER_ID", "")
+
+
+class EventRouter:
+    # イベントの種類ごとに登録したハンドラを呼び出し、対象外のイベントは理由を返す
+
+    def __init__(self):
+        self._routes = {}
+
+    @property
+    def event_types(self):
+        return frozenset(self._routes)
+
+    def register(self, event_type, handler, predicate=None):
+        self._routes.setdefault(event_type, []).append((predicate, handler))
+
+    def prefilter(self, raw_body, bot_user_id=None):
+        # 生の本文だけで明らかに対象外と分かるイベントの理由(パースが必要ならNone)
+        types = set(TYPE_PATTERN.findall(raw_body))
+        # 形式が分からない本文とURL検証はパースして判定する
+        if not types or URL_VERIFICATION in types:
+            return None
+        if not types & self.event_types:
+            return "event_type"
+        if BOT_ID_PATTERN.search(raw_body):
+            return "bot"
+        if any(
+            subtype not in ALLOWED_SUBTYPES
+            for subtype in SUBTYPE_PATTERN.findall(raw_body)
+        ):
+            return "subtype"
+        bot_user_id = get_bot_user_id() if bot_user_id is None else bot_user_id
+        if bot_user_id and re.search(
+            rf'"user"\s*:\s*"{re.escape(bot_user_id)}"', raw_body
+        ):
+            return "self"
+        return None
+
+    def resolve(self, body, bot_user_id=None):
+        # パースした本文からハンドラを選ぶ(対象外なら(None, 理由))
+        event = body.get("event") or {}
+        if event.get("bot_id"):
+            return None, "bot"
+        if event.get("subtype") and event["subtype"] not in ALLOWED_SUBTYPES:
+            return None, "subtype"
+        bot_user_id = get_bot_user_id() if bot_user_id is None else bot_user_id
+        if bot_user_id and event.get("user") == bot_user_id:
+            return None, "self"
+        for predicate, handler in self._routes.get(event.get("type"), []):
+            if predicate is None or predicate(event):
+                if not event.get("text"):
+                    return None, "no_text"
+                return handler, None
+        return None, "event_type"
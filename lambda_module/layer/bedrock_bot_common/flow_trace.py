@@ -0,0 +1,150 @@
+import datetime
+import json
+import os
+import random
+import time
+
+from bedrock_bot_common import instrumentation, tokens
+
+# トレースを有効にする呼び出しの割合(0で無効、1で全件)
+DEFAULT_SAMPLE_RATE = 0.0
+
+TRACE_KINDS = (("nodeInputTrace", "input"), ("nodeOutputTrace", "output"))
+
+
+def get_sample_rate():
+    return float(os.environ.get("FLOW_TRACE_SAMPLE_RATE", DEFAULT_SAMPLE_RATE))
+
+
+def is_sampled(rate=None, rand=random.random):
+    rate = get_sample_rate() if rate is None else rate
+    return rate > 0 and rand() < rate
+
+
+def to_seconds(timestamp):
+    # boto3はtimestampをdatetimeで返すが、記録したイベントでは文字列や数値の場合もある
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp.timestamp()
+    if isinstance(timestamp, str):
+        try:
+            return datetime.datetime.fromisoformat(
+                timestamp.replace("Z", "+00:00")
+            ).timestamp()
+        except ValueError:
+            return None
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    return None
+
+
+def content_text(content):
+    document = (content or {}).get("document")
+    if document is None:
+        return ""
+    if isinstance(document, str):
+        return document
+    return json.dumps(document, ensure_ascii=False, default=str)
+
+
+class FlowTrace:
+    # flowTraceEventのノードの入力と出力を突き合わせ、ノードごとの所要時間とトークン数を集計する
+    # (timestampがないイベントは受け取った時刻で代用する)
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.started = clock()
+        self._nodes = {}
+
+    def add(self, trace_event):
+        trace = trace_event.get("trace", {})
+        for key, kind in TRACE_KINDS:
+            if key in trace:
+                self._record(trace[key], kind)
+
+    def _record(self, node_trace, kind):
+        name = node_trace.get("nodeName") or "unknown"
+        at = to_seconds(node_trace.get("timestamp"))
+        if at is None:
+            at = self.clock()
+        count = sum(
+            tokens.estimate_tokens(content_text(field.get("content")))
+            for field in node_trace.get("fields", [])
+        )
+        node = self._nodes.setdefault(
+            name,
+            {"started": None, "finished": None, "input_tokens": 0, "output_tokens": 0},
+        )
+        if kind == "input":
+            node["started"] = (
+                at if node["started"] is None else min(node["started"], at)
+            )
+            node["input_tokens"] += count
+        else:
+            node["finished"] = (
+                at if node["finished"] is None else max(node["finished"], at)
+            )
+            node["output_tokens"] += count
+
+    def summary(self):
+        nodes = []
+        for name, node in self._nodes.items():
+            started, finished = node["started"], node["finished"]
+            # 入力か出力の片方しかないノード(Flowの入力・出力ノード)は所要時間を持たない
+            duration_ms = (
+                round((finished - started) * 1000, 3)
+                if started is not None and finished is not None
+                else None
+            )
+            nodes.append(
+                {
+                    "node": name,
+                    "duration_ms": duration_ms,
+                    "input_tokens": node["input_tokens"],
+                    "output_tokens": node["output_tokens"],
+                    "_order": started if started is not None else finished,
+                }
+            )
+        nodes.sort(key=lambda node: node.pop("_order"))
+        return nodes
+
+    def emit(self, logger, metrics=None):
+        # 構造化ログにノードごとの内訳を出し、所要時間はNodeをディメンションにしたEMFで出す
+        metrics = metrics or instrumentation.get_metrics()
+        nodes = self.summary()
+        timed = [node for node in nodes if node["duration_ms"] is not None]
+        slowest = max(timed, key=lambda node: node["duration_ms"], default=None)
+        logger.info(
+            "Flow trace",
+            nodes=nodes,
+            slowest_node=slowest["node"] if slowest else None,
+        )
+        for node in timed:
+            metrics.emit(
+                json.dumps(node_emf(metrics, node), ensure_ascii=False, default=str)
+            )
+        metrics.put("FlowTraced", 1)
+        return nodes
+
+
+def node_emf(metrics, node, timestamp=None):
+    return {
+        "_aws": {
+            "Timestamp": int((timestamp or time.time()) * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": metrics.namespace,
+                    "Dimensions": [["Function", "Node"]],
+                    "Metrics": [
+                        {"Name": "NodeLatency", "Unit": "Milliseconds"},
+                        {"Name": "NodeInputTokens", "Unit": "Count"},
+                        {"Name": "NodeOutputTokens", "Unit": "Count"},
+                    ],
+                }
+            ],
+        },
+        "Function": metrics.function_name,
+        "Node": node["node"],
+        "NodeLatency": node["duration_ms"],
+        "NodeInputTokens": node["input_tokens"],
+        "NodeOutputTokens": node["output_tokens"],
+    }
@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+import zlib
+
+from botocore.exceptions import ClientError
+
+from bedrock_bot_common import clients, prompt, tokens
+
+ROLE_USER = "u"
+ROLE_ASSISTANT = "a"
+
+DEFAULT_MAX_TURNS = 20
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# 同じスレッドへの追記が競合したときに読み直して書き込む回数
+MAX_APPEND_ATTEMPTS = 5
+
+
+def make_conversation_key(channel, thread_ts):
+    return f"{channel}#{thread_ts}"
+
+
+def serialize(turns):
+    # [["u", "質問"], ["a", "回答"], ...] を区切り文字なしのJSONにしてzlibで圧縮する
+    return zlib.compress(
+        json.dumps(turns, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    )
+
+
+def deserialize(data):
+    if not data:
+        return []
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+def truncate(turns, token_budget, max_turns=DEFAULT_MAX_TURNS):
+    # 新しい発言から順に、トークン数の上限に収まるところまで残す
+    # (1つの発言は上限の半分までに切り詰め、長い回答の後でも直前のやり取りが残るようにする)
+    kept = []
+    used = 0
+    for role, text in reversed(turns[-max_turns:]):
+        text = prompt.truncate(text, token_budget // 2)
+        cost = tokens.estimate_tokens(text)
+        if used + cost > token_budget:
+            break
+        kept.append([role, text])
+        used += cost
+    kept.reverse()
+    return kept
+
+
+def format_prompt(turns, text):
+    if not turns:
+        return text
+    lines = [
+        f"{'User' if role == ROLE_USER else 'Assistant'}: {turn_text}"
+        for role, turn_text in turns
+    ]
+    return "これまでの会話:\n" + "\n".join(lines) + f"\n\n質問: {text}"
+
+
+class InMemoryHistoryStore:
+    # テストやテーブル未設定時のためのコンテナ内の履歴
+
+    def __init__(self, token_budget, max_turns=DEFAULT_MAX_TURNS):
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def load(self, channel, thread_ts):
+        with self._lock:
+            data = self._items.get(make_conversation_key(channel, thread_ts))
+        return deserialize(data)
+
+    def append(self, channel, thread_ts, new_turns):
+        key = make_conversation_key(channel, thread_ts)
+        with self._lock:
+            turns = deserialize(self._items.get(key)) + [list(t) for t in new_turns]
+            self._items[key] = serialize(
+                truncate(turns, self.token_budget, self.max_turns)
+            )
+
+
+class DynamoDBHistoryStore:
+    # スレッドごとに1項目だけを読み書きするため、メッセージあたりのI/Oは一定になる
+
+    def __init__(
+        self,
+        table_name,
+        token_budget,
+        max_turns=DEFAULT_MAX_TURNS,
+        ttl_seconds=DEFAULT_TTL_SECONDS,
+        client=None,
+        clock=time.time,
+    ):
+        self.table_name = table_name
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.ttl_seconds = ttl_seconds
+        self.client = client or clients.get_client("dynamodb")
+        self.clock = clock
+
+    def get_item(self, channel, thread_ts, consistent=False):
+        return self.client.get_item(
+            TableName=self.table_name,
+            Key={"conversation_key": {"S": make_conversation_key(channel, thread_ts)}},
+            ConsistentRead=consistent,
+        ).get("Item")
+
+    def get_turns(self, item):
+        if item is None or int(item["expires_at"]["N"]) <= self.clock():
+            return []
+        return deserialize(item["turns"]["B"])
+
+    def load(self, channel, thread_ts):
+        return self.get_turns(self.get_item(channel, thread_ts))
+
+    def append(self, channel, thread_ts, new_turns):
+        # 同じスレッドへの追記が並行しても発言が失われないよう、versionを条件に書き込み、
+        # 他の追記と競合したら読み直してやり直す
+        for attempt in range(MAX_APPEND_ATTEMPTS):
+            item = self.get_item(channel, thread_ts, consistent=True)
+            version = int(item["version"]["N"]) if item and "version" in item else 0
+            turns = self.get_turns(item) + [list(t) for t in new_turns]
+            if version:
+                condition = {
+                    "ConditionExpression": "version = :version",
+                    "ExpressionAttributeValues": {":version": {"N": str(version)}},
+                }
+            else:
+                condition = {"ConditionExpression": "attribute_not_exists(version)"}
+            try:
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        "conversation_key": {
+                            "S": make_conversation_key(channel, thread_ts)
+                        },
+                        "turns": {
+                            "B": serialize(
+                                truncate(turns, self.token_budget, self.max_turns)
+                            )
+                        },
+                        "version": {"N": str(version + 1)},
+                        "expires_at": {"N": str(int(self.clock() + self.ttl_seconds))},
+                    },
+                    **condition,
+                )
+                return
+            except ClientError as e:
+                if (
+                    e.response["Error"]["Code"] != "ConditionalCheckFailedException"
+                    or attempt + 1 >= MAX_APPEND_ATTEMPTS
+                ):
+                    raise
+
+
+def get_token_budget():
+    return int(os.environ.get("HISTORY_TOKEN_BUDGET", 0))
+
+
+def is_enabled():
+    return get_token_budget() > 0
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                table_name = os.environ.get("HISTORY_TABLE")
+                max_turns = int(os.environ.get("HISTORY_MAX_TURNS", DEFAULT_MAX_TURNS))
+                _store = (
+                    DynamoDBHistoryStore(
+                        table_name,
+                        get_token_budget(),
+                        max_turns,
+                        int(os.environ.get("HISTORY_TTL", DEFAULT_TTL_SECONDS)),
+                    )
+                    if table_name
+                    else InMemoryHistoryStore(get_token_budget(), max_turns)
+                )
+    return _store
+
+
+def reset():
+    global _store
+    with _store_lock:
+        _store = None
@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from bedrock_bot_common import clients
+
+STATUS_IN_PROGRESS = "IN_PROGRESS"
+STATUS_COMPLETED = "COMPLETED"
+# 処理に失敗して受け付けを取り消した記録(投稿できなかった回答を次の受け付けに渡す)
+STATUS_RELEASED = "RELEASED"
+
+# 処理中のまま落ちた場合に再処理できるよう、処理中の記録は短めに保持する
+DEFAULT_IN_PROGRESS_TTL_SECONDS = 300
+DEFAULT_COMPLETED_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_PENDING_ANSWER_TTL_SECONDS = 24 * 60 * 60
+
+# APIがevent_idを受け付け中として記録する時間(秒)
+# (API Lambdaがタイムアウトで落ちても、Slackの再送を処理できるようタイムアウトと同程度にする)
+DEFAULT_EVENT_CLAIM_TTL_SECONDS = 10
+
+
+class InMemoryIdempotencyStore:
+    # テストやテーブル未設定時のためのコンテナ内の記録
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key, ttl_seconds=DEFAULT_IN_PROGRESS_TTL_SECONDS):
+        return self.claim_with_pending(key, ttl_seconds)[0]
+
+    def claim_with_pending(self, key, ttl_seconds=DEFAULT_IN_PROGRESS_TTL_SECONDS):
+        now = self.clock()
+        with self._lock:
+            record = self._records.get(key)
+            if record is None or record[1] <= now:
+                pending_answer = None
+            elif record[0] == STATUS_RELEASED:
+                pending_answer = record[2]
+            else:
+                return False, None
+            self._records[key] = (STATUS_IN_PROGRESS, now + ttl_seconds, None)
+            return True, pending_answer
+
+    def complete(self, key, ttl_seconds=DEFAULT_COMPLETED_TTL_SECONDS):
+        with self._lock:
+            self._records[key] = (STATUS_COMPLETED, self.clock() + ttl_seconds, None)
+
+    def release(
+        self,
+        key,
+        pending_answer=None,
+        ttl_seconds=DEFAULT_PENDING_ANSWER_TTL_SECONDS,
+    ):
+        with self._lock:
+            if pending_answer is None:
+                self._records.pop(key, None)
+            else:
+                self._records[key] = (
+                    STATUS_RELEASED,
+                    self.clock() + ttl_seconds,
+                    pending_answer,
+                )
+
+
+class DynamoDBIdempotencyStore:
+    # 条件付き書き込みで、同じキーを最初に記録した呼び出しだけが処理を進める
+
+    def __init__(self, table_name, client=None, clock=time.time):
+        self.table_name = table_name
+        self.client = client or clients.get_client("dynamodb")
+        self.clock = clock
+
+    def claim(self, key, ttl_seconds=DEFAULT_IN_PROGRESS_TTL_SECONDS):
+        return self.claim_with_pending(key, ttl_seconds)[0]
+
+    def claim_with_pending(self, key, ttl_seconds=DEFAULT_IN_PROGRESS_TTL_SECONDS):
+        # 上書き前の記録を返させ、取り消された記録に残っていた回答を読み取りなしで受け取る
+        now = int(self.clock())
+        try:
+            old = self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "idempotency_key": {"S": key},
+                    "status": {"S": STATUS_IN_PROGRESS},
+                    "expires_at": {"N": str(now + ttl_seconds)},
+                },
+                # TTLによる削除は遅れるため、期限切れの記録は上書きを許可する
+                ConditionExpression=(
+                    "attribute_not_exists(idempotency_key) OR expires_at < :now"
+                    " OR #status = :released"
+                ),
+                ExpressionAttributeNames={"#status": "status"},
+                ExpressionAttributeValues={
+                    ":now": {"N": str(now)},
+                    ":released": {"S": STATUS_RELEASED},
+                },
+                ReturnValues="ALL_OLD",
+            ).get("Attributes", {})
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False, None
+            raise
+        if int(old.get("expires_at", {}).get("N", 0)) < now:
+            return True, None
+        return True, old.get("pending_answer", {}).get("S")
+
+    def complete(self, key, ttl_seconds=DEFAULT_COMPLETED_TTL_SECONDS):
+        self.client.update_item(
+            TableName=self.table_name,
+            Key={"idempotency_key": {"S": key}},
+            UpdateExpression="SET #status = :status, expires_at = :expires_at",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={
+                ":status": {"S": STATUS_COMPLETED},
+                ":expires_at": {"N": str(int(self.clock()) + ttl_seconds)},
+            },
+        )
+
+    def release(
+        self,
+        key,
+        pending_answer=None,
+        ttl_seconds=DEFAULT_PENDING_ANSWER_TTL_SECONDS,
+    ):
+        if pending_answer is None:
+            self.client.delete_item(
+                TableName=self.table_name, Key={"idempotency_key": {"S": key}}
+            )
+            return
+        # 記録を消す代わりに回答を残し、次に受け付けた呼び出しが投稿だけをやり直す
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "idempotency_key": {"S": key},
+                "status": {"S": STATUS_RELEASED},
+                "expires_at": {"N": str(int(self.clock()) + ttl_seconds)},
+                "pending_answer": {"S": pending_answer},
+            },
+        )
+
+
+def get_event_claim_ttl():
+    return int(
+        os.environ.get("EVENT_CLAIM_TTL_SECONDS", DEFAULT_EVENT_CLAIM_TTL_SECONDS)
+    )
+
+
+def make_event_key(event_id):
+    return f"event:{event_id}"
+
+
+def make_flow_key(channel, event_ts):
+    return f"flow:{channel}:{event_ts}"
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_idempotency_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                table_name = os.environ.get("IDEMPOTENCY_TABLE")
+                _store = (
+                    DynamoDBIdempotencyStore(table_name)
+                    if table_name
+                    else InMemoryIdempotencyStore()
+                )
+    return _store
+
+
+def reset():
+    global _store
+    with _store_lock:
+        _store = None
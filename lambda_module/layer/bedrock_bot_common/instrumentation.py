@@ -0,0 +1,187 @@
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+DEFAULT_NAMESPACE = "BedrockSlackBot"
+
+# 構造化ログ(JSON 1行)の出力先となるロガー
+LOGGER_NAME = "bedrock_bot"
+
+# LoggerAdapterに渡すキーワードのうち、loggingがそのまま解釈するもの
+_LOGGING_KWARGS = ("exc_info", "stack_info", "stacklevel", "extra")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "timestamp": int(record.created * 1000),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class StdoutHandler(logging.Handler):
+    # 出力時点のsys.stdoutに書く(テストではcapsysで差し替えた出力を検証できる)
+
+    def emit(self, record):
+        try:
+            sys.stdout.write(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    # logger.info("message", key=value) の追加のキーワードをJSONの項目として出力する
+
+    def process(self, msg, kwargs):
+        fields = {
+            key: kwargs.pop(key) for key in list(kwargs) if key not in _LOGGING_KWARGS
+        }
+        kwargs["extra"] = {**kwargs.get("extra", {}), "fields": fields}
+        return msg, kwargs
+
+
+_configure_lock = threading.Lock()
+_configured = False
+
+
+def configure_logging(level=None):
+    global _configured
+    with _configure_lock:
+        logger = logging.getLogger(LOGGER_NAME)
+        if not _configured:
+            handler = StdoutHandler()
+            handler.setFormatter(JsonFormatter())
+            logger.addHandler(handler)
+            # Lambdaランタイムがrootに付けるハンドラーで二重に出力しない
+            logger.propagate = False
+            _configured = True
+        logger.setLevel(level or os.environ.get("LOG_LEVEL", "INFO").upper())
+        return logger
+
+
+def get_logger(name):
+    if not _configured:
+        configure_logging()
+    return StructuredLogger(logging.getLogger(f"{LOGGER_NAME}.{name}"), {})
+
+
+# CloudWatch Embedded Metric Format (EMF)の行は標準出力に書くとメトリクスになる
+def write_stdout(line):
+    sys.stdout.write(line + "\n")
+
+
+class Metrics:
+    # 1回の呼び出しの中で計測した値をまとめ、EMFの1行として出力する
+    # (同じ名前の値は配列として出力され、CloudWatch側でp50/p99を集計できる)
+
+    def __init__(
+        self, function_name, namespace=None, emit=None, clock=time.perf_counter
+    ):
+        self.function_name = function_name
+        self.namespace = namespace or os.environ.get(
+            "METRICS_NAMESPACE", DEFAULT_NAMESPACE
+        )
+        self.emit = emit or write_stdout
+        self.clock = clock
+        self._values = {}
+        self._units = {}
+        self._properties = {}
+        self._lock = threading.Lock()
+
+    def put(self, name, value, unit="Count"):
+        with self._lock:
+            self._values.setdefault(name, []).append(value)
+            self._units[name] = unit
+
+    def set_property(self, name, value):
+        with self._lock:
+            self._properties[name] = value
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        # 例外で抜けた場合も所要時間を記録する
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.put(f"{stage}Latency", (self.clock() - start) * 1000, "Milliseconds")
+
+    def values(self, name):
+        with self._lock:
+            return list(self._values.get(name, []))
+
+    def to_emf(self, timestamp=None):
+        with self._lock:
+            document = {
+                "_aws": {
+                    "Timestamp": int((timestamp or time.time()) * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": self.namespace,
+                            "Dimensions": [["Function"]],
+                            "Metrics": [
+                                {"Name": name, "Unit": self._units[name]}
+                                for name in self._values
+                            ],
+                        }
+                    ],
+                },
+                "Function": self.function_name,
+                **self._properties,
+            }
+            for name, values in self._values.items():
+                document[name] = values[0] if len(values) == 1 else values
+            return document
+
+    def flush(self):
+        if not self._values:
+            return
+        self.emit(json.dumps(self.to_emf(), ensure_ascii=False, default=str))
+        with self._lock:
+            self._values.clear()
+            self._units.clear()
+            self._properties.clear()
+
+
+# Lambdaは1コンテナで同時に1つの呼び出ししか処理しないため、
+# 呼び出し中のMetricsをモジュール単位で保持してワーカースレッドからも使う
+_cold_start = True
+_current = None
+
+
+def begin(function_name, emit=None):
+    global _cold_start, _current
+    _current = Metrics(function_name, emit=emit)
+    _current.put("ColdStart", 1 if _cold_start else 0)
+    _current.set_property("ColdStart", _cold_start)
+    _cold_start = False
+    return _current
+
+
+def get_metrics():
+    global _current
+    if _current is None:
+        _current = Metrics("unknown")
+    return _current
+
+
+def timer(stage):
+    return get_metrics().timer(stage)
+
+
+def put_metric(name, value, unit="Count"):
+    get_metrics().put(name, value, unit)
+
+
+def flush():
+    get_metrics().flush()
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from bedrock_bot_common import clients
+
+# ウォームコンテナ内でSSMパラメータを使い回すキャッシュ
+DEFAULT_TTL_SECONDS = 300
+
+# GetParametersで一度に取得できる件数の上限
+MAX_NAMES_PER_REQUEST = 10
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def get_ttl():
+    return int(os.environ.get("SSM_PARAMETER_CACHE_TTL", DEFAULT_TTL_SECONDS))
+
+
+def invalidate(names=None):
+    # names未指定の場合はキャッシュ全体を破棄する
+    with _lock:
+        if names is None:
+            _cache.clear()
+        else:
+            for name in names:
+                _cache.pop(name, None)
+
+
+def get_parameters(names, client=None):
+    now = time.monotonic()
+    values = {}
+    missing = []
+    with _lock:
+        for name in names:
+            cached = _cache.get(name)
+            if cached and cached[1] > now:
+                values[name] = cached[0]
+            elif name not in missing:
+                missing.append(name)
+
+    if not missing:
+        return values
+
+    # キャッシュにないものだけをGetParametersでまとめて取得
+    client = client or clients.get_client("ssm")
+    expires_at = now + get_ttl()
+    for i in range(0, len(missing), MAX_NAMES_PER_REQUEST):
+        response = client.get_parameters(
+            Names=missing[i : i + MAX_NAMES_PER_REQUEST], WithDecryption=True
+        )
+        invalid = response.get("InvalidParameters", [])
+        if invalid:
+            raise ClientError(
+                {
+                    "Error": {
+                        "Code": "ParameterNotFound",
+                        "Message": f"Invalid parameters: {', '.join(invalid)}",
+                    }
+                },
+                "GetParameters",
+            )
+        with _lock:
+            for parameter in response["Parameters"]:
+                _cache[parameter["Name"]] = (parameter["Value"], expires_at)
+                values[parameter["Name"]] = parameter["Value"]
+
+    return values
+
+
+def get_parameter(name, client=None):
+    return get_parameters([name], client=client)[name]
@@ -0,0 +1,99 @@
+import html
+import os
+import re
+
+from bedrock_bot_common import tokens
+
+# 質問として渡す推定トークン数の上限(0で無効)
+DEFAULT_TOKEN_BUDGET = 2000
+
+# 上限を超えた質問は先頭と末尾を残し、間をこの表記に置き換える
+# (貼り付けられたログなどは、最初と最後に要点があることが多い)
+TRUNCATION_MARKER = "\n…(長いため中略)…\n"
+HEAD_RATIO = 2 / 3
+
+# <@U123> / <@U123|name>
+MENTION_PATTERN = re.compile(r"<@([A-Z0-9]+)(?:\|([^>]*))?>")
+LEADING_MENTIONS_PATTERN = re.compile(r"^(?:\s*<@[A-Z0-9]+(?:\|[^>]*)?>)+")
+# <#C123|general>
+CHANNEL_PATTERN = re.compile(r"<#[A-Z0-9]+(?:\|([^>]*))?>")
+# <!here> / <!subteam^S123|@team>
+SPECIAL_PATTERN = re.compile(r"<!([a-z]+)(?:\^[A-Z0-9]+)?(?:\|([^>]*))?>")
+# <https://example.com|label> / <mailto:a@example.com>
+LINK_PATTERN = re.compile(r"<((?:https?|mailto):[^|>]+)(?:\|([^>]*))?>")
+TRAILING_SPACES_PATTERN = re.compile(r"[ \t]+\n")
+BLANK_LINES_PATTERN = re.compile(r"\n{3,}")
+
+
+def get_token_budget():
+    return int(os.environ.get("PROMPT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+
+
+def get_bot_user_id():
+    return os.environ.get("SLACK_BOT_USER_ID", "")
+
+
+def replace_link(match):
+    url, label = match.groups()
+    url = url.removeprefix("mailto:")
+    return url if not label or label == url else f"{label} ({url})"
+
+
+def strip_mentions(text, bot_user_id=None):
+    # ボットへのメンションを除き、ほかのユーザーへのメンションは@名前の表記にする
+    # (ボットのユーザーIDが分からない場合は、先頭のメンションをボットへのものとみなす)
+    bot_user_id = get_bot_user_id() if bot_user_id is None else bot_user_id
+    if not bot_user_id:
+        text = LEADING_MENTIONS_PATTERN.sub("", text)
+
+    def replace(match):
+        user_id, name = match.groups()
+        if user_id == bot_user_id:
+            return ""
+        return f"@{name or user_id}"
+
+    return MENTION_PATTERN.sub(replace, text)
+
+
+def normalize_mrkdwn(text):
+    # Slackの<...>表記とエスケープを、モデルが読みやすいプレーンテキストに戻す
+    text = CHANNEL_PATTERN.sub(lambda m: f"#{m.group(1) or 'channel'}", text)
+    text = SPECIAL_PATTERN.sub(lambda m: m.group(2) or f"@{m.group(1)}", text)
+    text = LINK_PATTERN.sub(replace_link, text)
+    text = html.unescape(text)
+    text = TRAILING_SPACES_PATTERN.sub("\n", text)
+    return BLANK_LINES_PATTERN.sub("\n\n", text).strip()
+
+
+def take_tokens(text, budget):
+    # 先頭からbudgetトークン以内に収まる文字数
+    used = 0.0
+    for i, char in enumerate(text):
+        used += 1 if ord(char) > 0x7F else 1 / tokens.ASCII_CHARS_PER_TOKEN
+        if used > budget:
+            return i
+    return len(text)
+
+
+def truncate(text, budget):
+    if not budget or tokens.estimate_tokens(text) <= budget:
+        return text
+    available = max(0, budget - tokens.estimate_tokens(TRUNCATION_MARKER))
+    head_budget = int(available * HEAD_RATIO)
+    while True:
+        head = text[: take_tokens(text, head_budget)]
+        tail_length = take_tokens(text[::-1], available - head_budget)
+        tail = text[len(text) - tail_length :] if tail_length else ""
+        result = head.rstrip() + TRUNCATION_MARKER + tail.lstrip()
+        # 概算の切り上げで上限をわずかに超えた場合は、末尾を削って収める
+        if tokens.estimate_tokens(result) <= budget or available <= 0:
+            return result
+        available -= 1
+
+
+def prepare(text, bot_user_id=None, token_budget=None):
+    # (前処理後の質問, 切り詰めたかどうか)
+    text = normalize_mrkdwn(strip_mentions(text or "", bot_user_id))
+    token_budget = get_token_budget() if token_budget is None else token_budget
+    truncated = truncate(text, token_budget)
+    return truncated, truncated != text
@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from bedrock_bot_common import clients, instrumentation
+
+logger = instrumentation.get_logger("rate_limit")
+
+# 楽観ロックの競合時に読み直す回数
+MAX_CONFLICT_RETRIES = 3
+
+
+class Limit:
+    # トークンバケットの設定(capacity件まで連続で受け付け、1分あたりper_minute件ずつ回復する)
+
+    def __init__(self, capacity, per_minute):
+        self.capacity = capacity
+        self.per_minute = per_minute
+
+    @property
+    def enabled(self):
+        return self.capacity > 0 and self.per_minute > 0
+
+    def refill(self, tokens, elapsed):
+        return min(self.capacity, tokens + elapsed * self.per_minute / 60)
+
+    def retry_after(self, tokens):
+        # 1件分のトークンが貯まるまでの秒数
+        return (1 - tokens) * 60 / self.per_minute
+
+    def take(self, tokens, max_wait=0):
+        # (受け付けるか, 待つ秒数, 取得後のトークン数)
+        # (足りなくてもmax_wait秒以内に貯まるなら先の分を予約し、残高をマイナスにする)
+        if tokens >= 1:
+            return True, 0, tokens - 1
+        wait = self.retry_after(tokens)
+        if wait <= max_wait:
+            return True, wait, tokens - 1
+        return False, wait, tokens
+
+
+class InMemoryRateLimiter:
+    # テストやテーブル未設定時のためのコンテナ内のトークンバケット
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, limit, max_wait=0):
+        now = self.clock()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (limit.capacity, now))
+            tokens = limit.refill(tokens, now - updated_at)
+            allowed, wait, remaining = limit.take(tokens, max_wait)
+            self._buckets[key] = (remaining, now)
+            return allowed, wait
+
+
+class DynamoDBRateLimiter:
+    # コンテナ間で共有するトークンバケット(更新は前回の更新時刻を条件にした楽観ロック)
+
+    def __init__(self, table_name, client=None, clock=time.time):
+        self.table_name = table_name
+        self.client = client or clients.get_client("dynamodb")
+        self.clock = clock
+
+    def acquire(self, key, limit, max_wait=0):
+        for _ in range(MAX_CONFLICT_RETRIES):
+            now = self.clock()
+            item = self.client.get_item(
+                TableName=self.table_name,
+                Key={"bucket_key": {"S": key}},
+                ConsistentRead=True,
+            ).get("Item")
+            if item is None:
+                tokens = limit.capacity
+                condition = {"ConditionExpression": "attribute_not_exists(bucket_key)"}
+            else:
+                updated_at = item["updated_at"]["N"]
+                tokens = limit.refill(
+                    float(item["tokens"]["N"]), now - float(updated_at)
+                )
+                condition = {
+                    "ConditionExpression": "updated_at = :updated_at",
+                    "ExpressionAttributeValues": {":updated_at": {"N": updated_at}},
+                }
+
+            allowed, wait, remaining = limit.take(tokens, max_wait)
+            # 満タンに戻るまでの時間が過ぎたら項目ごと消してよい
+            expires_at = now + (limit.capacity - remaining) * 60 / limit.per_minute + 60
+            try:
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        "bucket_key": {"S": key},
+                        "tokens": {"N": repr(remaining)},
+                        "updated_at": {"N": repr(now)},
+                        "expires_at": {"N": str(int(expires_at))},
+                    },
+                    **condition,
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                    continue
+                raise
+            return allowed, wait
+
+        # 競合が続く場合は受け付ける(レート制限のために正当な質問を落とさない)
+        logger.warning("Rate limit update kept conflicting", key=key)
+        return True, 0
+
+
+def get_limits():
+    return {
+        "user": Limit(
+            int(os.environ.get("RATE_LIMIT_USER_CAPACITY", 0)),
+            float(os.environ.get("RATE_LIMIT_USER_PER_MINUTE", 0)),
+        ),
+        "channel": Limit(
+            int(os.environ.get("RATE_LIMIT_CHANNEL_CAPACITY", 0)),
+            float(os.environ.get("RATE_LIMIT_CHANNEL_PER_MINUTE", 0)),
+        ),
+    }
+
+
+def check(user, channel, limiter=None, max_wait=0):
+    # ユーザーとチャンネルの順にトークンを取得し、(許可するか, 待つ秒数)を返す
+    # (max_wait秒以内に貯まるトークンは予約して受け付け、待つ秒数だけ処理を遅らせる)
+    limiter = limiter or get_rate_limiter()
+    limits = get_limits()
+    delay = 0
+    for scope, value in (("user", user), ("channel", channel)):
+        limit = limits[scope]
+        if not value or not limit.enabled:
+            continue
+        try:
+            allowed, wait = limiter.acquire(f"{scope}:{value}", limit, max_wait)
+        except ClientError as e:
+            # ストアの障害時は制限せずに受け付ける
+            logger.error("Rate limit check failed", scope=scope, error=str(e))
+            continue
+        if not allowed:
+            return False, wait
+        delay = max(delay, wait)
+    return True, delay
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                table_name = os.environ.get("RATE_LIMIT_TABLE")
+                _limiter = (
+                    DynamoDBRateLimiter(table_name)
+                    if table_name
+                    else InMemoryRateLimiter()
+                )
+    return _limiter
+
+
+def reset():
+    global _limiter
+    with _limiter_lock:
+        _limiter = None
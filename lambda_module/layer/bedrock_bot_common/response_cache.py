@@ -0,0 +1,165 @@
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from bedrock_bot_common import clients
+
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_MAX_ENTRIES = 256
+
+# Slackのメンション表記(<@U123> / <@U123|name>)
+MENTION_PATTERN = re.compile(r"<@[A-Z0-9]+(?:\|[^>]*)?>")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_prompt(text):
+    # ボットへのメンションを除き、空白をまとめた文字列をキャッシュキーに使う
+    text = MENTION_PATTERN.sub(" ", text or "")
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def make_cache_key(text, flow_identifier, flow_alias_identifier):
+    source = json.dumps(
+        [normalize_prompt(text), flow_identifier, flow_alias_identifier],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class LruResponseCache:
+    # ウォームコンテナ内のメモリに保持するLRUキャッシュ
+
+    def __init__(
+        self,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        ttl_seconds=DEFAULT_TTL_SECONDS,
+        clock=time.time,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at=None):
+        with self._lock:
+            self._entries[key] = (value, expires_at or self.clock() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DynamoDBResponseCache:
+    # コンテナ間で共有するDynamoDBのキャッシュ(期限切れの項目はTTLで削除される)
+
+    def __init__(
+        self, table_name, ttl_seconds=DEFAULT_TTL_SECONDS, client=None, clock=time.time
+    ):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.client = client or clients.get_client("dynamodb")
+        self.clock = clock
+
+    def get(self, key):
+        item = self.client.get_item(
+            TableName=self.table_name, Key={"cache_key": {"S": key}}
+        ).get("Item")
+        # TTLによる削除は遅れることがあるため、期限は読み取り時にも確認する
+        if item is None or int(item["expires_at"]["N"]) <= self.clock():
+            return None
+        return item["response"]["S"]
+
+    def set(self, key, value, expires_at=None):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "cache_key": {"S": key},
+                "response": {"S": value},
+                "expires_at": {
+                    "N": str(int(expires_at or self.clock() + self.ttl_seconds))
+                },
+            },
+        )
+
+
+class TieredResponseCache:
+    # メモリのLRUを先に参照し、なければ共有キャッシュを参照する
+
+    def __init__(self, local, remote=None):
+        self.local = local
+        self.remote = remote
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.remote is not None:
+            value = self.remote.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.remote is not None:
+            self.remote.set(key, value)
+
+
+def get_ttl():
+    return int(os.environ.get("RESPONSE_CACHE_TTL", DEFAULT_TTL_SECONDS))
+
+
+def is_enabled_for_channel(channel):
+    if get_ttl() <= 0:
+        return False
+    optout = os.environ.get("RESPONSE_CACHE_OPTOUT_CHANNELS", "")
+    return channel not in {c.strip() for c in optout.split(",") if c.strip()}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                ttl_seconds = get_ttl()
+                table_name = os.environ.get("RESPONSE_CACHE_TABLE")
+                _cache = TieredResponseCache(
+                    LruResponseCache(
+                        int(
+                            os.environ.get(
+                                "RESPONSE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES
+                            )
+                        ),
+                        ttl_seconds,
+                    ),
+                    (
+                        DynamoDBResponseCache(table_name, ttl_seconds)
+                        if table_name
+                        else None
+                    ),
+                )
+    return _cache
+
+
+def reset():
+    global _cache
+    with _cache_lock:
+        _cache = None
@@ -0,0 +1,292 @@
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+
+from bedrock_bot_common import instrumentation
+
+logger = instrumentation.get_logger("retry")
+
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BASE_DELAY_SECONDS = 0.5
+DEFAULT_MAX_DELAY_SECONDS = 20.0
+
+# 再試行の予算(最大でcapacity回、成功1回ごとにrefill回分だけ戻る)
+DEFAULT_BUDGET_CAPACITY = 10
+DEFAULT_BUDGET_REFILL = 0.2
+
+# 再試行しても失敗する呼び出しがthreshold回続いたら、cooldown秒のあいだ呼び出しを止める
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_COOLDOWN_SECONDS = 30.0
+
+# SQSの可視性タイムアウトの上限(秒)
+MAX_VISIBILITY_TIMEOUT_SECONDS = 12 * 60 * 60
+
+# 待てば成功する見込みのあるAWSのエラーコード
+# (イベントストリームの途中で届くエラーは先頭が小文字のため、小文字で比較する)
+RETRYABLE_ERROR_CODES = frozenset(
+    code.lower()
+    for code in (
+        "ThrottlingException",
+        "TooManyRequestsException",
+        "ServiceUnavailableException",
+        "InternalServerException",
+        "ModelNotReadyException",
+    )
+)
+
+
+class RetryableError(Exception):
+    # 再試行できる失敗(retry_afterが分かっていればその秒数だけ待つ)
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit {name} is open")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_retryable(error):
+    if isinstance(error, RetryableError):
+        return True
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code", "")
+        return code.lower() in RETRYABLE_ERROR_CODES
+    # 接続エラーや読み取りのタイムアウト(Bedrockはbotocoreで再試行しないため、ここで再試行する)
+    return isinstance(error, (BotoConnectionError, HTTPClientError))
+
+
+def get_retry_after(error):
+    return getattr(error, "retry_after", None)
+
+
+def full_jitter(attempt, base_delay, max_delay, rand=random.random):
+    # 0からbase_delay * 2^attemptまでの一様乱数(Full Jitter)
+    return rand() * min(max_delay, base_delay * 2**attempt)
+
+
+class RetryBudget:
+    # 障害時に再試行が呼び出し全体を何倍にも増やさないよう、再試行の回数を成功数に比例させる
+
+    def __init__(self, capacity=DEFAULT_BUDGET_CAPACITY, refill=DEFAULT_BUDGET_REFILL):
+        self.capacity = capacity
+        self.refill = refill
+        self._tokens = float(capacity)
+        self._lock = threading.Lock()
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + self.refill)
+
+
+class CircuitBreaker:
+    # 失敗が続いたら一定時間呼び出しを止め、その後は1件だけ試して回復を確かめる(half-open)
+
+    def __init__(
+        self,
+        name,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        cooldown=DEFAULT_COOLDOWN_SECONDS,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def before_call(self):
+        # 回復を確かめる1件目の呼び出しならTrueを返す
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            remaining = self._opened_at + self.cooldown - self.clock()
+            if remaining > 0:
+                raise CircuitOpenError(self.name, remaining)
+            if self._probing:
+                raise CircuitOpenError(self.name, self.cooldown)
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Circuit closed", circuit=self.name)
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if not self._probing:
+                    logger.warning(
+                        "Circuit opened", circuit=self.name, failures=self._failures
+                    )
+                self._opened_at = self.clock()
+                self._probing = False
+
+    def release_probe(self):
+        # 試行が成功とも失敗とも判定されずに終わった場合は、次の呼び出しで改めて試す
+        with self._lock:
+            self._probing = False
+
+
+class Retrier:
+    # 一時的な失敗をFull Jitterの指数バックオフで再試行する(Retry-Afterがあればそれに従う)
+
+    def __init__(
+        self,
+        name,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        base_delay=DEFAULT_BASE_DELAY_SECONDS,
+        max_delay=DEFAULT_MAX_DELAY_SECONDS,
+        budget=None,
+        breaker=None,
+        sleep=time.sleep,
+        rand=random.random,
+    ):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker(name)
+        self.sleep = sleep
+        self.rand = rand
+
+    def get_delay(self, attempt, error):
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            # 上限より長く待つよう指示された場合は、ここでは待たずに呼び出し元へ返す
+            return retry_after if retry_after <= self.max_delay else None
+        return full_jitter(attempt, self.base_delay, self.max_delay, self.rand)
+
+    def call(self, func, *args, **kwargs):
+        probing = self.breaker.before_call()
+        try:
+            return self._call(func, *args, **kwargs)
+        finally:
+            if probing:
+                self.breaker.release_probe()
+
+    def _call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    # 入力の誤りなど、待っても成功しない失敗は回路の状態に含めない
+                    raise
+                delay = self.get_delay(attempt, e)
+                attempt += 1
+                if (
+                    attempt >= self.max_attempts
+                    or delay is None
+                    or not self.budget.withdraw()
+                ):
+                    instrumentation.put_metric(f"{self.name}RetryExhausted", 1)
+                    self.breaker.record_failure()
+                    raise
+                instrumentation.put_metric(f"{self.name}Retry", 1)
+                logger.warning(
+                    "Retrying after a transient failure",
+                    target=self.name,
+                    attempt=attempt,
+                    delay=round(delay, 3),
+                    error=str(e),
+                )
+                self.sleep(delay)
+                continue
+            self.budget.deposit()
+            self.breaker.record_success()
+            return result
+
+
+def get_cooldown():
+    return float(os.environ.get("CIRCUIT_COOLDOWN_SECONDS", DEFAULT_COOLDOWN_SECONDS))
+
+
+def get_defer_seconds(error, rand=random.random, receive_count=1):
+    # SQSへ戻して後で処理し直すまでの秒数(戻しても成功しない失敗はNone)
+    if isinstance(error, CircuitOpenError):
+        delay = error.retry_after
+    elif is_retryable(error):
+        delay = get_retry_after(error) or get_cooldown()
+    else:
+        return None
+    # 受信のたびに待ち時間を倍にし、長い障害でもDLQへ移る前に回復を待てるようにする
+    delay *= 2 ** max(0, receive_count - 1)
+    # 同時に戻したメッセージが一斉に再配信されないよう、待ち時間を散らす
+    return int(min(MAX_VISIBILITY_TIMEOUT_SECONDS, delay * (1 + rand())))
+
+
+_retriers = {}
+_retriers_lock = threading.Lock()
+
+
+def get_retrier(name):
+    # 呼び出し先ごとの再試行の予算と回路の状態は、コンテナ内の全スレッドで共有する
+    retrier = _retriers.get(name)
+    if retrier is None:
+        with _retriers_lock:
+            retrier = _retriers.get(name)
+            if retrier is None:
+                retrier = Retrier(
+                    name,
+                    max_attempts=int(
+                        os.environ.get("RETRY_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+                    ),
+                    base_delay=float(
+                        os.environ.get("RETRY_BASE_DELAY", DEFAULT_BASE_DELAY_SECONDS)
+                    ),
+                    max_delay=float(
+                        os.environ.get("RETRY_MAX_DELAY", DEFAULT_MAX_DELAY_SECONDS)
+                    ),
+                    breaker=CircuitBreaker(
+                        name,
+                        failure_threshold=int(
+                            os.environ.get(
+                                "CIRCUIT_FAILURE_THRESHOLD", DEFAULT_FAILURE_THRESHOLD
+                            )
+                        ),
+                        cooldown=get_cooldown(),
+                    ),
+                )
+                _retriers[name] = retrier
+    return retrier
+
+
+def set_retrier(name, retrier):
+    # テストなどで待ち時間や乱数を差し替えた再試行を使う
+    with _retriers_lock:
+        _retriers[name] = retrier
+
+
+def reset():
+    with _retriers_lock:
+        _retriers.clear()
@@ -0,0 +1,272 @@
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+
+from bedrock_bot_common import retry
+
+SLACK_API_URL = "https://slack.com/api/"
+
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_TIMEOUT_SECONDS = 10
+
+
+class SlackResponse:
+    def __init__(self, status, headers, data):
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+    @property
+    def ok(self):
+        return self.status == 200 and bool(self.data.get("ok"))
+
+    def get_header(self, name):
+        name = name.lower()
+        for key, value in self.headers.items():
+            if key.lower() == name:
+                return value
+        return None
+
+    @property
+    def retry_after(self):
+        value = self.get_header("Retry-After")
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+
+class SlackRetryableError(retry.RetryableError):
+    pass
+
+
+class SlackClient:
+    # Slack Web APIへのkeep-alive接続をプールし、並列の投稿で共有するクライアント
+
+    def __init__(self, base_url=None, max_connections=None, timeout=None):
+        parsed = urllib.parse.urlparse(
+            base_url or os.environ.get("SLACK_API_URL", SLACK_API_URL)
+        )
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path.rstrip("/") + "/"
+        self.timeout = timeout or DEFAULT_TIMEOUT_SECONDS
+        self._pool = queue.LifoQueue(
+            maxsize=max_connections
+            or int(os.environ.get("SLACK_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS))
+        )
+
+    def _new_connection(self):
+        if self.scheme == "http":
+            return http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+        return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def _release(self, connection):
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _send(self, connection, method, body, headers):
+        connection.request("POST", self.path + method, body=body, headers=headers)
+        res = connection.getresponse()
+        return res, res.read()
+
+    def api_call(self, method, payload, access_token, form=False):
+        # files.*などJSONのボディを受け付けないメソッドはフォーム形式で送る
+        if form:
+            body = urllib.parse.urlencode(payload).encode("utf-8")
+            content_type = "application/x-www-form-urlencoded"
+        else:
+            body = json.dumps(payload).encode("utf-8")
+            content_type = "application/json; charset=UTF-8"
+        headers = {
+            "Content-Type": content_type,
+            "Authorization": f"Bearer {access_token}",
+        }
+        connection, reused = self._acquire()
+        try:
+            res, res_body = self._send(connection, method, body, headers)
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            if not reused:
+                raise
+            # プール内の接続がサーバー側で切断されていた場合は新しい接続で1回だけ再送
+            connection = self._new_connection()
+            try:
+                res, res_body = self._send(connection, method, body, headers)
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                raise
+
+        if res.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+
+        try:
+            data = json.loads(res_body.decode("utf-8"))
+        except ValueError:
+            data = {}
+        return SlackResponse(res.status, dict(res.getheaders()), data)
+
+    def upload(self, url, data):
+        # files.getUploadURLExternalが返したURL(APIとは別のホスト)へファイルの内容を送る
+        parsed = urllib.parse.urlparse(url)
+        if parsed.scheme == "http":
+            connection = http.client.HTTPConnection(
+                parsed.hostname, parsed.port, timeout=self.timeout
+            )
+        else:
+            connection = http.client.HTTPSConnection(
+                parsed.hostname, parsed.port, timeout=self.timeout
+            )
+        path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+        try:
+            connection.request(
+                "POST",
+                path,
+                body=data,
+                headers={"Content-Type": "application/octet-stream"},
+            )
+            res = connection.getresponse()
+            res.read()
+            return res.status
+        finally:
+            connection.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def api_call_with_retry(method, payload, access_token, client=None, form=False):
+    # 429(Retry-Afterに従う)、5xx、接続エラーは共通の再試行ポリシーで送り直す
+    client = client or get_slack_client()
+    kwargs = {"form": True} if form else {}
+
+    def call():
+        try:
+            res = client.api_call(method, payload, access_token, **kwargs)
+        except (http.client.HTTPException, OSError) as e:
+            raise SlackRetryableError(f"{method}: {e}") from e
+        if res.status == 429 or res.status >= 500:
+            raise SlackRetryableError(
+                f"{method} returned HTTP {res.status}", retry_after=res.retry_after
+            )
+        return res
+
+    return retry.get_retrier("Slack").call(call)
+
+
+def upload_text(
+    channel, text, filename, access_token, thread_ts=None, comment=None, client=None
+):
+    # 長い回答はファイルとして共有する(files.upload廃止後の外部アップロードの手順)
+    client = client or get_slack_client()
+    data = text.encode("utf-8")
+    res = api_call_with_retry(
+        "files.getUploadURLExternal",
+        {"filename": filename, "length": len(data)},
+        access_token,
+        client=client,
+        form=True,
+    )
+    if not res.ok:
+        return res
+
+    def upload():
+        try:
+            status = client.upload(res.data["upload_url"], data)
+        except (http.client.HTTPException, OSError) as e:
+            raise SlackRetryableError(f"upload: {e}") from e
+        if status == 429 or status >= 500:
+            raise SlackRetryableError(f"upload returned HTTP {status}")
+
+    retry.get_retrier("Slack").call(upload)
+
+    payload = {
+        "files": json.dumps([{"id": res.data["file_id"], "title": filename}]),
+        "channel_id": channel,
+    }
+    if thread_ts:
+        payload["thread_ts"] = thread_ts
+    if comment:
+        payload["initial_comment"] = comment
+    return api_call_with_retry(
+        "files.completeUploadExternal", payload, access_token, client=client, form=True
+    )
+
+
+class MessageStreamer:
+    # chat.updateの呼び出しを一定間隔に間引きながらメッセージを更新する
+    # (プレースホルダー投稿の直後に作成する想定のため、最初の更新もintervalを待つ)
+
+    def __init__(self, update, interval, clock=time.monotonic):
+        self.update = update
+        self.interval = interval
+        self.clock = clock
+        self.update_count = 0
+        self._last_update = clock()
+        self._pending = None
+        self._sent = None
+
+    def push(self, text):
+        if text == self._sent:
+            return
+        now = self.clock()
+        if now - self._last_update >= self.interval:
+            self._send(text, now)
+        else:
+            self._pending = text
+
+    def flush(self, text=None):
+        # 最後の内容は間隔に関係なく必ず反映する
+        if text is not None:
+            self._pending = text
+        if self._pending is not None and self._pending != self._sent:
+            self._send(self._pending, self.clock())
+
+    def _send(self, text, now):
+        self.update(text)
+        self.update_count += 1
+        self._sent = text
+        self._last_update = now
+        self._pending = None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_slack_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SlackClient()
+    return _client
+
+
+def reset():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
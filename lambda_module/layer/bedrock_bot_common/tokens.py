@@ -0,0 +1,14 @@
+import re
+
+# ASCIIの英数字はおよそ4文字で1トークン、日本語などの非ASCII文字は1文字1トークン程度として見積もる
+ASCII_CHARS_PER_TOKEN = 4
+NON_ASCII_PATTERN = re.compile(r"[^\x00-\x7f]")
+
+
+def estimate_tokens(text):
+    # 正確なトークナイザーを使わず、文字の種類から高速に概算する
+    if not text:
+        return 0
+    non_ascii = len(NON_ASCII_PATTERN.findall(text))
+    ascii_chars = len(text) - non_ascii
+    return non_ascii + -(-ascii_chars // ASCII_CHARS_PER_TOKEN)
@@ -1,34 +1,88 @@
-import json
-import boto3
 import os
-import urllib
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from bedrock_bot_common import (
+    backends,
+    chunker,
+    clients,
+    dispatch,
+    enqueue,
+    flow_trace,
+    history,
+    idempotency,
+    instrumentation,
+    parameters,
+    prompt,
+    response_cache,
+    retry,
+    slack,
+)
 
-# boto3のバージョンを表示
-print("boto3 version:", boto3.__version__)
+logger = instrumentation.get_logger("sqs")
 
+# バッチ内で同時に実行するBedrock Flow呼び出しの上限(スロットリング対策)
+DEFAULT_FLOW_MAX_CONCURRENCY = 4
 
-def get_ssm_parameter(name):
-    ssm = boto3.client("ssm")
+# ストリーミングモードでchat.updateを呼ぶ最小間隔(秒)
+DEFAULT_STREAM_UPDATE_INTERVAL = 1.0
+STREAMING_PLACEHOLDER = "考え中です…"
+
+# 長い回答をチャンクで投稿する合計文字数の上限(超えた分は全文をファイルで共有する、0で無効)
+DEFAULT_FILE_UPLOAD_CHARS = 12000
+FILE_UPLOAD_COMMENT = "回答が長いため、全文をファイルで共有します。"
+
+# メンションだけで質問の内容がない場合の返信
+EMPTY_PROMPT_MESSAGE = "質問の内容をメンションと一緒に書いてください。"
+
+
+def get_flow_max_concurrency():
+    return max(
+        1, int(os.environ.get("FLOW_MAX_CONCURRENCY", DEFAULT_FLOW_MAX_CONCURRENCY))
+    )
+
+
+def is_streaming_enabled():
+    return os.environ.get("SLACK_STREAMING_MODE", "false").lower() == "true"
+
+
+def get_stream_update_interval():
+    return float(
+        os.environ.get("SLACK_STREAM_UPDATE_INTERVAL", DEFAULT_STREAM_UPDATE_INTERVAL)
+    )
+
+
+def get_chunk_chars():
+    return int(os.environ.get("SLACK_CHUNK_CHARS", chunker.DEFAULT_LIMIT))
+
+
+def get_file_upload_chars():
+    return int(os.environ.get("SLACK_FILE_UPLOAD_CHARS", DEFAULT_FILE_UPLOAD_CHARS))
+
+
+def is_block_kit_enabled():
+    return os.environ.get("SLACK_BLOCK_KIT", "false").lower() == "true"
+
+
+def get_ssm_parameters():
+    # 4つのパラメータを1回のGetParametersで取得し、ウォーム時はキャッシュを使う
+    names = {
+        "access_token": os.environ["SLACK_BOT_USER_ACCESS_TOKEN"],
+        "verify_token": os.environ["SLACK_BOT_VERIFY_TOKEN"],
+        "flow_identifier": os.environ["FLOW_IDENTIFIER"],
+        "flow_alias_identifier": os.environ["FLOW_ALIAS_IDENTIFIER"],
+    }
     try:
-        parameter = ssm.get_parameter(Name=name, WithDecryption=True)["Parameter"][
-            "Value"
-        ]
-        return parameter
+        with instrumentation.timer("Ssm"):
+            values = parameters.get_parameters(list(names.values()))
     except ClientError as e:
-        error_message = f"SSMパラメータの取得に失敗しました: {str(e)}"
-        print(error_message)
+        logger.error("SSMパラメータの取得に失敗しました", error=str(e))
         raise
+    return {key: values[name] for key, name in names.items()}
 
 
 def post_message_to_channel(
     channel, message, access_token, verify_token, thread_ts=None
 ):
-    url = "https://slack.com/api/chat.postMessage"
-    headers = {
-        "Content-Type": "application/json; charset=UTF-8",
-        "Authorization": f"Bearer {access_token}",
-    }
     data = {
         "token": verify_token,
         "channel": channel,
@@ -38,85 +92,524 @@ def post_message_to_channel(
     if thread_ts:
         data["thread_ts"] = thread_ts
 
-    req = urllib.request.Request(
-        url, data=json.dumps(data).encode("utf-8"), method="POST", headers=headers
-    )
+    if is_block_kit_enabled():
+        data["blocks"] = chunker.make_blocks(message)
+
+    # コンテナ内で共有するkeep-alive接続プールを使って投稿する
+    # (429や接続エラーは再試行し、それでも失敗した場合は例外を送出する)
+    with instrumentation.timer("SlackPost"):
+        res = slack.api_call_with_retry("chat.postMessage", data, access_token)
+    logger.debug("Posted message", status=res.status, response=res.data)
+    if not res.ok:
+        logger.warning(
+            "Failed to post message to Slack", status=res.status, response=res.data
+        )
+
+    return res.data.get("ts") if res.ok else None
+
+
+def update_message(channel, ts, message, access_token):
+    data = {"channel": channel, "ts": ts, "text": message}
+    # blocksを省略するとSlackは投稿時のblocksを表示し続けるため、本文と一緒に置き換える
+    if is_block_kit_enabled():
+        data["blocks"] = chunker.make_blocks(message)
     try:
-        res = urllib.request.urlopen(req)
-        print(f"post result: {res.msg}")
-        res_body = res.read().decode("utf-8")
-        print(f"Response Body: {res_body}")
-    except urllib.error.URLError as e:
-        print(f"Failed to post message to Slack: {e}")
+        with instrumentation.timer("SlackUpdate"):
+            res = slack.api_call_with_retry("chat.update", data, access_token)
+        if not res.ok:
+            logger.warning(
+                "Failed to update message", status=res.status, response=res.data
+            )
+    except (retry.RetryableError, retry.CircuitOpenError) as e:
+        logger.error("Failed to update message", error=str(e))
 
 
-def main(event, context):
-    # イベントの内容をログに出力
-    print("Received event:", event)
-    # SQSイベントから最初のレコードのボディを取得し、JSON形式でパース
-    body = json.loads(event["Records"][0]["body"])
+def delete_message(channel, ts, access_token):
+    try:
+        slack.api_call_with_retry(
+            "chat.delete", {"channel": channel, "ts": ts}, access_token
+        )
+    except (retry.RetryableError, retry.CircuitOpenError) as e:
+        logger.error("Failed to delete message", error=str(e))
+
+
+def get_trace_node_name(event):
+    trace = event["flowTraceEvent"].get("trace", {})
+    for key in ("nodeInputTrace", "nodeOutputTrace"):
+        if key in trace:
+            return trace[key].get("nodeName")
+    return None
+
+
+def process_record(record, params):
+    # SQSレコードのボディをJSON形式でパース(大きいものは圧縮されている)
+    body = enqueue.decode_message(record["body"])
     user_id = body.get("event", {}).get("user", "不明なユーザー")
     text = body.get("event", {}).get("text", "")
     channel = body.get("event", {}).get("channel", "不明なチャンネル")
     thread_ts = body.get("event", {}).get("thread_ts", None)
     event_ts = body.get("event", {}).get("event_ts", None)
-    print(
-        f"user_id={user_id}, text={text}, channel={channel}, thread_ts={thread_ts}, event_ts={event_ts}"
+    logger.info(
+        "Processing mention",
+        user_id=user_id,
+        channel=channel,
+        thread_ts=thread_ts,
+        event_ts=event_ts,
     )
+    logger.debug("Mention text", text=text)
 
     # thread_tsがNoneの場合はevent_tsを設定
     if thread_ts is None:
         thread_ts = event_ts
 
-    # SSMパラメータの取得
+    # SQSの重複配信などで同じメンションに対してFlowを2回呼ばないようにする
+    # (前回の試行で投稿できなかった回答があれば、受け付けと同時に受け取る)
+    store = idempotency.get_idempotency_store()
+    idempotency_key = idempotency.make_flow_key(channel, event_ts) if event_ts else None
+    pending = PendingAnswer(channel)
+    if idempotency_key:
+        claimed, pending.text = store.claim_with_pending(idempotency_key)
+        if not claimed:
+            logger.info("Duplicate message", idempotency_key=idempotency_key)
+            return
+
     try:
-        access_token = get_ssm_parameter(os.environ["SLACK_BOT_USER_ACCESS_TOKEN"])
-        verify_token = get_ssm_parameter(os.environ["SLACK_BOT_VERIFY_TOKEN"])
-        flow_identifier = get_ssm_parameter(os.environ["FLOW_IDENTIFIER"])
-        flow_alias_identifier = get_ssm_parameter(os.environ["FLOW_ALIAS_IDENTIFIER"])
-    except ClientError:
-        return {
-            "statusCode": 500,
-            "body": json.dumps({"message": "SSMパラメータの取得に失敗しました"}),
-        }
-
-    # Bedrock Runtimeクライアントを作成
-    runtime_client = boto3.client("bedrock-agent-runtime", region_name="us-east-1")
-
-    input_data = [
-        {
-            "content": {"document": text},
-            "nodeName": "FlowInputNode",
-            "nodeOutputName": "document",
-        }
-    ]
+        respond_to_mention(text, channel, thread_ts, params, event_ts, pending)
+    except Exception:
+        # 失敗した場合は再試行で処理できるよう記録を取り消す(未投稿の回答は記録に残す)
+        if idempotency_key:
+            store.release(idempotency_key, pending_answer=pending.text)
+        raise
+
+    if idempotency_key:
+        store.complete(idempotency_key)
+
+    # 回答を投稿し終えた時刻(API側のログとevent_tsで突き合わせて全体の所要時間を求める)
+    logger.info("Mention processed", channel=channel, event_ts=event_ts)
+
+
+def respond_to_mention(text, channel, thread_ts, params, event_ts=None, pending=None):
+    # メンションの除去やmrkdwnの変換、トークン数の上限での切り詰めを行い、
+    # 質問が空になった場合はBedrockを呼ばずに返信する
+    original_chars = len(text or "")
+    text, truncated = prompt.prepare(text)
+    if not text:
+        instrumentation.put_metric("EmptyPrompts", 1)
+        post_message_to_channel(
+            channel,
+            EMPTY_PROMPT_MESSAGE,
+            params["access_token"],
+            params["verify_token"],
+            thread_ts,
+        )
+        return
+    if truncated:
+        logger.info(
+            "Prompt truncated",
+            channel=channel,
+            event_ts=event_ts,
+            original_chars=original_chars,
+            chars=len(text),
+        )
+        instrumentation.put_metric("PromptTruncated", 1)
+
+    # 前回の試行で生成済みの回答があれば、Flowを呼ばずにSlackへの投稿だけをやり直す
+    response_text = pending.text if pending else None
+    if response_text:
+        logger.info("Reposting pending answer", channel=channel, event_ts=event_ts)
+        post_answer(channel, response_text, params, thread_ts, pending)
+    else:
+        # スレッドのこれまでの会話を読み込む(Slackのconversations.repliesは呼ばない)
+        turns = []
+        if history.is_enabled():
+            with instrumentation.timer("HistoryLoad"):
+                turns = history.get_history_store().load(channel, thread_ts)
+            instrumentation.put_metric("HistoryTurns", len(turns))
+
+        response_text = generate_response(
+            text, turns, channel, thread_ts, params, pending
+        )
+
+    if history.is_enabled() and response_text:
+        with instrumentation.timer("HistorySave"):
+            history.get_history_store().append(
+                channel,
+                thread_ts,
+                [
+                    [history.ROLE_USER, response_cache.normalize_prompt(text)],
+                    [history.ROLE_ASSISTANT, response_text],
+                ],
+            )
+
+
+class PendingAnswer:
+    # 生成済みで投稿できなかった回答(冪等性の記録に残し、再配信では投稿だけをやり直す)
+
+    def __init__(self, channel, text=None):
+        self.channel = channel
+        self.text = text
+
+    def keep(self, text):
+        # 回答を保存しないチャンネルでは残さず、再配信では回答を生成し直す
+        self.text = (
+            text if response_cache.is_enabled_for_channel(self.channel) else None
+        )
+
+
+class AnswerPoster:
+    # 回答を段落とコードブロックの境界でSlackの上限以下に分け、確定したチャンクから順に投稿する
+    # (合計が上限を超えた場合は、残りを投稿せずに全文をファイルで共有する)
+
+    def __init__(self, channel, params, thread_ts):
+        self.channel = channel
+        self.params = params
+        self.thread_ts = thread_ts
+        self.upload_chars = get_file_upload_chars()
+        self.chunker = chunker.MessageChunker(get_chunk_chars())
+        self.received = ""
+        self.posted_chars = 0
+        self.post_count = 0
+        self.overflow = False
+        self._queue = []
+        self._posted_ts = []
+
+    @property
+    def remaining_text(self):
+        # まだ投稿していない部分(投稿に失敗した場合に再配信で送り直す)
+        return "\n\n".join([*self._queue, self.chunker.pending]).strip()
+
+    def update(self, text):
+        # ストリームで届いた出力を受け取る(途中の投稿の失敗はfinishでやり直す)
+        if text.startswith(self.received):
+            delta = text[len(self.received) :]
+        elif self.post_count == 0:
+            # まだ何も投稿していなければ、別の出力で置き換える
+            self.chunker = chunker.MessageChunker(self.chunker.limit)
+            self._queue = []
+            delta = text
+        else:
+            return
+        self.received = text
+        self._queue.extend(self.chunker.feed(delta))
+        try:
+            self._post_queued()
+        except (retry.RetryableError, retry.CircuitOpenError) as e:
+            logger.warning("Failed to post a chunk while streaming", error=str(e))
+
+    def finish(self, text):
+        if text != self.received:
+            if self.post_count == 0 or not text.startswith(self.received):
+                logger.info("Final answer differs from the streamed output")
+                self.chunker = chunker.MessageChunker(self.chunker.limit)
+                self._queue = []
+                self.received = ""
+            self.update(text)
+        self._queue.extend(self.chunker.finish())
+        self._post_queued()
+        if self.overflow:
+            self.upload(text)
+        instrumentation.put_metric("AnswerChunks", self.post_count)
 
+    def _post_queued(self):
+        while self._queue and not self.overflow:
+            chunk = self._queue[0]
+            if (
+                self.upload_chars
+                and self.post_count
+                and self.posted_chars + len(chunk) > self.upload_chars
+            ):
+                self.overflow = True
+                return
+            ts = post_message_to_channel(
+                self.channel,
+                chunk,
+                self.params["access_token"],
+                self.params["verify_token"],
+                self.thread_ts,
+            )
+            self._queue.pop(0)
+            self.post_count += 1
+            self.posted_chars += len(chunk)
+            if ts:
+                self._posted_ts.append(ts)
+
+    def discard(self):
+        # 投稿済みのチャンクを削除し、最初から投稿し直せるようにする
+        for ts in self._posted_ts:
+            delete_message(self.channel, ts, self.params["access_token"])
+        if self.post_count:
+            logger.info("Discarded partially posted answer", chunks=self.post_count)
+        self.chunker = chunker.MessageChunker(self.chunker.limit)
+        self.received = ""
+        self.posted_chars = 0
+        self.post_count = 0
+        self.overflow = False
+        self._queue = []
+        self._posted_ts = []
+
+    def upload(self, text):
+        with instrumentation.timer("SlackUpload"):
+            res = slack.upload_text(
+                self.channel,
+                text,
+                "answer.md",
+                self.params["access_token"],
+                thread_ts=self.thread_ts,
+                comment=FILE_UPLOAD_COMMENT,
+            )
+        if not res.ok:
+            logger.warning(
+                "Failed to upload answer", status=res.status, response=res.data
+            )
+        self._queue = []
+
+
+def post_answer(channel, response_text, params, thread_ts, pending=None, poster=None):
+    poster = poster or AnswerPoster(channel, params, thread_ts)
     try:
-        response = runtime_client.invoke_flow(
-            flowIdentifier=flow_identifier,
-            flowAliasIdentifier=flow_alias_identifier,
-            inputs=input_data,
+        poster.finish(response_text)
+    except (retry.RetryableError, retry.CircuitOpenError):
+        # 生成済みの回答のうち未投稿の部分を残し、再配信されたときは投稿だけをやり直す
+        if pending:
+            pending.keep(poster.remaining_text or response_text)
+        raise
+    if pending:
+        pending.text = None
+
+
+def generate_response(text, turns, channel, thread_ts, params, pending=None):
+    # チャンネルや質問の長さに応じて、FlowかConverseのどちらで回答を生成するかを選ぶ
+    backend = backends.get_backend(backends.select_backend_name(channel, text))
+
+    # 同じ質問への回答がキャッシュにあればBedrockを呼ばずに返す
+    # (会話の続きは文脈によって答えが変わるため、キャッシュしない)
+    cache_key = None
+    if not turns and response_cache.is_enabled_for_channel(channel):
+        cache_key = response_cache.make_cache_key(
+            text, *backend.get_cache_scope(params)
         )
-    except ClientError as e:
-        error_message = f"Bedrock Flowの呼び出しに失敗しました: {str(e)}"
-        print(error_message)
-        return {
-            "statusCode": 500,
-            "body": json.dumps({"message": error_message}),
-        }
+        with instrumentation.timer("CacheLookup"):
+            cached_text = response_cache.get_response_cache().get(cache_key)
+        instrumentation.put_metric("CacheHit", 1 if cached_text is not None else 0)
+        if cached_text is not None:
+            logger.info("Response cache hit", cache_key=cache_key)
+            post_answer(channel, cached_text, params, thread_ts)
+            return cached_text
 
-    response_text = ""
-    for event in response["responseStream"]:
-        if "flowOutputEvent" in event:
-            response_text = event["flowOutputEvent"]["content"]["document"]
-            print(f"Prompt Flow Response: {response_text}")
+    streamer = None
+    if is_streaming_enabled():
+        # 処理開始直後にスレッドへプレースホルダーを投稿し、以降はchat.updateで更新する
+        message_ts = post_message_to_channel(
+            channel,
+            STREAMING_PLACEHOLDER,
+            params["access_token"],
+            params["verify_token"],
+            thread_ts,
+        )
+        if message_ts:
+            streamer = slack.MessageStreamer(
+                lambda message: update_message(
+                    channel, message_ts, message, params["access_token"]
+                ),
+                get_stream_update_interval(),
+            )
+
+    # chat.updateで更新しない場合は、確定したチャンクからストリームの途中で投稿する
+    poster = None if streamer else AnswerPoster(channel, params, thread_ts)
+
+    # 一部のFlowの呼び出しだけトレースを有効にし、ノードごとの所要時間を記録する
+    traced = backend.name == backends.FLOW and flow_trace.is_sampled()
+
+    instrumentation.put_metric("PromptChars", len(text))
+    try:
+        # スロットリングなどの一時的な失敗は、ストリームの途中で起きたものも含めて再試行する
+        response_text = retry.get_retrier("Bedrock").call(
+            run_backend_attempt, backend, params, turns, text, streamer, poster, traced
+        )
+    except Exception as e:
+        logger.error(
+            "Bedrockの呼び出しに失敗しました", backend=backend.name, error=str(e)
+        )
+        # 再試行時に新しいプレースホルダーが投稿されるため、今回の分は削除する
+        # (BotoCoreErrorなどの接続エラーも含め、回答を書き込めなかった場合は必ず消す)
+        if streamer:
+            delete_message(channel, message_ts, params["access_token"])
+        raise
+
+    if cache_key and response_text:
+        response_cache.get_response_cache().set(cache_key, response_text)
+
+    if streamer:
+        # 上限を超える部分は、プレースホルダーの後に続けて投稿する
+        chunks = chunker.split_text(response_text, get_chunk_chars())
+        streamer.flush(chunks[0] if chunks else response_text)
+        if len(chunks) > 1:
+            post_answer(channel, "\n\n".join(chunks[1:]), params, thread_ts, pending)
+        return response_text
 
     # レスポンステキストを抽出してSlackチャンネルに投稿
-    post_message_to_channel(
-        channel, response_text, access_token, verify_token, thread_ts
-    )
+    post_answer(channel, response_text, params, thread_ts, pending, poster)
+    return response_text
 
-    return {
-        "statusCode": 200,
-        "body": json.dumps({"message": "Response posted to channel"}),
-    }
+
+def run_backend_attempt(backend, params, turns, text, streamer, poster, traced):
+    try:
+        return run_backend(backend, params, turns, text, streamer, poster, traced)
+    except Exception:
+        # 途中まで投稿したチャンクを削除し、再試行や再配信では回答を最初から投稿し直す
+        if poster:
+            poster.discard()
+        raise
+
+
+def run_backend(backend, params, turns, text, streamer, poster=None, traced=False):
+    # メトリクス名はバックエンドごとに分ける(FlowFirstEventLatency、ConverseFirstTextLatencyなど)
+    prefix = backend.metric_prefix
+    metrics = instrumentation.get_metrics()
+    tracer = flow_trace.FlowTrace() if traced else None
+    started = metrics.clock()
+    with instrumentation.timer(f"{prefix}Invoke"):
+        events = backend.invoke(
+            params, turns, text, trace=streamer is not None or traced
+        )
+
+    response_text = ""
+    first_event_at = None
+    for kind, value in events:
+        if first_event_at is None:
+            # Bedrockが最初のイベントを返すまでの時間
+            first_event_at = metrics.clock()
+            metrics.put(
+                f"{prefix}FirstEventLatency",
+                (first_event_at - started) * 1000,
+                "Milliseconds",
+            )
+        if kind == backends.TEXT:
+            if not response_text:
+                metrics.put(
+                    f"{prefix}FirstTextLatency",
+                    (metrics.clock() - started) * 1000,
+                    "Milliseconds",
+                )
+            response_text = value
+            logger.debug("Model response", backend=backend.name, response=value)
+            if streamer:
+                streamer.push(response_text)
+            if poster:
+                poster.update(response_text)
+        elif kind == backends.TRACE:
+            if tracer:
+                tracer.add(value)
+            if streamer and not response_text:
+                # 出力が届くまでは実行中のノード名を進捗として表示する
+                node_name = get_trace_node_name({"flowTraceEvent": value})
+                if node_name:
+                    streamer.push(f"{STREAMING_PLACEHOLDER} ({node_name})")
+
+    if first_event_at is not None:
+        metrics.put(
+            f"{prefix}StreamDrainLatency",
+            (metrics.clock() - first_event_at) * 1000,
+            "Milliseconds",
+        )
+    instrumentation.put_metric("ResponseChars", len(response_text))
+    if tracer:
+        tracer.emit(logger, metrics)
+    return response_text
+
+
+def timed_process_record(record, params):
+    instrumentation.put_metric("RecordBodyBytes", len(record["body"]), "Bytes")
+    with instrumentation.timer("Record"):
+        process_record(record, params)
+
+
+def get_queue_url(queue_arn):
+    # arn:aws:sqs:<region>:<account>:<name> からキューのURLを組み立てる
+    _, _, _, region, account, name = queue_arn.split(":", 5)
+    return f"https://sqs.{region}.amazonaws.com/{account}/{name}"
+
+
+def get_receive_count(record):
+    # このメッセージを受信した回数(直接起動の場合は1)
+    return int(record.get("attributes", {}).get("ApproximateReceiveCount", 1))
+
+
+def defer_record(record, delay_seconds):
+    # 可視性タイムアウトを待ち時間に合わせ、失敗として返したレコードをその後に再配信させる
+    if "receiptHandle" not in record or "eventSourceARN" not in record:
+        return False
+    try:
+        clients.get_client("sqs").change_message_visibility(
+            QueueUrl=get_queue_url(record["eventSourceARN"]),
+            ReceiptHandle=record["receiptHandle"],
+            VisibilityTimeout=delay_seconds,
+        )
+    except ClientError as e:
+        logger.error("Failed to extend visibility timeout", error=str(e))
+        return False
+    return True
+
+
+def process_records(records):
+    # SSMパラメータの取得
+    try:
+        params = get_ssm_parameters()
+    except ClientError:
+        # パラメータが取れない場合はバッチ全体を再試行させる
+        return [{"itemIdentifier": record["messageId"]} for record in records]
+
+    # バッチ内の全レコードを並列に処理し、失敗したものだけを再配信対象として返す
+    batch_item_failures = []
+    max_workers = min(get_flow_max_concurrency(), max(len(records), 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(timed_process_record, record, params) for record in records
+        ]
+        for record, future in zip(records, futures):
+            try:
+                future.result()
+            except Exception as e:
+                delay = retry.get_defer_seconds(
+                    e, receive_count=get_receive_count(record)
+                )
+                if delay is not None and defer_record(record, delay):
+                    logger.warning(
+                        "レコードの処理を後回しにしました",
+                        message_id=record["messageId"],
+                        delay_seconds=delay,
+                        error=str(e),
+                    )
+                    instrumentation.put_metric("DeferredRecords", 1)
+                else:
+                    logger.exception(
+                        "レコードの処理に失敗しました", message_id=record["messageId"]
+                    )
+                batch_item_failures.append({"itemIdentifier": record["messageId"]})
+
+    return batch_item_failures
+
+
+def main(event, context):
+    metrics = instrumentation.begin("sqs")
+    try:
+        return handle_event(event)
+    finally:
+        metrics.flush()
+
+
+def handle_event(event):
+    # イベントの内容はDEBUGレベルでのみ出力する
+    logger.debug("Received event", event=event)
+    records = event.get("Records", [])
+    instrumentation.put_metric("BatchSize", len(records))
+    batch_item_failures = process_records(records)
+    instrumentation.put_metric("FailedRecords", len(batch_item_failures))
+
+    # 非同期で直接起動された場合は例外にして、Lambdaの再試行とDLQに任せる
+    if batch_item_failures and any(
+        record.get("eventSource") == dispatch.DIRECT_EVENT_SOURCE for record in records
+    ):
+        raise RuntimeError(f"レコードの処理に失敗しました: {batch_item_failures}")
+
+    return {"batchItemFailures": batch_item_failures}
@@ -1,7 +1,6 @@
 import invoke
 import logging
 import os
-import boto3
 import shutil
 
 logger = logging.getLogger(__name__)
@@ -14,20 +13,6 @@ def invoke_run(command):
     invoke.run(command, pty=True)
 
 
-def get_aws_account_info():
-    # セッションを作成
-    session = boto3.session.Session()
-
-    # STSクライアントを使用してアカウントIDを取得
-    sts_client = session.client("sts")
-    account_id = sts_client.get_caller_identity()["Account"]
-
-    # セッションからリージョン名を取得
-    region = session.region_name
-
-    return account_id, region
-
-
 @invoke.task
 def env(c):
     invoke_run("python3 -m venv .venv")
@@ -61,28 +46,44 @@ def hotswap(c):
 
 
 @invoke.task
-def tailf(c):
-    function_name = os.getenv("LAMBDA_FUNCTION_NAME")
-    if not function_name:
-        print("LAMBDA_FUNCTION_NAME 環境変数が設定されていません")
-        return
+def tailf(c, filter="", interval=30, quiet=False):
+    # APIとワーカーのログをまとめてライブテールし、所要時間とコールドスタート率を定期的に集計する
+    # (LAMBDA_FUNCTION_NAMEに「API,ワーカー」の順で関数名を指定できる。未指定ならスタックの出力を使う)
+    options = f"--interval {interval}"
+    function_names = os.getenv("LAMBDA_FUNCTION_NAME")
+    if function_names:
+        options += f" --function-names {function_names}"
+    if filter:
+        options += "".join(f" --filter {f}" for f in filter.split(","))
+    if quiet:
+        options += " --quiet"
+    invoke_run(f"python3 -m bedrock_bot.logs tail {options}")
+
 
-    client = boto3.client("logs")
-    account_id, region = get_aws_account_info()
-    try:
-        response = client.start_live_tail(
-            logGroupIdentifiers=[
-                f"arn:aws:logs:{region}:{account_id}:log-group:/aws/lambda/{function_name}"
-            ]
-        )
-        for event in response["responseStream"]:
-            if "sessionUpdate" in event:
-                for log_event in event["sessionUpdate"]["sessionResults"]:
-                    print(f"{log_event['timestamp']}: {log_event['message']}")
-    except client.exceptions.SessionTimeoutException as e:
-        print(f"セッションがタイムアウトしました: {e.message}")
-    except client.exceptions.SessionStreamingException as e:
-        print(f"ストリーミングエラーが発生しました: {e.message}")
+@invoke.task
+def logs(c, files, filter=""):
+    # 保存したログファイル(aws logs tail/filter-log-eventsの出力)をtailfと同じ方法で集計する
+    options = "".join(f" --filter {f}" for f in filter.split(",") if f)
+    invoke_run(f"python3 -m bedrock_bot.logs analyze {files}{options}")
+
+
+@invoke.task
+def redrive(
+    c,
+    target="queue",
+    rate=5.0,
+    workers=4,
+    max_messages=0,
+    dry_run=False,
+    stack_name="BedrockBotStack",
+):
+    # DLQのメッセージを重複を除いてキューへ戻す(target=directならワーカーLambdaを直接起動する)
+    options = f"--target {target} --rate {rate} --workers {workers}"
+    if max_messages:
+        options += f" --max-messages {max_messages}"
+    if dry_run:
+        options += " --dry-run"
+    invoke_run(f"python3 -m bedrock_bot.redrive --stack-name {stack_name} {options}")
 
 
 def call_api(c):
@@ -101,3 +102,33 @@ def test(c):
 @invoke.task
 def test_unit(c):
     invoke_run("pytest -v tests/unit")
+
+
+@invoke.task
+def test_load(c):
+    invoke_run("pytest -v tests/load")
+
+
+@invoke.task
+def bench(c, output="bench_output.txt"):
+    # ローカルのスタブでSlackイベントのバーストを処理し、結果をJSONで出力
+    invoke_run(f"python3 -m tests.load.harness --output {output}")
+
+
+@invoke.task
+def bench_import(c, output="bench_import_output.txt"):
+    # ハンドラのimport時間(コールドスタートのINIT)を新しいプロセスで計測する
+    invoke_run(f"python3 -m tests.load.import_time --output {output}")
+
+
+@invoke.task
+def bench_enqueue(c, output="bench_enqueue_output.txt"):
+    # ローカルのSQSで、従来の送信と本文の削減・バッチ送信を比べる
+    invoke_run(f"python3 -m tests.load.enqueue_path --output {output}")
+
+
+@invoke.task
+def bench_power(c, events="", output="bench_power_output.txt"):
+    # 記録したイベントを各ハンドラで再生し、メモリとアーキテクチャごとのコストを比べる
+    events_option = f"--events {events} " if events else ""
+    invoke_run(f"python3 -m tests.load.power_tuning {events_option}--output {output}")
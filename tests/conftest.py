@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+# Lambdaレイヤー(/opt/python)に載る共通モジュールをテストからimportできるようにする
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "lambda_module", "layer"),
+)
+
+from bedrock_bot_common import (  # noqa: E402
+    backends,
+    history,
+    idempotency,
+    parameters,
+    rate_limit,
+    response_cache,
+    retry,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_module_caches():
+    # ウォームコンテナを想定したモジュール単位のキャッシュをテストごとに破棄する
+    parameters.invalidate()
+    backends.reset()
+    response_cache.reset()
+    idempotency.reset()
+    history.reset()
+    rate_limit.reset()
+    retry.reset()
+    yield
+    parameters.invalidate()
+    backends.reset()
+    response_cache.reset()
+    idempotency.reset()
+    history.reset()
+    rate_limit.reset()
+    retry.reset()
@@ -0,0 +1,158 @@
+import argparse
+import json
+import time
+
+from tests.load import harness
+from bedrock_bot_common import dispatch, enqueue
+
+QUEUE_URL = "https://sqs.local/bench"
+
+# SQSのAPI呼び出し1回あたりの往復時間(秒)と、送るデータ量に比例する時間(秒/KB)
+DEFAULT_ROUND_TRIP = 0.008
+DEFAULT_SECONDS_PER_KB = 0.00005
+
+
+class LatencyQueue(harness.InProcessQueue):
+    # 呼び出しごとに往復時間と転送時間だけ待つローカルのSQS
+
+    def __init__(self, round_trip, seconds_per_kb):
+        super().__init__()
+        self.round_trip = round_trip
+        self.seconds_per_kb = seconds_per_kb
+        self.calls = 0
+        self.bytes = 0
+
+    def wait(self, payload_bytes):
+        self.calls += 1
+        self.bytes += payload_bytes
+        time.sleep(self.round_trip + payload_bytes / 1024 * self.seconds_per_kb)
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        self.wait(len(MessageBody.encode("utf-8")))
+        return super().send_message(QueueUrl, MessageBody)
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.wait(sum(len(e["MessageBody"].encode("utf-8")) for e in Entries))
+        successful = []
+        for entry in Entries:
+            response = super().send_message(QueueUrl, entry["MessageBody"])
+            successful.append({"Id": entry["Id"], "MessageId": response["MessageId"]})
+        return {"Successful": successful, "Failed": []}
+
+
+def make_full_body(index, text_chars=200):
+    # Slackが送るイベント本文(blocksやauthorizationsなど、ワーカーが使わないフィールドを含む)
+    text = f"<@U000BOT> question {index} " + "あ" * text_chars
+    return {
+        "token": harness.VERIFY_TOKEN,
+        "team_id": "T000BENCH",
+        "api_app_id": "A000BENCH",
+        "type": "event_callback",
+        "event_id": f"Ev{index:06d}",
+        "event_time": 1700000000,
+        "authorizations": [
+            {
+                "enterprise_id": None,
+                "team_id": "T000BENCH",
+                "user_id": "U000BOT",
+                "is_bot": True,
+                "is_enterprise_install": False,
+            }
+        ],
+        "is_ext_shared_channel": False,
+        "event_context": "4-eyJldCI6ImFwcF9tZW50aW9uIiwidGlkIjoiVDAwMEJFTkNIIn0",
+        "event": {
+            "type": "app_mention",
+            "user": "U000BENCH",
+            "text": text,
+            "ts": f"1700000000.{index:06d}",
+            "client_msg_id": f"00000000-0000-0000-0000-{index:012d}",
+            "team": "T000BENCH",
+            "blocks": [
+                {
+                    "type": "rich_text",
+                    "block_id": "b1",
+                    "elements": [
+                        {
+                            "type": "rich_text_section",
+                            "elements": [
+                                {"type": "user", "user_id": "U000BOT"},
+                                {"type": "text", "text": text[len("<@U000BOT>") :]},
+                            ],
+                        }
+                    ],
+                }
+            ],
+            "channel": f"C{index % 5:08d}",
+            "event_ts": f"1700000000.{index:06d}",
+        },
+    }
+
+
+def run_path(name, bodies, round_trip, seconds_per_kb):
+    sqs = LatencyQueue(round_trip, seconds_per_kb)
+    dispatcher = dispatch.SqsDispatcher(QUEUE_URL, client=sqs)
+    started = time.perf_counter()
+    if name == "current":
+        # 従来の経路: 本文をそのままイベントごとにsend_messageで送る
+        for body in bodies:
+            sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=json.dumps(body))
+    elif name == "slim":
+        for body in bodies:
+            dispatcher.dispatch(enqueue.slim_body(body))
+    else:
+        dispatcher.dispatch_batch([enqueue.slim_body(body) for body in bodies])
+    elapsed = time.perf_counter() - started
+    return {
+        "path": name,
+        "messages": len(bodies),
+        "sqs_calls": sqs.calls,
+        "bytes_per_message": round(sqs.bytes / len(bodies), 1),
+        "ms_per_message": round(elapsed / len(bodies) * 1000, 3),
+    }
+
+
+def run_benchmark(
+    messages=50,
+    text_chars=200,
+    round_trip=DEFAULT_ROUND_TRIP,
+    seconds_per_kb=DEFAULT_SECONDS_PER_KB,
+):
+    bodies = [make_full_body(i, text_chars) for i in range(messages)]
+    results = {
+        name: run_path(name, bodies, round_trip, seconds_per_kb)
+        for name in ("current", "slim", "batch")
+    }
+    return {
+        "round_trip_ms": round_trip * 1000,
+        "text_chars": text_chars,
+        "results": results,
+        "speedup": {
+            name: round(
+                results["current"]["ms_per_message"] / result["ms_per_message"], 2
+            )
+            for name, result in results.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="ローカルのSQSで、従来の送信と本文の削減・バッチ送信をメッセージあたりの時間とバイト数で比べる"
+    )
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--text-chars", type=int, default=200)
+    parser.add_argument("--round-trip", type=float, default=DEFAULT_ROUND_TRIP)
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル")
+    args = parser.parse_args()
+    text = json.dumps(
+        run_benchmark(args.messages, args.text_chars, args.round_trip), indent=2
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
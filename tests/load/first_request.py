@@ -0,0 +1,83 @@
+import hashlib
+import hmac
+import json
+import time
+
+# 初回リクエストの計測で設定する環境変数(SSMのパラメータ名はreplyが解決する)
+ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "SLACK_BOT_USER_ACCESS_TOKEN": "/bench/access",
+    "SLACK_BOT_VERIFY_TOKEN": "/bench/verify",
+    "SLACK_SIGNING_SECRET": "/bench/signing",
+    "SQS_QUEUE_URL": "https://sqs.us-east-1.amazonaws.com/123456789012/bench",
+    "DISPATCH_MODE": "sqs",
+    "IDEMPOTENCY_TABLE": "bench-idempotency",
+    "RATE_LIMIT_TABLE": "bench-rate-limit",
+    "LOG_LEVEL": "WARNING",
+}
+SIGNING_SECRET = "bench-signing-secret"
+
+
+class StubHttpResponse:
+    status_code = 200
+
+
+def reply(model, params, **kwargs):
+    # AWSへは送らず、botocoreのbefore-callでその場の応答を返す
+    # (boto3の読み込みとクライアントの作成は本物のまま計測する)
+    if model.name == "GetParameters":
+        names = json.loads(params["body"])["Names"]
+        parsed = {
+            "Parameters": [{"Name": name, "Value": SIGNING_SECRET} for name in names],
+            "InvalidParameters": [],
+        }
+    elif model.name == "SendMessage":
+        parsed = {"MessageId": "bench"}
+    else:
+        parsed = {}
+    return StubHttpResponse(), parsed
+
+
+def install():
+    # ハンドラが作るクライアントにreplyを登録する
+    from bedrock_bot_common import clients
+
+    get_client = clients.get_client
+
+    def get_stubbed_client(service_name, region_name=None):
+        client = get_client(service_name, region_name)
+        client.meta.events.register("before-call", reply, unique_id="bench-reply")
+        return client
+
+    clients.get_client = get_stubbed_client
+
+
+def make_event():
+    body = json.dumps(
+        {
+            "type": "event_callback",
+            "event_id": "EvBENCH",
+            "event": {
+                "type": "app_mention",
+                "user": "U000BENCH",
+                "text": "<@U000BOT> question",
+                "channel": "C000BENCH",
+                "event_ts": "1.000001",
+            },
+        }
+    )
+    timestamp = str(int(time.time()))
+    signature = hmac.new(
+        SIGNING_SECRET.encode("utf-8"),
+        f"v0:{timestamp}:{body}".encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+    return {
+        "headers": {
+            "X-Slack-Request-Timestamp": timestamp,
+            "X-Slack-Signature": f"v0={signature}",
+        },
+        "body": body,
+    }
@@ -0,0 +1,390 @@
+import argparse
+import contextlib
+import hashlib
+import hmac
+import importlib
+import io
+import itertools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# python -m tests.load.harness で実行した場合もレイヤーの共通モジュールを読めるようにする
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LAYER_DIR = os.path.join(ROOT_DIR, "lambda_module", "layer")
+if LAYER_DIR not in sys.path:
+    sys.path.insert(0, LAYER_DIR)
+
+from bedrock_bot_common import (  # noqa: E402
+    backends,
+    clients,
+    idempotency,
+    instrumentation,
+    parameters,
+    response_cache,
+    slack,
+)
+
+# ベンチマーク用に設定する環境変数(SSMのパラメータ名はFakeSSMClientが解決する)
+BENCHMARK_ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "SLACK_BOT_USER_ACCESS_TOKEN": "/bench/access",
+    "SLACK_BOT_VERIFY_TOKEN": "/bench/verify",
+    "SLACK_SIGNING_SECRET": "/bench/signing",
+    "FLOW_IDENTIFIER": "/bench/flow",
+    "FLOW_ALIAS_IDENTIFIER": "/bench/alias",
+    "SQS_QUEUE_URL": "https://sqs.local/bench",
+    "DISPATCH_MODE": "sqs",
+    "RESPONSE_CACHE_TTL": "0",
+    "LOG_LEVEL": "WARNING",
+}
+VERIFY_TOKEN = "bench-verify-token"
+SIGNING_SECRET = "bench-signing-secret"
+
+
+class FakeSSMClient:
+    def get_parameters(self, Names, WithDecryption):
+        values = {"/bench/verify": VERIFY_TOKEN, "/bench/signing": SIGNING_SECRET}
+        return {
+            "Parameters": [
+                {"Name": name, "Value": values.get(name, name)} for name in Names
+            ],
+            "InvalidParameters": [],
+        }
+
+
+class InProcessQueue:
+    # send_message/send_message_batchを受け付けるプロセス内のSQS
+
+    def __init__(self):
+        self._messages = queue.Queue()
+        self._ids = itertools.count(1)
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        message_id = f"msg-{next(self._ids)}"
+        self._messages.put({"messageId": message_id, "body": MessageBody})
+        return {"MessageId": message_id}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        successful = []
+        for entry in Entries:
+            response = self.send_message(QueueUrl, entry["MessageBody"])
+            successful.append({"Id": entry["Id"], "MessageId": response["MessageId"]})
+        return {"Successful": successful, "Failed": []}
+
+    def receive(self, max_messages, wait_seconds):
+        # バッチウィンドウの間だけ待ってmax_messages件までまとめて受け取る
+        records = []
+        deadline = time.monotonic() + wait_seconds
+        while len(records) < max_messages:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                message = self._messages.get(timeout=timeout)
+            except queue.Empty:
+                break
+            records.append(dict(message, eventSource="aws:sqs"))
+        return records
+
+
+class FakeFlowRuntime:
+    # 最初のイベントまでの待ち時間とトークン数を指定できるBedrock Flowの代替
+
+    def __init__(self, first_event_latency=0.05, tokens=20, token_interval=0.001):
+        self.first_event_latency = first_event_latency
+        self.tokens = tokens
+        self.token_interval = token_interval
+
+    def invoke_flow(self, flowIdentifier, flowAliasIdentifier, inputs, **kwargs):
+        text = inputs[0]["content"]["document"]
+        time.sleep(self.first_event_latency)
+        return {"responseStream": self._stream(text, kwargs.get("enableTrace"))}
+
+    def _stream(self, text, enable_trace):
+        for i in range(self.tokens):
+            if enable_trace:
+                yield {
+                    "flowTraceEvent": {
+                        "trace": {"nodeOutputTrace": {"nodeName": f"Node{i}"}}
+                    }
+                }
+            time.sleep(self.token_interval)
+        yield {"flowOutputEvent": {"content": {"document": f"answer: {text}"}}}
+        yield {"flowCompletionEvent": {"completionReason": "SUCCESS"}}
+
+
+class SlackSinkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        received_at = time.perf_counter()
+        length = int(self.headers["Content-Length"])
+        payload = json.loads(self.rfile.read(length))
+        method = self.path.rsplit("/", 1)[-1]
+        self.server.record(method, payload, received_at)
+        body = json.dumps({"ok": True, "ts": f"{received_at:.6f}"}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SlackSink(ThreadingHTTPServer):
+    # Slack Web APIの代わりに投稿を受け取るローカルHTTPサーバー
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SlackSinkHandler)
+        self.posts = []
+        self.lock = threading.Lock()
+        self.delivered = threading.Condition(self.lock)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/api/"
+
+    def record(self, method, payload, received_at):
+        with self.lock:
+            self.posts.append((method, payload, received_at))
+            self.delivered.notify_all()
+
+    def wait_for(self, count, timeout):
+        with self.lock:
+            return self.delivered.wait_for(
+                lambda: len(self.answers()) >= count, timeout
+            )
+
+    def answers(self):
+        return [post for post in self.posts if post[0] == "chat.postMessage"]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "p50": round(pick(50), 3),
+        "p95": round(pick(95), 3),
+        "p99": round(pick(99), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def make_slack_event(index, run_id):
+    body = {
+        "token": VERIFY_TOKEN,
+        "type": "event_callback",
+        "event_id": f"Ev{run_id}{index:06d}",
+        "event": {
+            "type": "app_mention",
+            "user": "U000BENCH",
+            "text": f"<@U000BOT> question {run_id}-{index}",
+            "channel": f"C{index % 5:08d}",
+            "event_ts": f"{run_id}.{index:06d}",
+        },
+    }
+    raw_body = json.dumps(body)
+    timestamp = str(int(time.time()))
+    signature = hmac.new(
+        SIGNING_SECRET.encode("utf-8"),
+        f"v0:{timestamp}:{raw_body}".encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+    return {
+        "headers": {
+            "X-Slack-Request-Timestamp": timestamp,
+            "X-Slack-Signature": f"v0={signature}",
+        },
+        "body": raw_body,
+    }
+
+
+def reset_container():
+    # コールドスタートを再現するため、モジュール単位のキャッシュを破棄する
+    parameters.invalidate()
+    clients.reset()
+    backends.reset()
+    slack.reset()
+    response_cache.reset()
+    idempotency.reset()
+    instrumentation._cold_start = True
+
+
+@contextlib.contextmanager
+def local_environment(sink_url):
+    saved = {
+        key: os.environ.get(key) for key in [*BENCHMARK_ENVIRONMENT, "SLACK_API_URL"]
+    }
+    os.environ.update(BENCHMARK_ENVIRONMENT, SLACK_API_URL=sink_url)
+    instrumentation.configure_logging()
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        instrumentation.configure_logging()
+        reset_container()
+
+
+def install_fakes(flow_runtime, sqs_queue):
+    clients.set_client("ssm", FakeSSMClient())
+    clients.set_client("sqs", sqs_queue)
+    clients.set_client("bedrock-agent-runtime", flow_runtime, "us-east-1")
+
+
+def run_benchmark(
+    bursts=5,
+    burst_size=20,
+    burst_interval=0.05,
+    api_concurrency=10,
+    worker_pollers=2,
+    batch_size=10,
+    batching_window=0.02,
+    first_event_latency=0.05,
+    tokens=20,
+    token_interval=0.001,
+    timeout=60,
+):
+    flow_runtime = FakeFlowRuntime(first_event_latency, tokens, token_interval)
+    sqs_queue = InProcessQueue()
+    total = bursts * burst_size
+    run_id = int(time.time())
+    sent_at = {}
+    api_timings = []
+    worker_timings = []
+    timings_lock = threading.Lock()
+
+    with SlackSink() as sink, local_environment(sink.url):
+        # ハンドラを読み込み直し、最初の呼び出しをコールドスタートとして計測する
+        reset_container()
+        reload_started = time.perf_counter()
+        api_handler = importlib.reload(
+            importlib.import_module("lambda_module.api.handler")
+        )
+        sqs_handler = importlib.reload(
+            importlib.import_module("lambda_module.sqs.handler")
+        )
+        handler_reload_ms = (time.perf_counter() - reload_started) * 1000
+        install_fakes(flow_runtime, sqs_queue)
+
+        output = io.StringIO()
+        stop = threading.Event()
+
+        def call_api(index):
+            event = make_slack_event(index, run_id)
+            started = time.perf_counter()
+            sent_at[f"question {run_id}-{index}"] = started
+            response = api_handler.main(event, None)
+            with timings_lock:
+                api_timings.append((time.perf_counter() - started) * 1000)
+            return response["statusCode"]
+
+        def poll_worker():
+            while not stop.is_set():
+                records = sqs_queue.receive(batch_size, batching_window)
+                if not records:
+                    continue
+                started = time.perf_counter()
+                sqs_handler.main({"Records": records}, None)
+                with timings_lock:
+                    worker_timings.append((time.perf_counter() - started) * 1000)
+
+        with contextlib.redirect_stdout(output):
+            started = time.perf_counter()
+            pollers = [
+                threading.Thread(target=poll_worker, daemon=True)
+                for _ in range(worker_pollers)
+            ]
+            for poller in pollers:
+                poller.start()
+            statuses = []
+            with ThreadPoolExecutor(max_workers=api_concurrency) as executor:
+                for burst in range(bursts):
+                    indexes = range(burst * burst_size, (burst + 1) * burst_size)
+                    statuses.extend(executor.map(call_api, indexes))
+                    time.sleep(burst_interval)
+            sink.wait_for(total, timeout)
+            duration = time.perf_counter() - started
+            stop.set()
+            for poller in pollers:
+                poller.join()
+
+        latencies = []
+        for _, payload, received_at in sink.answers():
+            # ワーカーは質問からボットへのメンションを除いてFlowに渡す
+            question = payload["text"].removeprefix("answer: ")
+            if question in sent_at:
+                latencies.append((received_at - sent_at[question]) * 1000)
+
+    return {
+        "messages": total,
+        "accepted": statuses.count(200),
+        "delivered": len(latencies),
+        "duration_seconds": round(duration, 3),
+        "messages_per_second": round(len(latencies) / duration, 2) if duration else 0,
+        "latency_ms": percentiles(latencies),
+        "cold": {
+            "handler_reload_ms": round(handler_reload_ms, 3),
+            "api_first_ms": round(api_timings[0], 3) if api_timings else None,
+            "worker_first_ms": round(worker_timings[0], 3) if worker_timings else None,
+        },
+        "warm": {
+            "api_ms": percentiles(api_timings[1:]),
+            "worker_batch_ms": percentiles(worker_timings[1:]),
+        },
+        "emf_lines": output.getvalue().count('"_aws"'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Slackイベントのバーストをローカルのスタブで処理し、スループットとレイテンシをJSONで出力する"
+    )
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--burst-size", type=int, default=20)
+    parser.add_argument("--burst-interval", type=float, default=0.05)
+    parser.add_argument("--api-concurrency", type=int, default=10)
+    parser.add_argument("--worker-pollers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--batching-window", type=float, default=0.02)
+    parser.add_argument("--first-event-latency", type=float, default=0.05)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--token-interval", type=float, default=0.001)
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル")
+    args = vars(parser.parse_args())
+    output_path = args.pop("output")
+
+    report = json.dumps(run_benchmark(**args), indent=2)
+    print(report)
+    if output_path:
+        with open(output_path, "w") as f:
+            f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
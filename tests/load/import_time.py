@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from tests.load.first_request import ENVIRONMENT
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LAYER = os.path.join(ROOT, "lambda_module", "layer")
+
+HANDLERS = ("lambda_module.api.handler", "lambda_module.sqs.handler")
+API_HANDLER = "lambda_module.api.handler"
+
+# 新しいプロセスでハンドラを読み込み(必要なら続けて最初のリクエストを処理し)、
+# かかった時間と読み込み直後の重いモジュールの有無を出力する
+PROBE = """
+import importlib, json, sys, time
+module, preload, first_request = sys.argv[1], sys.argv[2], sys.argv[3] == "1"
+if first_request:
+    from tests.load import first_request as stub
+    stub.install()
+start = time.perf_counter()
+for name in filter(None, preload.split(",")):
+    importlib.import_module(name)
+handler = importlib.import_module(module)
+imported = time.perf_counter()
+boto3_loaded = "boto3" in sys.modules
+status = handler.main(stub.make_event(), {})["statusCode"] if first_request else None
+print(json.dumps({
+    "import_seconds": imported - start,
+    "first_request_seconds": time.perf_counter() - imported,
+    "boto3_loaded": boto3_loaded,
+    "status": status,
+}))
+"""
+
+
+def median_ms(samples, key):
+    return round(statistics.median(s[key] for s in samples) * 1000, 2)
+
+
+def measure(module, preload=(), runs=5, first_request=False, environment=None):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([LAYER, ROOT]))
+    if first_request:
+        env.update(ENVIRONMENT)
+    env.update(environment or {})
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                PROBE,
+                module,
+                ",".join(preload),
+                "1" if first_request else "0",
+            ],
+            cwd=ROOT,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        "median_ms": median_ms(samples, "import_seconds"),
+        "first_request_ms": median_ms(samples, "first_request_seconds"),
+        "boto3_loaded": samples[0]["boto3_loaded"],
+        "status": samples[0]["status"],
+    }
+
+
+def measure_first_request(runs=5, warm_on_init=False):
+    # INIT(import)と最初のリクエストを合わせて計測する
+    # (SnapStartやプロビジョニング済み同時実行ではINITは利用者を待たせないため、first_request_msが効く)
+    result = measure(
+        API_HANDLER,
+        runs=runs,
+        first_request=True,
+        environment={"WARM_ON_INIT": "true" if warm_on_init else "false"},
+    )
+    return {
+        "init_ms": result["median_ms"],
+        "first_request_ms": result["first_request_ms"],
+        "total_ms": round(result["median_ms"] + result["first_request_ms"], 2),
+        "boto3_loaded_at_init": result["boto3_loaded"],
+        "status": result["status"],
+    }
+
+
+def run_benchmark(runs=5):
+    # boto3をモジュールの読み込み時にimportしていた従来の構成を、先に読み込むことで再現して比べる
+    report = {"runs": runs, "handlers": {}}
+    for module in HANDLERS:
+        lazy = measure(module, runs=runs)
+        eager = measure(module, preload=("boto3",), runs=runs)
+        report["handlers"][module] = {
+            "lazy_ms": lazy["median_ms"],
+            "eager_ms": eager["median_ms"],
+            "saved_ms": round(eager["median_ms"] - lazy["median_ms"], 2),
+            "boto3_loaded": lazy["boto3_loaded"],
+        }
+    # 遅延読み込みのままの場合と、INITで温めておく場合(WARM_ON_INIT)の初回リクエストを比べる
+    report["first_request"] = {
+        "lazy": measure_first_request(runs),
+        "warm_on_init": measure_first_request(runs, warm_on_init=True),
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="ハンドラのimportと最初のリクエストにかかる時間を新しいプロセスで計測し、JSONで出力する"
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル")
+    args = parser.parse_args()
+    text = json.dumps(run_benchmark(args.runs), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
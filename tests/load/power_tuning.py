@@ -0,0 +1,265 @@
+import argparse
+import contextlib
+import hashlib
+import hmac
+import importlib
+import io
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from tests.load import harness
+
+# Lambdaは1,769MBで1vCPU相当になり、それ未満ではメモリに比例してCPUが割り当てられる
+FULL_VCPU_MEMORY_MB = 1769
+
+# GB秒あたりの料金とリクエスト料金(us-east-1、USD)
+PRICE_PER_GB_SECOND = {"x86_64": 0.0000166667, "arm64": 0.0000133334}
+PRICE_PER_REQUEST = 0.0000002
+
+DEFAULT_MEMORY_SIZES = (128, 256, 512, 1024, 1769)
+DEFAULT_BATCH_SIZES = (1, 5, 10)
+HANDLERS = ("api", "worker")
+
+
+def load_events(path):
+    # 記録したAPI Gatewayのイベント(JSONの配列かJSON Lines)を読み込む
+    with open(path) as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def resign(event):
+    # 記録時の署名は使えないため、ベンチマーク用のシークレットと現在時刻で署名し直す
+    raw_body = event.get("body") or "{}"
+    timestamp = str(int(time.time()))
+    signature = hmac.new(
+        harness.SIGNING_SECRET.encode("utf-8"),
+        f"v0:{timestamp}:{raw_body}".encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+    return {
+        "headers": {
+            "X-Slack-Request-Timestamp": timestamp,
+            "X-Slack-Signature": f"v0={signature}",
+        },
+        "body": raw_body,
+    }
+
+
+def make_sqs_batches(events, batch_size):
+    records = [
+        {"messageId": f"msg-{i}", "eventSource": "aws:sqs", "body": event["body"]}
+        for i, event in enumerate(events)
+    ]
+    return [
+        {"Records": records[i : i + batch_size]}
+        for i in range(0, len(records), batch_size)
+    ]
+
+
+def measure_in_process(handler_name, events, batch_size, first_event_latency, tokens):
+    # 1つのプロセスでハンドラにイベントを流し、CPU時間・経過時間・最大RSSを測る
+    flow_runtime = harness.FakeFlowRuntime(first_event_latency, tokens, 0)
+    with harness.SlackSink() as sink, harness.local_environment(sink.url):
+        harness.reset_container()
+        module = importlib.import_module(
+            "lambda_module.api.handler"
+            if handler_name == "api"
+            else "lambda_module.sqs.handler"
+        )
+        harness.install_fakes(flow_runtime, harness.InProcessQueue())
+        if handler_name == "api":
+            invocations = [resign(event) for event in events]
+        else:
+            invocations = make_sqs_batches(events, batch_size)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            cpu_started = time.process_time()
+            wall_started = time.perf_counter()
+            for event in invocations:
+                module.main(event, None)
+            wall_seconds = time.perf_counter() - wall_started
+            cpu_seconds = time.process_time() - cpu_started
+
+    return {
+        "handler": handler_name,
+        "batch_size": batch_size if handler_name == "worker" else 1,
+        "messages": len(events),
+        "invocations": len(invocations),
+        "cpu_seconds": cpu_seconds,
+        "wall_seconds": wall_seconds,
+        # Linuxのru_maxrssはKB単位
+        "rss_before_mb": round(rss_before / 1024, 1),
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def measure(handler_name, events_path, batch_size, first_event_latency, tokens):
+    # 最大RSSがほかの計測に影響しないよう、計測ごとに新しいプロセスで実行する
+    out = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "tests.load.power_tuning",
+            "--measure",
+            handler_name,
+            "--events",
+            events_path,
+            "--batch-sizes",
+            str(batch_size),
+            "--first-event-latency",
+            str(first_event_latency),
+            "--tokens",
+            str(tokens),
+        ],
+        cwd=harness.ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def simulate(measurement, architecture, memory_mb, arm64_cpu_factor=1.0):
+    # CPU時間だけがメモリ(vCPUの割り当て)とアーキテクチャの影響を受け、I/O待ちは変わらないと仮定する
+    cpu_share = min(1.0, memory_mb / FULL_VCPU_MEMORY_MB)
+    cpu_factor = arm64_cpu_factor if architecture == "arm64" else 1.0
+    invocations = measurement["invocations"]
+    cpu = measurement["cpu_seconds"] / invocations
+    wait = max(0.0, measurement["wall_seconds"] / invocations - cpu)
+    duration_ms = (cpu * cpu_factor / cpu_share + wait) * 1000
+    billed_seconds = math.ceil(duration_ms) / 1000
+    invocation_cost = (
+        memory_mb / 1024 * billed_seconds * PRICE_PER_GB_SECOND[architecture]
+        + PRICE_PER_REQUEST
+    )
+    return {
+        "handler": measurement["handler"],
+        "architecture": architecture,
+        "memory_mb": memory_mb,
+        "batch_size": measurement["batch_size"],
+        "duration_ms": round(duration_ms, 3),
+        "cpu_ms_per_message": round(
+            measurement["cpu_seconds"] / measurement["messages"] * 1000, 3
+        ),
+        "peak_rss_mb": measurement["peak_rss_mb"],
+        # 最大RSSがメモリ設定を超える構成はLambdaでは動かない
+        "fits": measurement["peak_rss_mb"] <= memory_mb,
+        "cost_per_message_usd": invocation_cost * invocations / measurement["messages"],
+    }
+
+
+def run_benchmark(
+    events_path=None,
+    messages=50,
+    memory_sizes=DEFAULT_MEMORY_SIZES,
+    batch_sizes=DEFAULT_BATCH_SIZES,
+    architectures=("x86_64", "arm64"),
+    arm64_cpu_factor=1.0,
+    first_event_latency=0.01,
+    tokens=20,
+):
+    with tempfile.TemporaryDirectory() as tmp:
+        if events_path is None:
+            # 記録したイベントがなければ、負荷試験と同じ形のイベントを生成して使う
+            events_path = os.path.join(tmp, "events.jsonl")
+            run_id = int(time.time())
+            with open(events_path, "w") as f:
+                for i in range(messages):
+                    f.write(json.dumps(harness.make_slack_event(i, run_id)) + "\n")
+
+        measurements = [measure("api", events_path, 1, first_event_latency, tokens)] + [
+            measure("worker", events_path, batch_size, first_event_latency, tokens)
+            for batch_size in batch_sizes
+        ]
+
+    configurations = [
+        simulate(measurement, architecture, memory_mb, arm64_cpu_factor)
+        for measurement in measurements
+        for architecture in architectures
+        for memory_mb in memory_sizes
+    ]
+    best = {}
+    for handler_name in HANDLERS:
+        candidates = [
+            c for c in configurations if c["handler"] == handler_name and c["fits"]
+        ]
+        if candidates:
+            best[handler_name] = min(
+                candidates, key=lambda c: (c["cost_per_message_usd"], c["duration_ms"])
+            )
+    return {
+        "measurements": measurements,
+        "configurations": sorted(
+            configurations,
+            key=lambda c: (c["handler"], c["cost_per_message_usd"]),
+        ),
+        "best": best,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="イベントを各ハンドラで再生し、メモリとアーキテクチャごとのメッセージあたりのコストをJSONで出力する"
+    )
+    parser.add_argument("--events", help="記録したAPI Gatewayイベント(JSON/JSON Lines)")
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument(
+        "--memory-sizes", default=",".join(map(str, DEFAULT_MEMORY_SIZES))
+    )
+    parser.add_argument(
+        "--batch-sizes", default=",".join(map(str, DEFAULT_BATCH_SIZES))
+    )
+    parser.add_argument(
+        "--arm64-cpu-factor",
+        type=float,
+        default=1.0,
+        help="arm64でのCPU時間のx86_64に対する比(実機で測った値があれば指定する)",
+    )
+    parser.add_argument("--first-event-latency", type=float, default=0.01)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--measure", choices=HANDLERS, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル")
+    args = parser.parse_args()
+    batch_sizes = [int(value) for value in args.batch_sizes.split(",")]
+
+    if args.measure:
+        result = measure_in_process(
+            args.measure,
+            load_events(args.events),
+            batch_sizes[0],
+            args.first_event_latency,
+            args.tokens,
+        )
+        print(json.dumps(result))
+        return
+
+    report = run_benchmark(
+        events_path=args.events,
+        messages=args.messages,
+        memory_sizes=[int(value) for value in args.memory_sizes.split(",")],
+        batch_sizes=batch_sizes,
+        arm64_cpu_factor=args.arm64_cpu_factor,
+        first_event_latency=args.first_event_latency,
+        tokens=args.tokens,
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import os
+
+from tests.load import enqueue_path, harness, import_time, power_tuning
+
+# CIで検出したい最低限のスループット(環境変数で調整できる)
+MIN_MESSAGES_PER_SECOND = float(os.environ.get("LOAD_TEST_MIN_THROUGHPUT", "5"))
+MAX_P99_LATENCY_MS = float(os.environ.get("LOAD_TEST_MAX_P99_MS", "5000"))
+
+
+def test_burst_is_delivered_within_budget():
+    report = harness.run_benchmark(
+        bursts=3,
+        burst_size=10,
+        first_event_latency=0.02,
+        tokens=5,
+    )
+
+    assert report["accepted"] == report["messages"] == 30
+    assert report["delivered"] == 30
+    assert report["messages_per_second"] >= MIN_MESSAGES_PER_SECOND
+    assert report["latency_ms"]["p99"] <= MAX_P99_LATENCY_MS
+    assert report["cold"]["api_first_ms"] is not None
+    assert report["warm"]["api_ms"]["p50"] <= report["latency_ms"]["p50"]
+    # 各呼び出しがEMFを1行ずつ出力している
+    assert report["emf_lines"] >= report["messages"]
+
+
+def test_concurrent_flows_beat_serial_latency():
+    # 1バッチ10件を同時に処理するため、Flowの待ち時間の合計より十分早く終わる
+    report = harness.run_benchmark(
+        bursts=1,
+        burst_size=10,
+        worker_pollers=1,
+        batching_window=0.2,
+        first_event_latency=0.2,
+        tokens=1,
+    )
+    assert report["delivered"] == 10
+    assert report["duration_seconds"] < 10 * 0.2
+
+
+def test_handlers_import_without_boto3():
+    # boto3は最初のAWS呼び出しまで読み込まない(コールドスタートのINITを短くする)
+    report = import_time.run_benchmark(runs=1)
+    for result in report["handlers"].values():
+        assert result["boto3_loaded"] is False
+
+
+def test_warm_on_init_moves_aws_setup_out_of_first_request():
+    # SnapStartやプロビジョニング済み同時実行では、boto3とSSMの取得をINITで済ませる
+    lazy = import_time.measure_first_request(runs=1)
+    warm = import_time.measure_first_request(runs=1, warm_on_init=True)
+    assert lazy["status"] == warm["status"] == 200
+    assert lazy["boto3_loaded_at_init"] is False
+    assert warm["boto3_loaded_at_init"] is True
+    assert warm["first_request_ms"] < lazy["first_request_ms"]
+
+
+def test_power_tuning_reports_cost_per_message():
+    report = power_tuning.run_benchmark(
+        messages=10, memory_sizes=(128, 1024), batch_sizes=(1, 10)
+    )
+
+    assert {m["handler"] for m in report["measurements"]} == {"api", "worker"}
+    assert all(m["peak_rss_mb"] > 0 for m in report["measurements"])
+    assert len(report["configurations"]) == 3 * 2 * 2
+    assert set(report["best"]) == {"api", "worker"}
+    # 同じ所要時間ならarm64の方が安い
+    worker = [
+        c
+        for c in report["configurations"]
+        if c["handler"] == "worker" and c["batch_size"] == 10 and c["memory_mb"] == 1024
+    ]
+    by_arch = {c["architecture"]: c["cost_per_message_usd"] for c in worker}
+    assert by_arch["arm64"] < by_arch["x86_64"]
+
+
+def test_batched_enqueue_uses_fewer_sqs_calls():
+    report = enqueue_path.run_benchmark(messages=20, round_trip=0.002)
+    results = report["results"]
+
+    assert results["current"]["sqs_calls"] == 20
+    assert results["batch"]["sqs_calls"] == 2
+    assert (
+        results["slim"]["bytes_per_message"]
+        < results["current"]["bytes_per_message"] / 2
+    )
+    assert results["batch"]["ms_per_message"] < results["current"]["ms_per_message"]
@@ -0,0 +1,54 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+from lambda_module.sqs import handler as sqs_handler
+from tests.unit.fakes import FakeRuntimeClient
+
+
+@pytest.fixture
+def runtime_client(monkeypatch):
+    client = FakeRuntimeClient(fail_texts=("broken",))
+    posted = []
+    monkeypatch.setattr(
+        sqs_handler,
+        "get_ssm_parameters",
+        lambda: {
+            "access_token": "access",
+            "verify_token": "verify",
+            "flow_identifier": "flow",
+            "flow_alias_identifier": "alias",
+        },
+    )
+    monkeypatch.setattr(
+        sqs_handler.clients, "get_client", lambda *args, **kwargs: client
+    )
+    monkeypatch.setattr(
+        sqs_handler,
+        "post_message_to_channel",
+        lambda channel, message, *args: posted.append((channel, message)),
+    )
+    client.posted = posted
+    return client
+
+
+@pytest.fixture
+def dynamodb_table(monkeypatch):
+    # motoのDynamoDBにテーブル名とパーティションキー名を指定してテーブルを作り、クライアントを返す
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("dynamodb", region_name="us-east-1")
+
+        def create_table(table_name, key_name):
+            client.create_table(
+                TableName=table_name,
+                KeySchema=[{"AttributeName": key_name, "KeyType": "HASH"}],
+                AttributeDefinitions=[
+                    {"AttributeName": key_name, "AttributeType": "S"}
+                ],
+                BillingMode="PAY_PER_REQUEST",
+            )
+            return client
+
+        yield create_table
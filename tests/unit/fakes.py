@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+class FakeClock:
+    # テストから時刻を進められる時計(time.time/time.monotonicの代わり)
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRuntimeClient:
+    def __init__(self, fail_texts=(), latency=0):
+        self.fail_texts = fail_texts
+        self.latency = latency
+        self.inputs = []
+        self.traced = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def invoke_flow(self, flowIdentifier, flowAliasIdentifier, inputs, **kwargs):
+        text = inputs[0]["content"]["document"]
+        with self.lock:
+            self.inputs.append(text)
+            self.traced.append(kwargs.get("enableTrace", False))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.latency)
+        with self.lock:
+            self.active -= 1
+        if text in self.fail_texts:
+            raise ClientError(
+                {"Error": {"Code": "ValidationException", "Message": "failed"}},
+                "InvokeFlow",
+            )
+        stream = [
+            {"flowOutputEvent": {"content": {"document": f"answer: {text}"}}},
+            {"flowCompletionEvent": {"completionReason": "SUCCESS"}},
+        ]
+        if kwargs.get("enableTrace"):
+            stream.insert(
+                0,
+                {
+                    "flowTraceEvent": {
+                        "trace": {"nodeInputTrace": {"nodeName": "PromptNode"}}
+                    }
+                },
+            )
+        return {"responseStream": stream}
+
+
+class FakeBackend:
+    # Bedrockを呼ばずに、決まった回答を1文字ずつストリームで返すバックエンド
+    metric_prefix = "Fake"
+
+    def __init__(self, name="fake", answer="fake answer"):
+        self.name = name
+        self.answer = answer
+        self.calls = []
+
+    def get_cache_scope(self, params):
+        return self.name, "fake"
+
+    def invoke(self, params, turns, text, trace=False):
+        self.calls.append((turns, text))
+        return (("text", self.answer[: i + 1]) for i in range(len(self.answer)))
+
+
+class FakeConverseClient:
+    def __init__(self, deltas=("answer", ": ", "ok")):
+        self.deltas = deltas
+        self.requests = []
+
+    def converse_stream(self, **kwargs):
+        self.requests.append(kwargs)
+        stream = [{"messageStart": {"role": "assistant"}}]
+        stream += [
+            {"contentBlockDelta": {"delta": {"text": delta}, "contentBlockIndex": 0}}
+            for delta in self.deltas
+        ]
+        stream += [
+            {"messageStop": {"stopReason": "end_turn"}},
+            {"metadata": {"usage": {"inputTokens": 3, "outputTokens": 4}}},
+        ]
+        return {"stream": stream}
+
+
+def make_record(message_id, text, event_ts=None):
+    event_ts = event_ts or f"1700000000.{message_id}"
+    body = {
+        "event": {
+            "type": "app_mention",
+            "user": "U123456",
+            "text": text,
+            "channel": "C123456",
+            "event_ts": event_ts,
+        }
+    }
+    return {"messageId": message_id, "body": json.dumps(body)}
@@ -0,0 +1,77 @@
+import pytest
+
+from bedrock_bot_common import backends, history, instrumentation
+from lambda_module.sqs import handler
+from tests.unit.fakes import FakeBackend, FakeConverseClient, make_record
+
+
+def test_select_backend_by_channel_and_prompt_length(monkeypatch):
+    assert backends.select_backend_name("C1", "hello") == backends.FLOW
+    monkeypatch.setenv("CONVERSE_CHANNELS", "C2, C3")
+    monkeypatch.setenv("CONVERSE_MAX_PROMPT_TOKENS", "5")
+    assert backends.select_backend_name("C2", "a" * 100) == backends.CONVERSE
+    assert backends.select_backend_name("C1", "short") == backends.CONVERSE
+    assert backends.select_backend_name("C1", "a" * 100) == backends.FLOW
+    monkeypatch.setenv("MODEL_BACKEND", "converse")
+    assert backends.select_backend_name("C1", "a" * 100) == backends.CONVERSE
+
+
+def test_converse_backend_streams_text_with_history():
+    client = FakeConverseClient()
+    backend = backends.ConverseBackend(client, "model", system_prompt="be brief")
+    turns = [
+        [history.ROLE_ASSISTANT, "orphan"],
+        [history.ROLE_USER, "hi"],
+        [history.ROLE_ASSISTANT, "hello"],
+        [history.ROLE_USER, "one"],
+    ]
+    instrumentation.begin("sqs", emit=lambda line: None)
+
+    events = list(backend.invoke({}, turns, "two"))
+
+    texts = [value for kind, value in events if kind == backends.TEXT]
+    assert texts == ["answer", "answer: ", "answer: ok"]
+    (request,) = client.requests
+    assert request["modelId"] == "model"
+    assert request["system"] == [{"text": "be brief"}]
+    assert request["messages"] == [
+        {"role": "user", "content": [{"text": "hi"}]},
+        {"role": "assistant", "content": [{"text": "hello"}]},
+        {"role": "user", "content": [{"text": "one\n\ntwo"}]},
+    ]
+    assert instrumentation.get_metrics().values("OutputTokens") == [4]
+
+
+def test_converse_backend_requires_model_id():
+    with pytest.raises(ValueError):
+        backends.ConverseBackend(FakeConverseClient(), "")
+
+
+def test_converse_channel_is_answered_without_the_flow(runtime_client, monkeypatch):
+    monkeypatch.setenv("CONVERSE_CHANNELS", "C123456")
+    monkeypatch.setenv("CONVERSE_MODEL_ID", "model")
+    converse_client = FakeConverseClient()
+    monkeypatch.setattr(
+        handler.backends.clients,
+        "get_client",
+        lambda service_name, **kwargs: (
+            converse_client if service_name == "bedrock-runtime" else runtime_client
+        ),
+    )
+
+    handler.process_records([make_record("1", "hello")])
+
+    assert runtime_client.inputs == []
+    assert converse_client.requests[0]["messages"][-1]["content"] == [{"text": "hello"}]
+    assert runtime_client.posted == [("C123456", "answer: ok")]
+
+
+def test_fake_backend_can_replace_the_flow(runtime_client):
+    fake = FakeBackend()
+    backends.set_backend(backends.FLOW, fake)
+
+    handler.process_records([make_record("1", "hello")])
+
+    assert fake.calls == [([], "hello")]
+    assert runtime_client.inputs == []
+    assert runtime_client.posted == [("C123456", "fake answer")]
@@ -1,15 +1,289 @@
 import aws_cdk as core
 import aws_cdk.assertions as assertions
+import pytest
 
 from bedrock_bot.bedrock_bot_stack import BedrockBotStack
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in bedrock_bot/bedrock_bot_stack.py
-# def test_sqs_queue_created():
-#     app = core.App()
-#     stack = BedrockBotStack(app, "bedrock-bot")
-#     template = assertions.Template.from_stack(stack)
 
-#     template.has_resource_properties("AWS::SQS::Queue", {
-#         "VisibilityTimeout": 300
-#     })
+def get_template(**context):
+    # Lambdaアセットのバンドル(Docker)を行わずに合成する
+    app = core.App(context={"aws:cdk:bundling-stacks": [], **context})
+    stack = BedrockBotStack(app, "bedrock-bot")
+    return assertions.Template.from_stack(stack)
+
+
+def test_sqs_queue_created():
+    template = get_template()
+
+    template.has_resource_properties(
+        "AWS::SQS::Queue",
+        {
+            "VisibilityTimeout": 300,
+            "RedrivePolicy": {"maxReceiveCount": 8},
+        },
+    )
+
+
+def test_sqs_event_source_reports_batch_item_failures():
+    template = get_template()
+
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {
+            "BatchSize": 10,
+            "FunctionResponseTypes": ["ReportBatchItemFailures"],
+        },
+    )
+
+
+def test_dispatch_mode_defaults_to_sqs():
+    template = get_template()
+
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "Environment": {
+                "Variables": assertions.Match.object_like({"DISPATCH_MODE": "sqs"})
+            }
+        },
+    )
+
+
+def test_lambda_dispatch_mode_grants_direct_invoke():
+    template = get_template(dispatch_mode="lambda")
+
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "Environment": {
+                "Variables": assertions.Match.object_like(
+                    {
+                        "DISPATCH_MODE": "lambda",
+                        "WORKER_FUNCTION_NAME": assertions.Match.any_value(),
+                    }
+                )
+            }
+        },
+    )
+    template.has_resource_properties(
+        "AWS::IAM::Policy",
+        {
+            "PolicyDocument": {
+                "Statement": assertions.Match.array_with(
+                    [assertions.Match.object_like({"Action": "lambda:InvokeFunction"})]
+                )
+            }
+        },
+    )
+
+
+def test_response_cache_table_has_ttl():
+    template = get_template()
+
+    template.has_resource_properties(
+        "AWS::DynamoDB::Table",
+        {
+            "KeySchema": [{"AttributeName": "cache_key", "KeyType": "HASH"}],
+            "TimeToLiveSpecification": {
+                "AttributeName": "expires_at",
+                "Enabled": True,
+            },
+        },
+    )
+
+
+@pytest.mark.parametrize(
+    "context",
+    [
+        {"worker_max_concurrency": 3, "worker_reserved_concurrency": 6},
+        # -cで指定した値は文字列で渡される
+        {"worker_max_concurrency": "3", "worker_reserved_concurrency": "6"},
+    ],
+)
+def test_worker_concurrency_is_capped(context):
+    template = get_template(**context)
+
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {"ScalingConfig": {"MaximumConcurrency": 3}},
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {"ReservedConcurrentExecutions": 6},
+    )
+
+
+def test_priority_queue_has_its_own_worker_mapping():
+    template = get_template(
+        priority_channels="C1,C2",
+        worker_max_concurrency=4,
+        # -cで指定した値は文字列で渡される
+        priority_worker_max_concurrency="2",
+    )
+
+    template.resource_count_is("AWS::Lambda::EventSourceMapping", 2)
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {"ScalingConfig": {"MaximumConcurrency": 2}},
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "Environment": {
+                "Variables": assertions.Match.object_like(
+                    {"PRIORITY_CHANNELS": "C1,C2"}
+                )
+            }
+        },
+    )
+
+
+def has_warm_on_init(template):
+    functions = template.find_resources(
+        "AWS::Lambda::Function",
+        {
+            "Properties": {
+                "Environment": {
+                    "Variables": assertions.Match.object_like({"WARM_ON_INIT": "true"})
+                }
+            }
+        },
+    )
+    return len(functions) == 1
+
+
+def test_api_cold_start_options():
+    template = get_template()
+    template.resource_count_is("AWS::Lambda::Alias", 0)
+    assert not has_warm_on_init(template)
+
+    template = get_template(api_provisioned_concurrency=2)
+    template.has_resource_properties(
+        "AWS::Lambda::Alias",
+        {
+            "Name": "live",
+            "ProvisionedConcurrencyConfig": {"ProvisionedConcurrentExecutions": 2},
+        },
+    )
+    assert has_warm_on_init(template)
+
+    template = get_template(api_snapstart="true")
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {"SnapStart": {"ApplyOn": "PublishedVersions"}},
+    )
+    template.resource_count_is("AWS::Lambda::Alias", 1)
+    assert has_warm_on_init(template)
+
+    with pytest.raises(ValueError):
+        get_template(api_snapstart="true", api_provisioned_concurrency=2)
+
+
+def test_tuning_context_values():
+    template = get_template(
+        lambda_architecture="arm64",
+        api_memory_size=512,
+        worker_memory_size=1024,
+        worker_timeout_seconds=600,
+        worker_batch_size=20,
+        worker_batching_window_seconds=2,
+    )
+
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {"Architectures": ["arm64"], "MemorySize": 512, "Timeout": 10},
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {"Architectures": ["arm64"], "MemorySize": 1024, "Timeout": 600},
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::LayerVersion", {"CompatibleArchitectures": ["arm64"]}
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {"BatchSize": 20, "MaximumBatchingWindowInSeconds": 2},
+    )
+    template.has_resource_properties("AWS::SQS::Queue", {"VisibilityTimeout": 600})
+
+    with pytest.raises(ValueError):
+        get_template(lambda_architecture="sparc")
+
+    # -cで指定した値は文字列で渡される
+    template = get_template(worker_memory_size="1024")
+    template.has_resource_properties("AWS::Lambda::Function", {"MemorySize": 1024})
+
+
+def test_converse_backend_context_values():
+    template = get_template(
+        converse_model_id="anthropic.claude-3-haiku-20240307-v1:0",
+        converse_channels="C1,C2",
+        converse_max_prompt_tokens=200,
+    )
+
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "Environment": {
+                "Variables": assertions.Match.object_like(
+                    {
+                        "MODEL_BACKEND": "flow",
+                        "CONVERSE_MODEL_ID": "anthropic.claude-3-haiku-20240307-v1:0",
+                        "CONVERSE_CHANNELS": "C1,C2",
+                        "CONVERSE_MAX_PROMPT_TOKENS": "200",
+                    }
+                )
+            }
+        },
+    )
+    template.has_resource_properties(
+        "AWS::IAM::Policy",
+        {
+            "PolicyDocument": {
+                "Statement": assertions.Match.array_with(
+                    [
+                        assertions.Match.object_like(
+                            {"Action": "bedrock:InvokeModelWithResponseStream"}
+                        )
+                    ]
+                )
+            }
+        },
+    )
+
+
+def test_redrive_outputs():
+    template = get_template()
+
+    for name in (
+        "DeadLetterQueueUrl",
+        "QueueUrl",
+        "ApiFunctionName",
+        "WorkerFunctionName",
+    ):
+        template.has_output(name, {})
+
+
+def test_event_claim_ttl_follows_api_timeout():
+    template = get_template(api_timeout_seconds=15)
+
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "Timeout": 15,
+            "Environment": {
+                "Variables": assertions.Match.object_like(
+                    {"EVENT_CLAIM_TTL_SECONDS": "15"}
+                )
+            },
+        },
+    )
+
+
+def test_redrive_outputs_include_priority_queue():
+    template = get_template()
+    template.has_output("PriorityQueueUrl", {})
+    assert template.find_outputs("PriorityChannels") == {}
+
+    template = get_template(priority_channels="C1,C2")
+    template.has_output("PriorityChannels", {"Value": "C1,C2"})
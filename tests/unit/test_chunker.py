@@ -0,0 +1,197 @@
+from botocore.exceptions import ClientError
+
+from bedrock_bot_common import backends, chunker, retry, slack
+from lambda_module.sqs import handler
+from tests.unit.fakes import make_record
+
+# フィクスチャで差し替える前の実装
+post_message_to_channel = handler.post_message_to_channel
+
+LONG_ANSWER = "\n\n".join(
+    [
+        "はじめに、" + "概要です。" * 10,
+        "```python\n" + "\n".join(f"value_{i} = {i}" for i in range(30)) + "\n```",
+        " ".join(f"word{i}" for i in range(60)),
+        "おわりに。",
+    ]
+)
+
+
+def test_split_text_respects_limit_and_code_fences():
+    chunks = chunker.split_text(LONG_ANSWER, 120)
+
+    assert len(chunks) > 3
+    assert all(len(chunk) <= 120 for chunk in chunks)
+    # コードブロックを途中で分けたチャンクも、フェンスが閉じている
+    assert all(chunk.count("```") % 2 == 0 for chunk in chunks)
+    assert chunks[0].startswith("はじめに")
+    assert chunks[-1].endswith("おわりに。")
+    code = [chunk for chunk in chunks if chunk.startswith("```python")]
+    assert "value_0 = 0" in code[0]
+    assert "value_29 = 29" in code[-1]
+
+
+def test_split_text_keeps_short_paragraphs_together():
+    assert chunker.split_text("a\n\nb\n\nc", 100) == ["a\n\nb\n\nc"]
+    assert chunker.split_text("", 100) == []
+
+
+def test_chunker_streams_the_same_chunks_as_a_single_split():
+    message_chunker = chunker.MessageChunker(120)
+    chunks = []
+    ready_before_end = 0
+    for i in range(0, len(LONG_ANSWER), 13):
+        ready = message_chunker.feed(LONG_ANSWER[i : i + 13])
+        chunks.extend(ready)
+        ready_before_end += len(ready)
+    chunks.extend(message_chunker.finish())
+
+    assert chunks == chunker.split_text(LONG_ANSWER, 120)
+    # 確定したチャンクは、テキストが全部届く前から返る
+    assert ready_before_end > 0
+
+
+class RecordingSlackClient:
+    def __init__(self):
+        self.calls = []
+        self.uploads = []
+
+    def api_call(self, method, payload, access_token, form=False):
+        self.calls.append((method, payload, form))
+        data = {"ok": True, "ts": f"1.{len(self.calls)}"}
+        if method == "files.getUploadURLExternal":
+            data.update(upload_url="https://files.example/upload/1", file_id="F1")
+        return slack.SlackResponse(200, {}, data)
+
+    def upload(self, url, data):
+        self.uploads.append((url, data))
+        return 200
+
+    def posted(self):
+        return [p["text"] for m, p, _ in self.calls if m == "chat.postMessage"]
+
+
+def use_slack(monkeypatch, **env):
+    client = RecordingSlackClient()
+    monkeypatch.setattr(handler, "post_message_to_channel", post_message_to_channel)
+    monkeypatch.setattr(handler.slack, "get_slack_client", lambda: client)
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    return client
+
+
+def test_long_answer_is_posted_in_chunks(runtime_client, monkeypatch):
+    client = use_slack(
+        monkeypatch, SLACK_CHUNK_CHARS="120", SLACK_FILE_UPLOAD_CHARS="0"
+    )
+    monkeypatch.setattr(
+        runtime_client,
+        "invoke_flow",
+        lambda **kwargs: {
+            "responseStream": [
+                {"flowOutputEvent": {"content": {"document": LONG_ANSWER}}}
+            ]
+        },
+    )
+
+    response = handler.main({"Records": [make_record("m1", "hello")]}, {})
+
+    assert response == {"batchItemFailures": []}
+    assert client.posted() == chunker.split_text(LONG_ANSWER, 120)
+    assert all(p["thread_ts"] == "1700000000.m1" for _, p, _ in client.calls)
+
+
+def test_very_long_answer_falls_back_to_file_upload(runtime_client, monkeypatch):
+    client = use_slack(
+        monkeypatch,
+        SLACK_CHUNK_CHARS="120",
+        SLACK_FILE_UPLOAD_CHARS="250",
+        SLACK_BLOCK_KIT="true",
+    )
+    poster = handler.AnswerPoster(
+        "C1", {"access_token": "t", "verify_token": "v"}, "1.0"
+    )
+
+    poster.finish(LONG_ANSWER)
+
+    posted = client.posted()
+    assert 1 <= len(posted) < len(chunker.split_text(LONG_ANSWER, 120))
+    assert sum(len(text) for text in posted) <= 250
+    assert client.calls[0][1]["blocks"] == chunker.make_blocks(posted[0])
+    methods = [method for method, _, _ in client.calls]
+    assert methods[-2:] == [
+        "files.getUploadURLExternal",
+        "files.completeUploadExternal",
+    ]
+    assert all(form for method, _, form in client.calls if method.startswith("files."))
+    assert client.uploads == [
+        ("https://files.example/upload/1", LONG_ANSWER.encode("utf-8"))
+    ]
+    complete = client.calls[-1][1]
+    assert complete["channel_id"] == "C1"
+    assert complete["thread_ts"] == "1.0"
+
+
+def test_remaining_chunks_are_kept_when_posting_fails(monkeypatch):
+    class FailingAfterFirst(RecordingSlackClient):
+        def api_call(self, method, payload, access_token, form=False):
+            if self.calls:
+                return slack.SlackResponse(503, {}, {"ok": False})
+            return super().api_call(method, payload, access_token, form)
+
+    client = FailingAfterFirst()
+    monkeypatch.setattr(handler, "post_message_to_channel", post_message_to_channel)
+    monkeypatch.setattr(handler.slack, "get_slack_client", lambda: client)
+    monkeypatch.setenv("SLACK_CHUNK_CHARS", "120")
+    retry.set_retrier("Slack", retry.Retrier("Slack", max_attempts=1))
+    poster = handler.AnswerPoster(
+        "C1", {"access_token": "t", "verify_token": "v"}, "1.0"
+    )
+
+    try:
+        poster.finish(LONG_ANSWER)
+    except retry.RetryableError:
+        pass
+
+    chunks = chunker.split_text(LONG_ANSWER, 120)
+    assert client.posted() == chunks[:1]
+    assert poster.remaining_text == "\n\n".join(chunks[1:])
+
+
+def test_retried_stream_replaces_partially_posted_chunks(runtime_client, monkeypatch):
+    class ThrottledOnce:
+        name = backends.FLOW
+        metric_prefix = "Fake"
+
+        def __init__(self):
+            self.calls = 0
+
+        def get_cache_scope(self, params):
+            return "fake", "fake"
+
+        def invoke(self, params, turns, text, trace=False):
+            self.calls += 1
+            if self.calls == 1:
+                yield "text", "first para one\n\nfirst para two\n\nfirst"
+                raise ClientError(
+                    {"Error": {"Code": "throttlingException", "Message": "slow"}},
+                    "InvokeFlow",
+                )
+            yield "text", "alpha para one\n\nbeta para two\n\ngamma end"
+
+    client = use_slack(monkeypatch, SLACK_CHUNK_CHARS="20", SLACK_FILE_UPLOAD_CHARS="0")
+    backends.set_backend(backends.FLOW, ThrottledOnce())
+    retry.set_retrier("Bedrock", retry.Retrier("Bedrock", sleep=lambda s: None))
+
+    response = handler.main({"Records": [make_record("m1", "hello")]}, {})
+
+    assert response == {"batchItemFailures": []}
+    # 最初の試行で投稿したチャンクは削除し、再試行の回答だけをスレッドに残す
+    deleted = [p["ts"] for m, p, _ in client.calls if m == "chat.delete"]
+    assert deleted == ["1.1"]
+    assert client.posted() == [
+        "first para one",
+        "alpha para one",
+        "beta para two",
+        "gamma end",
+    ]
@@ -0,0 +1,139 @@
+import json
+
+import pytest
+
+from bedrock_bot_common import dispatch
+from lambda_module.api import handler as api_handler
+from lambda_module.sqs import handler as sqs_handler
+from tests.unit.fakes import make_record
+
+
+class FakeLambdaClient:
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, **kwargs):
+        self.invocations.append(kwargs)
+        return {"StatusCode": 202}
+
+
+class FakeSQSClient:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        self.messages.append((QueueUrl, MessageBody))
+        return {"MessageId": f"id-{len(self.messages)}"}
+
+
+def make_api_event(text="<@UBOT> hello"):
+    body = {
+        "event": {
+            "type": "app_mention",
+            "user": "U123456",
+            "text": text,
+            "channel": "C123456",
+            "event_ts": "1700000000.000100",
+        }
+    }
+    return {"headers": {}, "body": json.dumps(body)}
+
+
+def test_lambda_dispatcher_invokes_worker_asynchronously():
+    client = FakeLambdaClient()
+    message_id = dispatch.LambdaDispatcher("worker", client=client).dispatch(
+        {"event": {"text": "hi"}}
+    )
+    invocation = client.invocations[0]
+    assert invocation["FunctionName"] == "worker"
+    assert invocation["InvocationType"] == "Event"
+    record = json.loads(invocation["Payload"])["Records"][0]
+    assert record["messageId"] == message_id
+    assert record["eventSource"] == dispatch.DIRECT_EVENT_SOURCE
+    assert json.loads(record["body"]) == {"event": {"text": "hi"}}
+
+
+def test_get_dispatcher_uses_dispatch_mode(monkeypatch):
+    monkeypatch.setenv("SQS_QUEUE_URL", "https://sqs.example/queue")
+    monkeypatch.setenv("WORKER_FUNCTION_NAME", "worker")
+    monkeypatch.setattr(dispatch.clients, "get_client", lambda service: service)
+
+    monkeypatch.delenv("DISPATCH_MODE", raising=False)
+    assert isinstance(dispatch.get_dispatcher(), dispatch.SqsDispatcher)
+    monkeypatch.setenv("DISPATCH_MODE", "lambda")
+    assert isinstance(dispatch.get_dispatcher(), dispatch.LambdaDispatcher)
+    monkeypatch.setenv("DISPATCH_MODE", "carrier-pigeon")
+    with pytest.raises(ValueError):
+        dispatch.get_dispatcher()
+
+
+def test_sqs_dispatcher_routes_priority_channels(monkeypatch):
+    monkeypatch.setenv("SQS_QUEUE_URL", "https://sqs.example/queue")
+    monkeypatch.setenv("SQS_PRIORITY_QUEUE_URL", "https://sqs.example/priority")
+    monkeypatch.setenv("PRIORITY_CHANNELS", "C1, C2")
+    monkeypatch.delenv("DISPATCH_MODE", raising=False)
+    client = FakeSQSClient()
+    monkeypatch.setattr(dispatch.clients, "get_client", lambda service: client)
+
+    dispatcher = dispatch.get_dispatcher()
+    for channel in ("C1", "C3", "C2"):
+        dispatcher.dispatch({"event": {"channel": channel}})
+
+    assert [url for url, _ in client.messages] == [
+        "https://sqs.example/priority",
+        "https://sqs.example/queue",
+        "https://sqs.example/priority",
+    ]
+
+
+def test_sqs_dispatcher_without_priority_queue_uses_default():
+    client = FakeSQSClient()
+    dispatcher = dispatch.SqsDispatcher(
+        "https://sqs.example/queue", client=client, priority_channels=["C1"]
+    )
+    dispatcher.dispatch({"event": {"channel": "C1"}})
+    assert client.messages[0][0] == "https://sqs.example/queue"
+
+
+@pytest.mark.parametrize(
+    "mode", [dispatch.DISPATCH_MODE_SQS, dispatch.DISPATCH_MODE_LAMBDA]
+)
+def test_api_dispatches_to_local_worker(mode, runtime_client, monkeypatch):
+    local = dispatch.LocalDispatcher(sqs_handler.main, mode=mode)
+    monkeypatch.setattr(api_handler, "is_verify_token", lambda body: True)
+    monkeypatch.setattr(api_handler.dispatch, "get_dispatcher", lambda: local)
+
+    response = api_handler.main(make_api_event(), {})
+
+    assert response["statusCode"] == 200
+    assert local.results == [{"batchItemFailures": []}]
+    assert runtime_client.posted == [("C123456", "answer: hello")]
+
+
+def test_direct_invocation_raises_on_failure(runtime_client):
+    local = dispatch.LocalDispatcher(
+        sqs_handler.main, mode=dispatch.DISPATCH_MODE_LAMBDA
+    )
+    with pytest.raises(RuntimeError):
+        local.dispatch(json.loads(make_record("m1", "broken")["body"]))
+
+    # SQS経由の場合は部分バッチ失敗として返す
+    local = dispatch.LocalDispatcher(sqs_handler.main, mode=dispatch.DISPATCH_MODE_SQS)
+    local.dispatch(json.loads(make_record("m1", "broken")["body"]))
+    assert len(local.results[0]["batchItemFailures"]) == 1
+
+
+def test_api_returns_500_when_dispatch_fails(monkeypatch):
+    class FailingDispatcher:
+        supports_delay = False
+
+        def dispatch(self, body):
+            raise api_handler.ClientError(
+                {"Error": {"Code": "AccessDenied", "Message": "denied"}}, "SendMessage"
+            )
+
+    monkeypatch.setattr(api_handler, "is_verify_token", lambda body: True)
+    monkeypatch.setattr(api_handler.dispatch, "get_dispatcher", FailingDispatcher)
+    response = api_handler.main(make_api_event(), {})
+    assert response["statusCode"] == 500
+    assert response["body"] == '{"message": "Failed to dispatch message."}'
@@ -0,0 +1,115 @@
+import json
+
+from bedrock_bot_common import dispatch, enqueue
+from lambda_module.sqs import handler as sqs_handler
+
+
+class FakeBatchSQSClient:
+    def __init__(self, fail_ids=()):
+        self.fail_ids = fail_ids
+        self.batches = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.batches.append((QueueUrl, Entries))
+        return {
+            "Successful": [
+                {"Id": e["Id"], "MessageId": f"{QueueUrl}#{e['Id']}"}
+                for e in Entries
+                if e["Id"] not in self.fail_ids
+            ],
+            "Failed": [
+                {"Id": e["Id"], "Code": "InternalError", "SenderFault": False}
+                for e in Entries
+                if e["Id"] in self.fail_ids
+            ],
+        }
+
+
+def test_slim_body_keeps_only_worker_fields():
+    body = {
+        "token": "secret",
+        "event_id": "Ev1",
+        "authorizations": [{"user_id": "UBOT"}],
+        "event": {
+            "type": "app_mention",
+            "user": "U1",
+            "text": "hello",
+            "channel": "C1",
+            "thread_ts": None,
+            "event_ts": "1.0",
+            "blocks": [{"type": "rich_text"}],
+        },
+    }
+    assert enqueue.slim_body(body) == {
+        "event_id": "Ev1",
+        "event": {
+            "type": "app_mention",
+            "user": "U1",
+            "text": "hello",
+            "channel": "C1",
+            "event_ts": "1.0",
+        },
+    }
+
+
+def test_large_messages_are_compressed():
+    body = {"event": {"text": "あ" * 10000}}
+    small = enqueue.encode_message({"event": {"text": "hi"}}, threshold=1024)
+    large = enqueue.encode_message(body, threshold=1024)
+
+    assert json.loads(small) == {"event": {"text": "hi"}}
+    assert json.loads(large)["encoding"] == enqueue.COMPRESSED_ENCODING
+    assert len(large) < 1024
+    assert enqueue.decode_message(large) == body
+    assert enqueue.decode_message(small) == {"event": {"text": "hi"}}
+
+
+def test_make_batches_respects_entry_and_byte_limits():
+    messages = ["x" * 10] * 25
+    assert [len(b) for b in enqueue.make_batches(messages)] == [10, 10, 5]
+    assert [len(b) for b in enqueue.make_batches(messages, max_bytes=35)] == [3] * 8 + [
+        1
+    ]
+
+
+def test_dispatch_batch_groups_by_queue_and_reports_failures():
+    client = FakeBatchSQSClient(fail_ids=("1",))
+    dispatcher = dispatch.SqsDispatcher(
+        "normal",
+        client=client,
+        priority_queue_url="priority",
+        priority_channels=["C9"],
+    )
+    bodies = [{"event": {"channel": c}} for c in ("C1", "C9", "C2", "C9")]
+
+    message_ids = dispatcher.dispatch_batch(bodies, delay_seconds=5)
+
+    # 各バッチの2件目(Id "1")が失敗する
+    assert message_ids == ["normal#0", "priority#0", None, None]
+    assert [(url, len(entries)) for url, entries in client.batches] == [
+        ("normal", 2),
+        ("priority", 2),
+    ]
+    assert all(e["DelaySeconds"] == 5 for _, entries in client.batches for e in entries)
+
+
+def test_worker_processes_compressed_records(runtime_client, monkeypatch):
+    monkeypatch.setenv("ENQUEUE_COMPRESS_THRESHOLD_BYTES", "10")
+    event = dispatch.build_worker_event(
+        [
+            {
+                "event": {
+                    "type": "app_mention",
+                    "user": "U1",
+                    "text": "hello",
+                    "channel": "C123456",
+                    "event_ts": "1700000000.000100",
+                }
+            }
+        ],
+        "aws:sqs",
+    )
+    assert "encoding" in json.loads(event["Records"][0]["body"])
+
+    assert sqs_handler.main(event, None) == {"batchItemFailures": []}
+    assert runtime_client.posted == [("C123456", "answer: hello")]
@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+from bedrock_bot_common import event_router
+from lambda_module.api import handler as api_handler
+
+
+def make_body(**event):
+    return {
+        "type": "event_callback",
+        "event_id": "Ev1",
+        "event": {
+            "type": "app_mention",
+            "user": "U123456",
+            "text": "<@UBOT> hello",
+            "channel": "C123456",
+            "event_ts": "1700000000.000100",
+            **event,
+        },
+    }
+
+
+@pytest.mark.parametrize(
+    "event, reason",
+    [
+        ({}, None),
+        ({"type": "reaction_added"}, "event_type"),
+        ({"bot_id": "B1"}, "bot"),
+        ({"subtype": "message_changed"}, "subtype"),
+        ({"subtype": "thread_broadcast"}, None),
+        ({"user": "UBOT"}, "self"),
+        # 本文中の文字列はエスケープされるため、キーとして扱われない
+        ({"text": '"bot_id": "B1" "type": "x"'}, None),
+    ],
+)
+def test_prefilter_and_resolve_agree(event, reason):
+    router = event_router.EventRouter()
+    router.register("app_mention", "mention")
+    body = make_body(**event)
+
+    assert router.prefilter(json.dumps(body), bot_user_id="UBOT") == reason
+    handler, resolved = router.resolve(body, bot_user_id="UBOT")
+    assert resolved == reason
+    assert handler == (None if reason else "mention")
+
+
+def test_resolve_uses_predicates_and_requires_text():
+    router = event_router.EventRouter()
+    router.register("message", "dm", lambda event: event.get("channel_type") == "im")
+
+    assert router.resolve(make_body(type="message", channel_type="im")) == (
+        "dm",
+        None,
+    )
+    assert router.resolve(make_body(type="message", channel_type="channel")) == (
+        None,
+        "event_type",
+    )
+    assert router.resolve(make_body(type="message", channel_type="im", text="")) == (
+        None,
+        "no_text",
+    )
+
+
+def test_prefilter_leaves_unknown_payloads_to_the_parser():
+    router = event_router.EventRouter()
+    router.register("app_mention", "mention")
+    assert router.prefilter("{}") is None
+    assert router.prefilter('{"type": "url_verification"}') is None
+
+
+class RecordingDispatcher:
+    supports_delay = False
+
+    def __init__(self):
+        self.bodies = []
+
+    def dispatch(self, body):
+        self.bodies.append(body)
+        return "id-1"
+
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    dispatcher = RecordingDispatcher()
+    monkeypatch.setattr(api_handler, "is_verify_token", lambda body: True)
+    monkeypatch.setattr(api_handler.dispatch, "get_dispatcher", lambda: dispatcher)
+    return dispatcher
+
+
+def test_direct_message_is_dispatched(dispatcher):
+    body = make_body(type="message", channel_type="im", text="hello")
+    response = api_handler.main({"headers": {}, "body": json.dumps(body)}, {})
+    assert response["statusCode"] == 200
+    assert dispatcher.bodies == [
+        {
+            "event_id": "Ev1",
+            "event": {
+                "type": "message",
+                "user": "U123456",
+                "text": "hello",
+                "channel": "C123456",
+                "channel_type": "im",
+                "event_ts": "1700000000.000100",
+            },
+        }
+    ]
+
+
+def test_bot_message_is_acknowledged_without_parsing(dispatcher, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("body should not be parsed")
+
+    monkeypatch.setattr(api_handler.json, "loads", fail)
+    body = make_body(type="message", channel_type="im", bot_id="B1")
+    response = api_handler.main({"headers": {}, "body": json.dumps(body)}, {})
+    assert response == {
+        "statusCode": 200,
+        "body": json.dumps({"message": "Event ignored."}),
+    }
+    assert dispatcher.bodies == []
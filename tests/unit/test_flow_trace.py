@@ -0,0 +1,109 @@
+import datetime
+import json
+
+from bedrock_bot_common import flow_trace, instrumentation
+from lambda_module.sqs import handler
+from tests.unit.fakes import make_record
+
+STARTED = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def node_trace(kind, name, seconds, document):
+    return {
+        "trace": {
+            kind: {
+                "nodeName": name,
+                "timestamp": STARTED + datetime.timedelta(seconds=seconds),
+                "fields": [{"nodeInputName": "x", "content": {"document": document}}],
+            }
+        }
+    }
+
+
+def test_summary_pairs_node_input_and_output():
+    tracer = flow_trace.FlowTrace()
+    for event in [
+        node_trace("nodeOutputTrace", "FlowInputNode", 0, "hello"),
+        node_trace("nodeInputTrace", "PromptNode", 0.1, "hello"),
+        node_trace("nodeOutputTrace", "PromptNode", 1.6, "a" * 40),
+        node_trace("nodeInputTrace", "FlowOutputNode", 1.7, {"text": "a" * 40}),
+    ]:
+        tracer.add(event)
+    assert tracer.summary() == [
+        {
+            "node": "FlowInputNode",
+            "duration_ms": None,
+            "input_tokens": 0,
+            "output_tokens": 2,
+        },
+        {
+            "node": "PromptNode",
+            "duration_ms": 1500.0,
+            "input_tokens": 2,
+            "output_tokens": 10,
+        },
+        {
+            "node": "FlowOutputNode",
+            "duration_ms": None,
+            "input_tokens": 13,
+            "output_tokens": 0,
+        },
+    ]
+
+
+def test_missing_timestamp_uses_arrival_time():
+    times = iter([100.0, 100.0, 100.25])
+    tracer = flow_trace.FlowTrace(clock=lambda: next(times))
+    tracer.add({"trace": {"nodeInputTrace": {"nodeName": "PromptNode"}}})
+    tracer.add({"trace": {"nodeOutputTrace": {"nodeName": "PromptNode"}}})
+    (node,) = tracer.summary()
+    assert node["duration_ms"] == 250.0
+
+
+def test_is_sampled(monkeypatch):
+    assert not flow_trace.is_sampled()
+    monkeypatch.setenv("FLOW_TRACE_SAMPLE_RATE", "0.1")
+    assert flow_trace.is_sampled(rand=lambda: 0.05)
+    assert not flow_trace.is_sampled(rand=lambda: 0.5)
+
+
+def test_sampled_invocation_emits_node_metrics(runtime_client, monkeypatch, capsys):
+    monkeypatch.setenv("FLOW_TRACE_SAMPLE_RATE", "1")
+    invoke_flow = runtime_client.invoke_flow
+
+    def invoke_flow_with_timings(**kwargs):
+        # Flowの実行時と同じく、ノードの入力と出力のトレースに時刻を付ける
+        response = invoke_flow(**kwargs)
+        response["responseStream"][:1] = [
+            {"flowTraceEvent": node_trace("nodeInputTrace", "PromptNode", 0, "hello")},
+            {
+                "flowTraceEvent": node_trace(
+                    "nodeOutputTrace", "PromptNode", 0.5, "answer: hello"
+                )
+            },
+        ]
+        return response
+
+    monkeypatch.setattr(runtime_client, "invoke_flow", invoke_flow_with_timings)
+    lines = []
+    instrumentation.begin("sqs", emit=lines.append)
+
+    handler.process_records([make_record("1", "hello")])
+
+    assert runtime_client.traced == [True]
+    assert runtime_client.posted == [("C123456", "answer: hello")]
+    (emf,) = [json.loads(line) for line in lines]
+    assert emf["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["Function", "Node"]]
+    assert emf["Node"] == "PromptNode"
+    assert emf["NodeLatency"] == 500.0
+    log = next(
+        json.loads(line)
+        for line in capsys.readouterr().out.splitlines()
+        if '"Flow trace"' in line
+    )
+    assert log["slowest_node"] == "PromptNode"
+
+
+def test_unsampled_invocation_does_not_enable_trace(runtime_client):
+    handler.process_records([make_record("1", "hello")])
+    assert runtime_client.traced == [False]
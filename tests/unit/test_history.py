@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+from bedrock_bot_common import history, tokens
+from lambda_module.sqs import handler
+from tests.unit.fakes import make_record
+
+
+@pytest.fixture
+def dynamodb_client(dynamodb_table):
+    return dynamodb_table("history", "conversation_key")
+
+
+def test_estimate_tokens():
+    assert tokens.estimate_tokens("") == 0
+    assert tokens.estimate_tokens("abcd") == 1
+    assert tokens.estimate_tokens("abcde") == 2
+    assert tokens.estimate_tokens("こんにちは") == 5
+
+
+def test_serialize_is_compact_round_trip():
+    turns = [["u", "VPNの繋ぎ方は？"], ["a", "設定画面から" * 50]]
+    data = history.serialize(turns)
+    assert history.deserialize(data) == turns
+    assert len(data) < len(json.dumps(turns, ensure_ascii=False).encode("utf-8"))
+    assert history.deserialize(None) == []
+
+
+def test_truncate_keeps_newest_turns_within_budget():
+    turns = [["u", "a" * 40], ["a", "b" * 40], ["u", "c" * 40], ["a", "d" * 40]]
+    assert history.truncate(turns, token_budget=25) == turns[-2:]
+    assert history.truncate(turns, token_budget=1000, max_turns=3) == turns[-3:]
+    assert history.truncate(turns, token_budget=5) == []
+
+
+def test_truncate_shortens_a_long_answer_instead_of_dropping_history():
+    turns = [["u", "q1"], ["a", "a1"], ["u", "q2"], ["a", "あ" * 2100]]
+    kept = history.truncate(turns, token_budget=2000)
+
+    assert [text for _, text in kept[:3]] == ["q1", "a1", "q2"]
+    assert kept[3][0] == "a"
+    assert tokens.estimate_tokens(kept[3][1]) <= 1000
+    assert sum(tokens.estimate_tokens(text) for _, text in kept) <= 2000
+
+
+def test_format_prompt():
+    assert history.format_prompt([], "hello") == "hello"
+    assert history.format_prompt([["u", "hi"], ["a", "hello!"]], "next?") == (
+        "これまでの会話:\nUser: hi\nAssistant: hello!\n\n質問: next?"
+    )
+
+
+def test_dynamodb_store_appends_and_bounds_history(dynamodb_client):
+    store = history.DynamoDBHistoryStore(
+        "history", token_budget=1000, max_turns=4, client=dynamodb_client
+    )
+    assert store.load("C1", "1.0") == []
+    for i in range(3):
+        store.append("C1", "1.0", [["u", f"q{i}"], ["a", f"a{i}"]])
+    assert store.load("C1", "1.0") == [
+        ["u", "q1"],
+        ["a", "a1"],
+        ["u", "q2"],
+        ["a", "a2"],
+    ]
+    assert store.load("C1", "2.0") == []
+
+
+def test_dynamodb_store_keeps_concurrent_appends(dynamodb_client):
+    class RacingClient:
+        # 最初の書き込みの直前に、同じスレッドへの別の追記を割り込ませる
+        def __init__(self, client):
+            self.client = client
+            self.raced = False
+
+        def get_item(self, **kwargs):
+            return self.client.get_item(**kwargs)
+
+        def put_item(self, **kwargs):
+            if not self.raced:
+                self.raced = True
+                other.append("C1", "1.0", [["u", "q2"], ["a", "a2"]])
+            return self.client.put_item(**kwargs)
+
+    other = history.DynamoDBHistoryStore(
+        "history", token_budget=1000, client=dynamodb_client
+    )
+    store = history.DynamoDBHistoryStore(
+        "history", token_budget=1000, client=RacingClient(dynamodb_client)
+    )
+    store.append("C1", "1.0", [["u", "q1"], ["a", "a1"]])
+
+    assert store.load("C1", "1.0") == [
+        ["u", "q2"],
+        ["a", "a2"],
+        ["u", "q1"],
+        ["a", "a1"],
+    ]
+
+
+def test_main_sends_thread_history_to_flow(runtime_client, monkeypatch):
+    monkeypatch.setenv("HISTORY_TOKEN_BUDGET", "1000")
+    first = make_record("m1", "<@UBOT> VPNの繋ぎ方は？", event_ts="1.0")
+    follow_up = json.loads(make_record("m2", "<@UBOT> Macの場合は？")["body"])
+    follow_up["event"]["thread_ts"] = "1.0"
+    handler.main({"Records": [first]}, {})
+    handler.main({"Records": [{"messageId": "m2", "body": json.dumps(follow_up)}]}, {})
+
+    assert runtime_client.inputs[0] == "VPNの繋ぎ方は？"
+    assert runtime_client.inputs[1] == (
+        "これまでの会話:\n"
+        "User: VPNの繋ぎ方は？\n"
+        "Assistant: answer: VPNの繋ぎ方は？\n\n"
+        "質問: Macの場合は？"
+    )
+
+
+def test_main_does_not_use_history_when_disabled(runtime_client, monkeypatch):
+    monkeypatch.delenv("HISTORY_TOKEN_BUDGET", raising=False)
+    handler.main({"Records": [make_record("m1", "q1", event_ts="1.0")]}, {})
+    follow_up = json.loads(make_record("m2", "q2")["body"])
+    follow_up["event"]["thread_ts"] = "1.0"
+    handler.main({"Records": [{"messageId": "m2", "body": json.dumps(follow_up)}]}, {})
+    assert runtime_client.inputs == ["q1", "q2"]
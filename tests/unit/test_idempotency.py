@@ -0,0 +1,180 @@
+import json
+
+import pytest
+from botocore.exceptions import EndpointConnectionError
+
+from bedrock_bot_common import dispatch, idempotency
+from lambda_module.api import handler as api_handler
+from lambda_module.sqs import handler as sqs_handler
+from tests.unit.fakes import FakeClock, make_record
+
+
+@pytest.fixture
+def dynamodb_store(dynamodb_table):
+    client = dynamodb_table("idempotency", "idempotency_key")
+    return idempotency.DynamoDBIdempotencyStore(
+        "idempotency", client=client, clock=FakeClock()
+    )
+
+
+@pytest.fixture(params=["memory", "dynamodb"])
+def store(request):
+    if request.param == "memory":
+        return idempotency.InMemoryIdempotencyStore(clock=FakeClock())
+    return request.getfixturevalue("dynamodb_store")
+
+
+def test_claim_is_granted_once(store):
+    assert store.claim("event:Ev1")
+    assert not store.claim("event:Ev1")
+    assert store.claim("event:Ev2")
+
+
+def test_release_allows_reclaim(store):
+    assert store.claim("event:Ev1")
+    store.release("event:Ev1")
+    assert store.claim("event:Ev1")
+
+
+def test_expired_claim_can_be_taken_over(store):
+    assert store.claim("event:Ev1", ttl_seconds=10)
+    store.clock.now += 11
+    assert store.claim("event:Ev1")
+
+
+def test_completed_record_blocks_until_expiry(store):
+    assert store.claim("event:Ev1", ttl_seconds=10)
+    store.complete("event:Ev1", ttl_seconds=100)
+    store.clock.now += 50
+    assert not store.claim("event:Ev1")
+
+
+def test_released_record_hands_over_pending_answer_once(store):
+    assert store.claim("flow:C1:1.0")
+    store.release("flow:C1:1.0", pending_answer="answer")
+    assert store.claim_with_pending("flow:C1:1.0") == (True, "answer")
+    assert store.claim_with_pending("flow:C1:1.0") == (False, None)
+    store.release("flow:C1:1.0")
+    assert store.claim_with_pending("flow:C1:1.0") == (True, None)
+
+
+def test_pending_answer_expires(store):
+    assert store.claim("flow:C1:1.0")
+    store.release("flow:C1:1.0", pending_answer="answer", ttl_seconds=10)
+    store.clock.now += 11
+    assert store.claim_with_pending("flow:C1:1.0") == (True, None)
+
+
+def make_api_event(event_id, retry_num=None):
+    body = {
+        "event_id": event_id,
+        "event": {
+            "type": "app_mention",
+            "text": "<@UBOT> hello",
+            "channel": "C123456",
+            "event_ts": "1700000000.000100",
+        },
+    }
+    headers = {"X-Slack-Retry-Num": retry_num} if retry_num else {}
+    return {"headers": headers, "body": json.dumps(body)}
+
+
+def test_api_processes_retry_when_first_delivery_was_lost(monkeypatch):
+    dispatched = []
+
+    class FlakyDispatcher:
+        supports_delay = False
+
+        def dispatch(self, body):
+            if not dispatched:
+                dispatched.append(None)
+                raise api_handler.ClientError(
+                    {"Error": {"Code": "ServiceUnavailable", "Message": ""}},
+                    "SendMessage",
+                )
+            dispatched.append(body)
+            return "id"
+
+    monkeypatch.setattr(api_handler, "is_verify_token", lambda body: True)
+    monkeypatch.setattr(api_handler.dispatch, "get_dispatcher", FlakyDispatcher)
+
+    assert api_handler.main(make_api_event("Ev1"), {})["statusCode"] == 500
+    assert api_handler.main(make_api_event("Ev1", "1"), {})["statusCode"] == 200
+    # 受け付け済みのイベントのリトライは送信しない
+    assert api_handler.main(make_api_event("Ev1", "2"), {})["statusCode"] == 200
+    assert len(dispatched) == 2
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        EndpointConnectionError(endpoint_url="https://sqs.us-east-1.amazonaws.com"),
+        RuntimeError("unexpected"),
+    ],
+)
+def test_api_releases_claim_on_any_dispatch_error(error, monkeypatch):
+    dispatched = []
+
+    class FlakyDispatcher:
+        supports_delay = False
+
+        def dispatch(self, body):
+            if not dispatched:
+                dispatched.append(None)
+                raise error
+            dispatched.append(body)
+            return "id"
+
+    monkeypatch.setattr(api_handler, "is_verify_token", lambda body: True)
+    monkeypatch.setattr(api_handler.dispatch, "get_dispatcher", FlakyDispatcher)
+
+    assert api_handler.main(make_api_event("Ev1"), {})["statusCode"] == 500
+    assert api_handler.main(make_api_event("Ev1", "1"), {})["statusCode"] == 200
+    assert len(dispatched) == 2
+
+
+def test_api_releases_claim_when_rate_limit_check_fails(monkeypatch):
+    def broken_check(user, channel, max_wait=0):
+        raise RuntimeError("rate limit table is unavailable")
+
+    monkeypatch.setattr(api_handler, "is_verify_token", lambda body: True)
+    monkeypatch.setattr(api_handler.rate_limit, "check", broken_check)
+    monkeypatch.setattr(
+        api_handler.dispatch, "get_dispatcher", lambda: dispatch.LocalDispatcher(None)
+    )
+    with pytest.raises(RuntimeError):
+        api_handler.main(make_api_event("Ev1"), {})
+
+    assert idempotency.get_idempotency_store().claim("event:Ev1")
+
+
+def test_api_claim_expires_with_the_api_timeout(monkeypatch):
+    claims = []
+    store = idempotency.get_idempotency_store()
+    monkeypatch.setattr(
+        store, "claim", lambda key, ttl_seconds: claims.append(ttl_seconds)
+    )
+    monkeypatch.setenv("EVENT_CLAIM_TTL_SECONDS", "15")
+    monkeypatch.setattr(api_handler, "is_verify_token", lambda body: True)
+
+    api_handler.main(make_api_event("Ev1"), {})
+
+    assert claims == [15]
+
+
+def test_worker_invokes_flow_once_for_duplicate_delivery(runtime_client):
+    record = make_record("m1", "hello", event_ts="1700000000.000100")
+    duplicate = dict(record, messageId="m2")
+    response = sqs_handler.main({"Records": [record]}, {})
+    assert response == {"batchItemFailures": []}
+    response = sqs_handler.main({"Records": [duplicate]}, {})
+    assert response == {"batchItemFailures": []}
+    assert runtime_client.inputs == ["hello"]
+    assert len(runtime_client.posted) == 1
+
+
+def test_worker_retries_after_failure(runtime_client):
+    record = make_record("m1", "broken", event_ts="1700000000.000100")
+    sqs_handler.main({"Records": [record]}, {})
+    sqs_handler.main({"Records": [record]}, {})
+    assert runtime_client.inputs == ["broken", "broken"]
@@ -0,0 +1,118 @@
+import json
+import logging
+
+import pytest
+
+from bedrock_bot_common import instrumentation
+from lambda_module.api import handler as api_handler
+from lambda_module.sqs import handler as sqs_handler
+from tests.unit.fakes import make_record
+
+
+def read_lines(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def find_emf(lines, function_name):
+    return next(
+        line for line in lines if "_aws" in line and line["Function"] == function_name
+    )
+
+
+@pytest.fixture
+def log_level():
+    logger = logging.getLogger(instrumentation.LOGGER_NAME)
+    level = logger.level
+    yield logger.setLevel
+    logger.setLevel(level)
+
+
+def test_logger_writes_json_with_fields(capsys):
+    logger = instrumentation.get_logger("test")
+    logger.info("hello", channel="C1", count=2)
+    (line,) = read_lines(capsys)
+    assert line["level"] == "INFO"
+    assert line["logger"] == "bedrock_bot.test"
+    assert line["message"] == "hello"
+    assert line["channel"] == "C1"
+    assert line["count"] == 2
+
+
+def test_logger_respects_level(capsys, log_level):
+    log_level("WARNING")
+    logger = instrumentation.get_logger("test")
+    logger.info("hidden")
+    logger.warning("shown")
+    assert [line["message"] for line in read_lines(capsys)] == ["shown"]
+
+
+def test_metrics_emits_embedded_metric_format():
+    lines = []
+    clock = iter([0.0, 0.25, 1.0, 1.5]).__next__
+    metrics = instrumentation.Metrics("api", emit=lines.append, clock=clock)
+    with metrics.timer("Dispatch"):
+        pass
+    with metrics.timer("Dispatch"):
+        pass
+    metrics.put("RequestBodyBytes", 128, "Bytes")
+    metrics.flush()
+
+    document = json.loads(lines[0])
+    directive = document["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == instrumentation.DEFAULT_NAMESPACE
+    assert directive["Dimensions"] == [["Function"]]
+    assert {"Name": "DispatchLatency", "Unit": "Milliseconds"} in directive["Metrics"]
+    assert document["Function"] == "api"
+    assert document["DispatchLatency"] == [250.0, 500.0]
+    assert document["RequestBodyBytes"] == 128
+
+    # 出力済みの値は次のflushに含めない
+    metrics.flush()
+    assert len(lines) == 1
+
+
+def test_timer_records_latency_on_exception():
+    metrics = instrumentation.Metrics("api", emit=lambda line: None)
+    with pytest.raises(ValueError):
+        with metrics.timer("Verify"):
+            raise ValueError()
+    assert len(metrics.values("VerifyLatency")) == 1
+
+
+def test_begin_marks_only_first_invocation_as_cold(monkeypatch):
+    monkeypatch.setattr(instrumentation, "_cold_start", True)
+    assert instrumentation.begin("api").values("ColdStart") == [1]
+    assert instrumentation.begin("api").values("ColdStart") == [0]
+
+
+def test_api_main_emits_stage_metrics_without_payload_dump(capsys):
+    event = {"body": '{"type": "url_verification", "challenge": "secret"}'}
+    api_handler.main(event, {})
+    lines = read_lines(capsys)
+    emf = find_emf(lines, "api")
+    assert "RequestLatency" in emf
+    assert "ParseLatency" in emf
+    assert emf["RequestBodyBytes"] == len(event["body"])
+    assert all("Received event" != line.get("message") for line in lines)
+
+
+def test_api_main_logs_payload_at_debug_level(capsys, log_level):
+    log_level("DEBUG")
+    api_handler.main({"body": '{"type": "url_verification", "challenge": "c"}'}, {})
+    lines = read_lines(capsys)
+    assert any(line.get("message") == "Received event" for line in lines)
+
+
+def test_sqs_main_emits_pipeline_stage_metrics(runtime_client, capsys):
+    sqs_handler.main({"Records": [make_record("m1", "hello")]}, {})
+    emf = find_emf(read_lines(capsys), "sqs")
+    for name in (
+        "RecordLatency",
+        "FlowInvokeLatency",
+        "FlowFirstEventLatency",
+        "FlowStreamDrainLatency",
+    ):
+        assert name in emf
+    assert emf["BatchSize"] == 1
+    assert emf["FailedRecords"] == 0
+    assert emf["PromptChars"] == len("hello")
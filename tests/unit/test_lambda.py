@@ -1,10 +1,12 @@
 import pytest
 import os
+from lambda_module.api import handler
 from lambda_module.api.handler import (
     main,
     is_verify_token,
     is_app_mention,
     has_slack_retry_header,
+    is_valid_signature,
 )
 import boto3
 
@@ -43,8 +45,8 @@ def test_main_not_app_mention():
     event = {"body": '{"event": {"type": "message", "text": "Hello"}}'}
     context = {}
     response = main(event, context)
-    assert response["statusCode"] == 400
-    assert response["body"] == '{"message": "Not an app mention."}'
+    assert response["statusCode"] == 200
+    assert response["body"] == '{"message": "Event ignored."}'
 
 
 def test_main_no_body():
@@ -59,8 +61,8 @@ def test_main_no_text():
     event = {"body": '{"event": {"type": "app_mention"}}'}
     context = {}
     response = main(event, context)
-    assert response["statusCode"] == 500
-    assert response["body"] == '{"message": "Text is not found."}'
+    assert response["statusCode"] == 200
+    assert response["body"] == '{"message": "Event ignored."}'
 
 
 # @pytest.fixture
@@ -103,3 +105,137 @@ def test_has_slack_retry_header():
 def test_has_no_slack_retry_header():
     event = {"headers": {}}
     assert has_slack_retry_header(event) == False
+
+
+# Slackのドキュメントにある署名の例
+SIGNING_SECRET = "8f742231b10e8888abcd99yyyzzz85a5"
+SIGNED_TIMESTAMP = 1531420618
+SIGNED_BODY = (
+    "token=xyzz0WbapA4vBCDEFasx0q6G&team_id=T1DC2JH3J&team_domain=testteamnow"
+    "&channel_id=G8PSS9T3V&channel_name=foobar&user_id=U2CERLKJA"
+    "&user_name=roadrunner&command=%2Fwebhook-collect&text="
+    "&response_url=https%3A%2F%2Fhooks.slack.com%2Fcommands%2FT1DC2JH3J"
+    "%2F397700885554%2F96rGlfmibIGlgcZRskXaIFfN"
+    "&trigger_id=398738663015.47445629121.803a0bc887a14d10d2c447fce8b6703c"
+)
+SIGNATURE = "v0=a2114d57b48eac39b9ad189dd8316235a7b4a8d21a10bd27519666489c69b503"
+
+
+@pytest.fixture
+def signing_secret(monkeypatch):
+    fetched = []
+    monkeypatch.setenv("SLACK_SIGNING_SECRET", "/bedrock_bot/lambda/signing_secret")
+    monkeypatch.setattr(handler, "_signing_hmac", None)
+    monkeypatch.setattr(
+        handler.parameters,
+        "get_parameter",
+        lambda name: fetched.append(name) or SIGNING_SECRET,
+    )
+    return fetched
+
+
+def make_signed_event(signature=SIGNATURE, timestamp=SIGNED_TIMESTAMP):
+    return {
+        "headers": {
+            "x-slack-signature": signature,
+            "X-Slack-Request-Timestamp": str(timestamp),
+        },
+        "body": SIGNED_BODY,
+    }
+
+
+def test_is_valid_signature(signing_secret):
+    assert is_valid_signature(make_signed_event(), now=SIGNED_TIMESTAMP + 10)
+
+
+def test_is_valid_signature_loads_secret_once(signing_secret):
+    for _ in range(3):
+        is_valid_signature(make_signed_event(), now=SIGNED_TIMESTAMP)
+    assert signing_secret == ["/bedrock_bot/lambda/signing_secret"]
+
+
+def test_is_invalid_signature(signing_secret):
+    event = make_signed_event(signature=SIGNATURE[:-1] + "0")
+    assert not is_valid_signature(event, now=SIGNED_TIMESTAMP)
+
+
+def test_is_invalid_signature_outside_replay_window(signing_secret):
+    assert not is_valid_signature(
+        make_signed_event(), now=SIGNED_TIMESTAMP + handler.REPLAY_WINDOW_SECONDS + 1
+    )
+
+
+def test_is_invalid_signature_without_headers(signing_secret):
+    assert not is_valid_signature({"body": SIGNED_BODY}, now=SIGNED_TIMESTAMP)
+    assert signing_secret == []
+
+
+def test_main_rejects_unsigned_app_mention(signing_secret):
+    event = {
+        "headers": {},
+        "body": '{"event": {"type": "app_mention", "text": "Hello"}}',
+    }
+    response = main(event, {})
+    assert response["statusCode"] == 403
+    assert response["body"] == '{"message": "Invalid token."}'
+
+
+def test_is_verify_token_uses_constant_time_compare(monkeypatch):
+    monkeypatch.setenv("SLACK_BOT_VERIFY_TOKEN", "/bedrock_bot/lambda/token/verify")
+    monkeypatch.setattr(handler.parameters, "get_parameter", lambda name: "valid")
+    assert is_verify_token({"token": "valid"})
+    assert not is_verify_token({"token": "invalid"})
+    assert not is_verify_token({})
+
+
+class FakeSSMClient:
+    def __init__(self):
+        self.requested = []
+
+    def get_parameters(self, Names, WithDecryption):
+        self.requested.append(Names)
+        return {"Parameters": [{"Name": name, "Value": name} for name in Names]}
+
+
+@pytest.fixture
+def warm_environment(monkeypatch):
+    ssm = FakeSSMClient()
+    stubs = {"ssm": ssm, "sqs": object(), "dynamodb": object()}
+    monkeypatch.setenv("SLACK_BOT_VERIFY_TOKEN", "/bedrock_bot/lambda/token/verify")
+    monkeypatch.setenv("SLACK_SIGNING_SECRET", "/bedrock_bot/lambda/signing_secret")
+    monkeypatch.setenv("SLACK_BOT_USER_ACCESS_TOKEN", "/bedrock_bot/lambda/access")
+    monkeypatch.setenv("SQS_QUEUE_URL", "https://sqs.local/queue")
+    monkeypatch.setenv("IDEMPOTENCY_TABLE", "idempotency")
+    monkeypatch.setenv("RATE_LIMIT_TABLE", "rate-limit")
+    monkeypatch.setattr(handler, "_signing_hmac", None)
+    monkeypatch.setattr(
+        handler.dispatch.clients, "get_client", lambda name, *args: stubs[name]
+    )
+    return ssm
+
+
+def test_warm_fetches_parameters_and_creates_clients(warm_environment):
+    handler.warm()
+    assert warm_environment.requested == [
+        [
+            "/bedrock_bot/lambda/token/verify",
+            "/bedrock_bot/lambda/signing_secret",
+            "/bedrock_bot/lambda/access",
+        ]
+    ]
+    assert handler._signing_hmac is not None
+    assert handler.idempotency.get_idempotency_store().client is not None
+    assert handler.rate_limit.get_rate_limiter().client is not None
+
+    # 最初のリクエストではSSMを呼ばない
+    assert is_verify_token({"token": "/bedrock_bot/lambda/token/verify"})
+    assert len(warm_environment.requested) == 1
+
+
+def test_warm_failure_is_left_to_first_request(warm_environment, monkeypatch):
+    def broken(Names, WithDecryption):
+        raise RuntimeError("unreachable")
+
+    monkeypatch.setattr(warm_environment, "get_parameters", broken)
+    handler.warm()
+    assert handler._signing_hmac is None
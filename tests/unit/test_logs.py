@@ -0,0 +1,137 @@
+import io
+import json
+
+from bedrock_bot import logs
+
+REPORT_COLD = (
+    "REPORT RequestId: r1\tDuration: 120.50 ms\tBilled Duration: 121 ms\t"
+    "Memory Size: 256 MB\tMax Memory Used: 80 MB\tInit Duration: 400.25 ms\t"
+)
+REPORT_WARM = (
+    "REPORT RequestId: r2\tDuration: 20.00 ms\tBilled Duration: 20 ms\t"
+    "Memory Size: 256 MB\tMax Memory Used: 82 MB\t"
+)
+
+
+def log(logger, message, timestamp, **fields):
+    return json.dumps(
+        {
+            "timestamp": timestamp,
+            "level": "INFO",
+            "logger": logger,
+            "message": message,
+            **fields,
+        }
+    )
+
+
+def test_parse_report():
+    assert logs.parse_report(REPORT_COLD) == {
+        "request_id": "r1",
+        "duration_ms": 120.5,
+        "billed_ms": 121.0,
+        "memory_mb": 256.0,
+        "max_memory_mb": 80.0,
+        "init_ms": 400.25,
+    }
+    assert "init_ms" not in logs.parse_report(REPORT_WARM)
+    assert logs.parse_report("START RequestId: r1") is None
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert logs.percentile(values, 50) == 50
+    assert logs.percentile(values, 99) == 99
+    assert logs.percentile([], 50) is None
+
+
+def test_analyzer_correlates_api_and_worker_by_event_ts():
+    analyzer = logs.LogAnalyzer()
+    lines = [
+        (
+            "api-stream",
+            log(
+                "bedrock_bot.api",
+                "Message dispatched",
+                1700000000500,
+                event_ts="1700000000.000100",
+            ),
+        ),
+        ("api-stream", REPORT_COLD),
+        (
+            "worker-stream",
+            log(
+                "bedrock_bot.sqs",
+                "Processing mention",
+                1700000000700,
+                event_ts="1700000000.000100",
+            ),
+        ),
+        ("api-stream", REPORT_WARM),
+        (
+            "worker-stream",
+            log(
+                "bedrock_bot.sqs",
+                "Mention processed",
+                1700000003100,
+                event_ts="1700000000.000100",
+            ),
+        ),
+        ("worker-stream", REPORT_WARM),
+    ]
+    for stream, message in lines:
+        analyzer.add(message, stream=stream)
+
+    summary = analyzer.summary()
+    assert summary["functions"]["api"]["invocations"] == 2
+    assert summary["functions"]["api"]["cold_start_rate"] == 0.5
+    assert summary["functions"]["api"]["init_ms"]["p50"] == 400.2
+    assert summary["functions"]["worker"]["invocations"] == 1
+    assert summary["mentions"]["queue_delay_ms"]["p50"] == 200
+    assert summary["mentions"]["worker_ms"]["p50"] == 2400
+    assert summary["mentions"]["end_to_end_ms"]["p99"] == 3099.9
+    assert summary["slowest"] == [
+        {"event_ts": "1700000000.000100", "end_to_end_ms": 3099.9}
+    ]
+    assert "api: n=2 cold=50.0%" in logs.format_summary(summary)
+
+
+def test_analyze_saved_files_with_filter(tmp_path):
+    # aws logs tail の出力と filter-log-events のJSON出力
+    tail_file = tmp_path / "api.log"
+    tail_file.write_text(
+        "\n".join(
+            [
+                "2024-01-01T00:00:00.000000+00:00 2024/01/01/[$LATEST]abc "
+                + log("bedrock_bot.api", "Request rate limited", 1, user="U1"),
+                "2024-01-01T00:00:00.100000+00:00 2024/01/01/[$LATEST]abc "
+                + REPORT_WARM,
+            ]
+        )
+    )
+    events_file = tmp_path / "worker.json"
+    events_file.write_text(
+        json.dumps(
+            {
+                "events": [
+                    {
+                        "logStreamName": "w1",
+                        "message": log("bedrock_bot.sqs", "Processing mention", 2),
+                    },
+                    {"logStreamName": "w1", "message": REPORT_COLD},
+                ]
+            }
+        )
+    )
+    out = io.StringIO()
+
+    summary = logs.analyze_files(
+        [str(tail_file), str(events_file)],
+        logs.parse_filters(["message=Request rate limited"]),
+        out=out,
+    )
+
+    assert set(summary["functions"]) == {"api", "worker"}
+    assert summary["functions"]["worker"]["cold_start_rate"] == 1.0
+    (line,) = out.getvalue().splitlines()
+    assert json.loads(line)["user"] == "U1"
@@ -0,0 +1,65 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from bedrock_bot_common import parameters
+
+
+class FakeSSMClient:
+    def __init__(self, values):
+        self.values = values
+        self.calls = []
+
+    def get_parameters(self, Names, WithDecryption):
+        self.calls.append(list(Names))
+        return {
+            "Parameters": [
+                {"Name": name, "Value": self.values[name]}
+                for name in Names
+                if name in self.values
+            ],
+            "InvalidParameters": [name for name in Names if name not in self.values],
+        }
+
+
+def test_get_parameters_uses_single_batch_call():
+    client = FakeSSMClient({"/a": "1", "/b": "2", "/c": "3", "/d": "4"})
+    values = parameters.get_parameters(["/a", "/b", "/c", "/d"], client=client)
+    assert values == {"/a": "1", "/b": "2", "/c": "3", "/d": "4"}
+    assert client.calls == [["/a", "/b", "/c", "/d"]]
+
+
+def test_get_parameters_is_cached_while_warm():
+    client = FakeSSMClient({"/a": "1", "/b": "2"})
+    parameters.get_parameters(["/a", "/b"], client=client)
+    assert parameters.get_parameter("/a", client=client) == "1"
+    assert parameters.get_parameters(["/a", "/b"], client=client) == {
+        "/a": "1",
+        "/b": "2",
+    }
+    assert len(client.calls) == 1
+
+
+def test_get_parameters_refetches_after_ttl(monkeypatch):
+    client = FakeSSMClient({"/a": "1"})
+    monkeypatch.setenv("SSM_PARAMETER_CACHE_TTL", "0")
+    parameters.get_parameter("/a", client=client)
+    parameters.get_parameter("/a", client=client)
+    assert len(client.calls) == 2
+
+
+def test_invalidate_forces_refetch():
+    client = FakeSSMClient({"/a": "1", "/b": "2"})
+    parameters.get_parameters(["/a", "/b"], client=client)
+    client.values["/a"] = "rotated"
+    parameters.invalidate(["/a"])
+    assert parameters.get_parameters(["/a", "/b"], client=client) == {
+        "/a": "rotated",
+        "/b": "2",
+    }
+    assert client.calls == [["/a", "/b"], ["/a"]]
+
+
+def test_get_parameters_raises_for_invalid_parameters():
+    client = FakeSSMClient({"/a": "1"})
+    with pytest.raises(ClientError):
+        parameters.get_parameters(["/a", "/missing"], client=client)
@@ -0,0 +1,60 @@
+from bedrock_bot_common import prompt, tokens
+from lambda_module.sqs import handler
+from tests.unit.fakes import make_record
+
+
+def test_strip_mentions():
+    assert prompt.strip_mentions("<@UBOT> hi <@U2|taro>", "UBOT") == " hi @taro"
+    assert prompt.strip_mentions("hi <@UBOT> and <@U2>", "UBOT") == "hi  and @U2"
+    # ボットのユーザーIDが分からない場合は先頭のメンションだけを除く
+    assert prompt.strip_mentions("<@UBOT><@U2> hi <@U3>", "") == " hi @U3"
+
+
+def test_normalize_mrkdwn():
+    text = (
+        "<#C1|general> で <!here> <https://example.com/a|手順書> "
+        "<https://example.com/b> <!subteam^S1|@infra>\n\n\n\n"
+        "a &lt; b &amp;&amp; c &gt; d   \n"
+    )
+    assert prompt.normalize_mrkdwn(text) == (
+        "#general で @here 手順書 (https://example.com/a) "
+        "https://example.com/b @infra\n\n"
+        "a < b && c > d"
+    )
+
+
+def test_truncate_keeps_head_and_tail_within_budget():
+    text = "先頭の説明\n" + "log line 0123456789\n" * 500 + "最後のエラー"
+    truncated = prompt.truncate(text, 200)
+
+    assert tokens.estimate_tokens(truncated) <= 200
+    assert truncated.startswith("先頭の説明")
+    assert truncated.endswith("最後のエラー")
+    assert prompt.TRUNCATION_MARKER in truncated
+    assert prompt.truncate("short", 200) == "short"
+    assert prompt.truncate(text, 0) == text
+
+
+def test_prepare(monkeypatch):
+    monkeypatch.setenv("PROMPT_TOKEN_BUDGET", "10")
+    assert prompt.prepare("<@UBOT> hello") == ("hello", False)
+    text, truncated = prompt.prepare("<@UBOT> " + "あ" * 50)
+    assert truncated and tokens.estimate_tokens(text) <= 10
+    assert prompt.prepare("<@UBOT>  ") == ("", False)
+
+
+def test_empty_prompt_is_answered_without_bedrock(runtime_client):
+    handler.process_records([make_record("1", "<@UBOT> ")])
+
+    assert runtime_client.inputs == []
+    assert runtime_client.posted == [("C123456", handler.EMPTY_PROMPT_MESSAGE)]
+
+
+def test_long_prompt_is_truncated_before_the_flow(runtime_client, monkeypatch):
+    monkeypatch.setenv("PROMPT_TOKEN_BUDGET", "50")
+
+    handler.process_records([make_record("1", "<@UBOT> " + "error " * 500)])
+
+    (text,) = runtime_client.inputs
+    assert tokens.estimate_tokens(text) <= 50
+    assert prompt.TRUNCATION_MARKER in text
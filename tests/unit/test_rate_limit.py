@@ -0,0 +1,136 @@
+import json
+
+import pytest
+
+from bedrock_bot_common import dispatch, rate_limit
+from lambda_module.api import handler as api_handler
+from tests.unit.fakes import FakeClock
+
+
+@pytest.fixture
+def dynamodb_limiter(dynamodb_table):
+    client = dynamodb_table("rate_limit", "bucket_key")
+    return rate_limit.DynamoDBRateLimiter(
+        "rate_limit", client=client, clock=FakeClock()
+    )
+
+
+@pytest.fixture(params=["memory", "dynamodb"])
+def limiter(request):
+    if request.param == "memory":
+        return rate_limit.InMemoryRateLimiter(clock=FakeClock())
+    return request.getfixturevalue("dynamodb_limiter")
+
+
+def test_token_bucket_allows_burst_then_refills(limiter):
+    limit = rate_limit.Limit(capacity=2, per_minute=6)
+    assert limiter.acquire("user:U1", limit) == (True, 0)
+    assert limiter.acquire("user:U1", limit) == (True, 0)
+    allowed, retry_after = limiter.acquire("user:U1", limit)
+    assert not allowed
+    assert retry_after == pytest.approx(10)
+
+    # 1分あたり6件 = 10秒で1件回復する
+    limiter.clock.now += 10
+    assert limiter.acquire("user:U1", limit) == (True, 0)
+    assert limiter.acquire("user:U2", limit) == (True, 0)
+
+
+def test_reservations_build_debt_up_to_max_wait(limiter):
+    limit = rate_limit.Limit(capacity=1, per_minute=6)
+    assert limiter.acquire("user:U1", limit, max_wait=25) == (True, 0)
+    # 足りない分は先のトークンを予約し、予約が増えるほど待ち時間が延びる
+    assert limiter.acquire("user:U1", limit, max_wait=25) == (True, pytest.approx(10))
+    assert limiter.acquire("user:U1", limit, max_wait=25) == (True, pytest.approx(20))
+    allowed, wait = limiter.acquire("user:U1", limit, max_wait=25)
+    assert not allowed
+    assert wait == pytest.approx(30)
+
+    # 予約した分が返るまでは、断られ続ける
+    limiter.clock.now += 10
+    assert not limiter.acquire("user:U1", limit, max_wait=0)[0]
+    limiter.clock.now += 20
+    assert limiter.acquire("user:U1", limit, max_wait=0) == (True, 0)
+
+
+def test_check_limits_user_and_channel_separately(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_USER_CAPACITY", "1")
+    monkeypatch.setenv("RATE_LIMIT_USER_PER_MINUTE", "1")
+    monkeypatch.setenv("RATE_LIMIT_CHANNEL_CAPACITY", "2")
+    monkeypatch.setenv("RATE_LIMIT_CHANNEL_PER_MINUTE", "1")
+    limiter = rate_limit.InMemoryRateLimiter(clock=FakeClock())
+
+    assert rate_limit.check("U1", "C1", limiter)[0]
+    assert not rate_limit.check("U1", "C1", limiter)[0]
+    assert rate_limit.check("U2", "C1", limiter)[0]
+    # チャンネル全体の上限に達すると、別のユーザーも制限される
+    assert not rate_limit.check("U3", "C1", limiter)[0]
+    assert rate_limit.check("U4", "C2", limiter)[0]
+
+
+def test_check_is_disabled_without_limits(monkeypatch):
+    for name in ("USER", "CHANNEL"):
+        monkeypatch.delenv(f"RATE_LIMIT_{name}_CAPACITY", raising=False)
+    limiter = rate_limit.InMemoryRateLimiter()
+    assert all(rate_limit.check("U1", "C1", limiter)[0] for _ in range(100))
+
+
+def make_api_event(index):
+    body = {
+        "event_id": f"Ev{index}",
+        "event": {
+            "type": "app_mention",
+            "user": "U1",
+            "text": "<@UBOT> hello",
+            "channel": "C1",
+            "event_ts": f"1700000000.{index}",
+        },
+    }
+    return {"headers": {}, "body": json.dumps(body)}
+
+
+@pytest.fixture
+def api(monkeypatch):
+    ephemeral = []
+    local = dispatch.LocalDispatcher(lambda event, context: None)
+    rate_limit.reset()
+    monkeypatch.setenv("RATE_LIMIT_USER_CAPACITY", "1")
+    monkeypatch.setenv("RATE_LIMIT_USER_PER_MINUTE", "2")
+    monkeypatch.setattr(api_handler, "is_verify_token", lambda body: True)
+    monkeypatch.setattr(api_handler.dispatch, "get_dispatcher", lambda: local)
+    monkeypatch.setattr(
+        api_handler,
+        "post_ephemeral",
+        lambda channel, user, message: ephemeral.append((channel, user, message)),
+    )
+    yield local, ephemeral
+    rate_limit.reset()
+
+
+def test_api_defers_within_the_cap_and_rejects_the_rest_of_a_burst(api):
+    local, ephemeral = api
+    responses = [api_handler.main(make_api_event(i), {}) for i in range(12)]
+
+    assert all(response["statusCode"] == 200 for response in responses)
+    # 30秒に1件回復するため、上限60秒までの2件だけを予約して後回しにする
+    assert local.delays == [0, 30, 60]
+    rejected = [r for r in responses if r["body"] == '{"message": "Rate limited."}']
+    assert len(rejected) == 9
+    assert ephemeral[:2] == [("C1", "U1", api_handler.DEFERRED_MESSAGE)] * 2
+    assert len(ephemeral) == 11
+
+
+def test_api_rejects_long_waits_with_ephemeral_notice(api, monkeypatch):
+    local, ephemeral = api
+    monkeypatch.setenv("RATE_LIMIT_MAX_DEFER_SECONDS", "10")
+    api_handler.main(make_api_event(1), {})
+    response = api_handler.main(make_api_event(2), {})
+    assert response["statusCode"] == 200
+    assert response["body"] == '{"message": "Rate limited."}'
+    assert local.delays == [0]
+    assert ephemeral == [
+        ("C1", "U1", api_handler.RATE_LIMITED_MESSAGE.format(seconds=30))
+    ]
+    # 制限で断ったイベントのリトライは、受け付け済みとして扱う
+    api_handler.main(make_api_event(2), {})
+    assert len(ephemeral) == 1
@@ -0,0 +1,139 @@
+import json
+
+from bedrock_bot import redrive
+from bedrock_bot_common import dispatch, enqueue
+from lambda_module.sqs import handler as sqs_handler
+
+
+def make_body(event_ts, text="hello"):
+    return {
+        "event": {
+            "type": "app_mention",
+            "user": "U1",
+            "text": text,
+            "channel": "C123456",
+            "event_ts": event_ts,
+        }
+    }
+
+
+def make_dlq():
+    return redrive.LocalQueue(
+        [
+            enqueue.encode_message(make_body("1.0")),
+            # SQSの再配信で同じメンションが2回DLQに入った場合
+            enqueue.encode_message(make_body("1.0")),
+            # 非同期起動に失敗したワーカーのイベント
+            json.dumps(
+                dispatch.build_worker_event([make_body("2.0"), make_body("3.0")])
+            ),
+            "not json",
+        ]
+    )
+
+
+def make_redriver(dlq, dispatcher, **kwargs):
+    return redrive.Redriver(dlq, "dlq", dispatcher, rate=0, workers=2, **kwargs)
+
+
+def test_redrive_to_queue_dedupes_and_deletes_sent_messages():
+    dlq = make_dlq()
+    queue = redrive.LocalQueue()
+    dispatcher = dispatch.SqsDispatcher("queue", client=queue)
+
+    report = make_redriver(dlq, dispatcher).drain()
+
+    sent = sorted(
+        enqueue.decode_message(body)["event"]["event_ts"] for body in queue.sent
+    )
+    assert sent == ["1.0", "2.0", "3.0"]
+    assert report["received"] == 4
+    assert report["redriven"] == 3
+    assert report["duplicates"] == 1
+    assert report["unreadable"] == 1
+    assert dlq.messages == ["not json"]
+
+
+def test_dry_run_leaves_the_dlq_untouched():
+    dlq = make_dlq()
+    queue = redrive.LocalQueue()
+    dispatcher = dispatch.SqsDispatcher("queue", client=queue)
+
+    report = make_redriver(dlq, dispatcher, dry_run=True).drain()
+
+    assert queue.sent == []
+    assert len(dlq.messages) == 4
+    # 可視性タイムアウトを待たずに、すぐに受信できる状態へ戻す
+    assert len(dlq.visible_messages) == 4
+    assert sorted(report["events"]) == ["C123456:1.0", "C123456:2.0", "C123456:3.0"]
+
+
+def test_dry_run_then_real_run_redrives_everything():
+    dlq = make_dlq()
+    queue = redrive.LocalQueue()
+    dispatcher = dispatch.SqsDispatcher("queue", client=queue)
+
+    make_redriver(dlq, dispatcher, dry_run=True).drain()
+    report = make_redriver(dlq, dispatcher).drain()
+
+    assert report["received"] == 4
+    assert report["redriven"] == 3
+    assert len(queue.sent) == 3
+    assert dlq.messages == ["not json"]
+
+
+def test_queue_dispatcher_keeps_priority_channels():
+    dispatcher = redrive.make_dispatcher(
+        redrive.TARGET_QUEUE,
+        queue_url="queue",
+        sqs_client=redrive.LocalQueue(),
+        priority_queue_url="priority",
+        priority_channels=dispatch.parse_channels("C123456,C999"),
+    )
+
+    assert dispatcher.get_queue_url(make_body("1.0")) == "priority"
+    other = make_body("2.0")
+    other["event"]["channel"] = "C000"
+    assert dispatcher.get_queue_url(other) == "queue"
+
+
+def test_redrive_directly_to_the_worker(runtime_client):
+    dlq = redrive.LocalQueue([enqueue.encode_message(make_body("1.0"))])
+    dispatcher = dispatch.LocalDispatcher(
+        sqs_handler.main, mode=dispatch.DISPATCH_MODE_LAMBDA
+    )
+
+    report = make_redriver(dlq, dispatcher).drain()
+
+    assert report["redriven"] == 1
+    assert runtime_client.posted == [("C123456", "answer: hello")]
+    assert dlq.messages == []
+
+
+def test_max_messages_limits_the_drain():
+    dlq = redrive.LocalQueue(
+        [enqueue.encode_message(make_body(f"{i}.0")) for i in range(25)]
+    )
+    dispatcher = dispatch.SqsDispatcher("queue", client=redrive.LocalQueue())
+
+    report = make_redriver(dlq, dispatcher, max_messages=12).drain()
+
+    assert report["received"] == 12
+    assert len(dlq.messages) == 13
+
+
+def test_pacer_limits_the_send_rate():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    pacer = redrive.Pacer(2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(6):
+        pacer.wait()
+
+    # 最初の2件はすぐに送り、その後は0.5秒に1件
+    assert now[0] == 2.0
+    assert len(sleeps) == 4
@@ -0,0 +1,77 @@
+import pytest
+
+from bedrock_bot_common import response_cache
+from lambda_module.sqs import handler
+from tests.unit.fakes import FakeClock, make_record
+
+
+@pytest.fixture
+def dynamodb_client(dynamodb_table):
+    return dynamodb_table("cache", "cache_key")
+
+
+def test_normalize_prompt_strips_mentions_and_folds_whitespace():
+    assert (
+        response_cache.normalize_prompt("<@U123ABC>   VPNの\n\n繋ぎ方は？ ")
+        == "VPNの 繋ぎ方は？"
+    )
+    assert response_cache.normalize_prompt("<@U123|bot> hi") == "hi"
+
+
+def test_make_cache_key_depends_on_flow_and_alias():
+    key = response_cache.make_cache_key("<@U1> hello", "flow", "alias")
+    assert key == response_cache.make_cache_key("hello  ", "flow", "alias")
+    assert key != response_cache.make_cache_key("hello", "flow", "alias2")
+    assert key != response_cache.make_cache_key("hello", "flow2", "alias")
+
+
+def test_lru_cache_evicts_least_recently_used_and_expired():
+    clock = FakeClock()
+    cache = response_cache.LruResponseCache(max_entries=2, ttl_seconds=10, clock=clock)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    clock.now += 11
+    assert cache.get("a") is None
+
+
+def test_dynamodb_cache_round_trip_and_ttl(dynamodb_client):
+    clock = FakeClock()
+    cache = response_cache.DynamoDBResponseCache(
+        "cache", ttl_seconds=10, client=dynamodb_client, clock=clock
+    )
+    assert cache.get("key") is None
+    cache.set("key", "answer")
+    assert cache.get("key") == "answer"
+    clock.now += 11
+    assert cache.get("key") is None
+
+
+def test_tiered_cache_fills_local_from_remote(dynamodb_client):
+    remote = response_cache.DynamoDBResponseCache("cache", client=dynamodb_client)
+    remote.set("key", "answer")
+    cache = response_cache.TieredResponseCache(
+        response_cache.LruResponseCache(), remote
+    )
+    assert cache.get("key") == "answer"
+    assert cache.local.get("key") == "answer"
+
+
+def test_main_answers_repeated_question_from_cache(runtime_client):
+    handler.main({"Records": [make_record("m1", "<@UBOT> VPN の繋ぎ方")]}, {})
+    handler.main({"Records": [make_record("m2", "<@UBOT>  VPN の繋ぎ方 ")]}, {})
+    assert len(runtime_client.inputs) == 1
+    assert [message for _, message in runtime_client.posted] == [
+        "answer: VPN の繋ぎ方",
+        "answer: VPN の繋ぎ方",
+    ]
+
+
+def test_main_skips_cache_for_opted_out_channel(runtime_client, monkeypatch):
+    monkeypatch.setenv("RESPONSE_CACHE_OPTOUT_CHANNELS", "C999,C123456")
+    handler.main({"Records": [make_record("m1", "hello")]}, {})
+    handler.main({"Records": [make_record("m2", "hello")]}, {})
+    assert len(runtime_client.inputs) == 2
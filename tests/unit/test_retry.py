@@ -0,0 +1,313 @@
+import json
+
+import pytest
+from botocore.exceptions import (
+    ClientError,
+    EndpointConnectionError,
+    ReadTimeoutError,
+)
+
+from bedrock_bot_common import clients, idempotency, retry, slack
+from lambda_module.sqs import handler
+from tests.unit.fakes import FakeClock, make_record
+
+# フィクスチャで差し替える前の実装
+post_message_to_channel = handler.post_message_to_channel
+
+
+def throttling_error():
+    return ClientError(
+        {"Error": {"Code": "ThrottlingException", "Message": "slow down"}},
+        "InvokeFlow",
+    )
+
+
+def make_retrier(name="Test", **kwargs):
+    sleeps = []
+    kwargs.setdefault("breaker", retry.CircuitBreaker(name, clock=FakeClock()))
+    retrier = retry.Retrier(
+        name, sleep=sleeps.append, rand=lambda: 1.0, base_delay=1, **kwargs
+    )
+    return retrier, sleeps
+
+
+def flaky(failures, error=throttling_error):
+    calls = []
+
+    def func():
+        calls.append(None)
+        if len(calls) <= failures:
+            raise error()
+        return "ok"
+
+    return func, calls
+
+
+def test_full_jitter_is_bounded_by_exponential_cap():
+    assert retry.full_jitter(0, 0.5, 20, rand=lambda: 1.0) == 0.5
+    assert retry.full_jitter(3, 0.5, 20, rand=lambda: 1.0) == 4
+    assert retry.full_jitter(10, 0.5, 20, rand=lambda: 1.0) == 20
+    assert retry.full_jitter(10, 0.5, 20, rand=lambda: 0.0) == 0
+
+
+def test_retrier_backs_off_on_throttling():
+    retrier, sleeps = make_retrier()
+    func, calls = flaky(2)
+    assert retrier.call(func) == "ok"
+    assert len(calls) == 3
+    assert sleeps == [1, 2]
+
+
+def test_retrier_honors_retry_after():
+    retrier, sleeps = make_retrier(max_delay=10)
+    func, _ = flaky(1, lambda: retry.RetryableError("429", retry_after=7))
+    assert retrier.call(func) == "ok"
+    assert sleeps == [7]
+
+    # 上限を超える待ちはその場で諦め、呼び出し元に任せる
+    func, calls = flaky(1, lambda: retry.RetryableError("429", retry_after=60))
+    with pytest.raises(retry.RetryableError):
+        retrier.call(func)
+    assert len(calls) == 1
+
+
+def test_retrier_does_not_retry_client_errors():
+    retrier, sleeps = make_retrier()
+    func, calls = flaky(
+        1,
+        lambda: ClientError(
+            {"Error": {"Code": "ValidationException", "Message": "bad"}}, "InvokeFlow"
+        ),
+    )
+    with pytest.raises(ClientError):
+        retrier.call(func)
+    assert len(calls) == 1
+    assert sleeps == []
+
+
+def test_retrier_retries_connection_errors():
+    retrier, sleeps = make_retrier()
+    func, calls = flaky(1, lambda: ReadTimeoutError(endpoint_url="https://bedrock"))
+    assert retrier.call(func) == "ok"
+    func, calls = flaky(
+        1, lambda: EndpointConnectionError(endpoint_url="https://bedrock")
+    )
+    assert retrier.call(func) == "ok"
+    assert sleeps == [1, 1]
+
+
+def test_retry_budget_limits_retries():
+    retrier, sleeps = make_retrier(
+        max_attempts=10, budget=retry.RetryBudget(capacity=3, refill=0.5)
+    )
+    func, calls = flaky(100)
+    with pytest.raises(ClientError):
+        retrier.call(func)
+    assert len(calls) == 4
+
+    # 予算を使い切った後は再試行しない
+    func, calls = flaky(100)
+    with pytest.raises(ClientError):
+        retrier.call(func)
+    assert len(calls) == 1
+
+
+def test_circuit_breaker_opens_and_probes_after_cooldown():
+    clock = FakeClock()
+    breaker = retry.CircuitBreaker(
+        "Test", failure_threshold=2, cooldown=30, clock=clock
+    )
+    retrier, _ = make_retrier(max_attempts=1, breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(ClientError):
+            retrier.call(flaky(1)[0])
+    with pytest.raises(retry.CircuitOpenError) as excinfo:
+        retrier.call(flaky(0)[0])
+    assert excinfo.value.retry_after == 30
+
+    # 待ち時間が過ぎたら1件だけ試し、成功すれば閉じる
+    clock.now += 30
+    assert retrier.call(flaky(0)[0]) == "ok"
+    assert not breaker.is_open
+
+
+def test_non_retryable_probe_error_does_not_leave_circuit_stuck():
+    clock = FakeClock()
+    breaker = retry.CircuitBreaker(
+        "Test", failure_threshold=1, cooldown=30, clock=clock
+    )
+    retrier, _ = make_retrier(max_attempts=1, breaker=breaker)
+    with pytest.raises(ClientError):
+        retrier.call(flaky(1)[0])
+
+    # 回復の確認中に入力の誤りなどで失敗しても、次の呼び出しで改めて試す
+    clock.now += 30
+    with pytest.raises(ValueError):
+        retrier.call(flaky(1, ValueError)[0])
+    clock.now += 1000
+    assert retrier.call(flaky(0)[0]) == "ok"
+    assert not breaker.is_open
+
+
+def test_defer_seconds():
+    assert retry.get_defer_seconds(ValueError("bug")) is None
+    assert retry.get_defer_seconds(retry.CircuitOpenError("x", 10), lambda: 0.5) == 15
+    assert (
+        retry.get_defer_seconds(retry.RetryableError("429", retry_after=4), lambda: 0)
+        == 4
+    )
+
+
+def test_defer_seconds_doubles_with_each_receive():
+    error = retry.CircuitOpenError("x", 30)
+    assert [
+        retry.get_defer_seconds(error, lambda: 0, receive_count=n) for n in (1, 2, 5)
+    ] == [30, 60, 480]
+    assert (
+        retry.get_defer_seconds(error, lambda: 0, receive_count=100)
+        == retry.MAX_VISIBILITY_TIMEOUT_SECONDS
+    )
+
+
+def test_bedrock_clients_leave_retries_to_the_retrier():
+    # botocoreとRetrierの再試行が掛け合わさって呼び出しが増えないようにする
+    assert clients.get_config("bedrock-agent-runtime").retries["max_attempts"] == 1
+    assert clients.get_config("bedrock-runtime").retries["max_attempts"] == 1
+    assert clients.get_config("sqs").retries["max_attempts"] == 3
+
+
+class SequenceSlackClient:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def api_call(self, method, payload, access_token):
+        self.calls.append((method, payload))
+        return self.responses.pop(0)
+
+
+def test_slack_api_call_retries_429_with_retry_after():
+    retrier, sleeps = make_retrier("Slack")
+    retry.set_retrier("Slack", retrier)
+    client = SequenceSlackClient(
+        slack.SlackResponse(429, {"retry-after": "3"}, {"ok": False}),
+        slack.SlackResponse(200, {}, {"ok": True, "ts": "1.2"}),
+    )
+    res = slack.api_call_with_retry("chat.postMessage", {}, "token", client=client)
+    assert res.ok
+    assert sleeps == [3]
+    assert len(client.calls) == 2
+
+
+class VisibilityClient:
+    def __init__(self):
+        self.changes = []
+
+    def change_message_visibility(self, **kwargs):
+        self.changes.append(kwargs)
+
+
+def make_sqs_record(message_id, text):
+    record = make_record(message_id, text)
+    record["receiptHandle"] = f"handle-{message_id}"
+    record["eventSourceARN"] = "arn:aws:sqs:us-east-1:123456789012:queue"
+    return record
+
+
+def test_throttled_flow_is_deferred_back_to_sqs(runtime_client, monkeypatch):
+    sqs_client = VisibilityClient()
+    monkeypatch.setattr(
+        handler.clients,
+        "get_client",
+        lambda service, **kwargs: sqs_client if service == "sqs" else runtime_client,
+    )
+    retry.set_retrier("Bedrock", make_retrier("Bedrock", max_attempts=2)[0])
+
+    def throttled(**kwargs):
+        raise throttling_error()
+
+    monkeypatch.setattr(runtime_client, "invoke_flow", throttled)
+    response = handler.main({"Records": [make_sqs_record("m1", "hello")]}, {})
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "m1"}]}
+    change = sqs_client.changes[0]
+    assert change["QueueUrl"] == (
+        "https://sqs.us-east-1.amazonaws.com/123456789012/queue"
+    )
+    assert change["ReceiptHandle"] == "handle-m1"
+    assert change["VisibilityTimeout"] >= retry.DEFAULT_COOLDOWN_SECONDS
+
+
+def test_deferral_grows_with_receive_count(runtime_client, monkeypatch):
+    sqs_client = VisibilityClient()
+    monkeypatch.setattr(
+        handler.clients,
+        "get_client",
+        lambda service, **kwargs: sqs_client if service == "sqs" else runtime_client,
+    )
+    retry.set_retrier("Bedrock", make_retrier("Bedrock", max_attempts=1)[0])
+
+    def throttled(**kwargs):
+        raise throttling_error()
+
+    monkeypatch.setattr(runtime_client, "invoke_flow", throttled)
+    record = make_sqs_record("m1", "hello")
+    record["attributes"] = {"ApproximateReceiveCount": "3"}
+    handler.main({"Records": [record]}, {})
+
+    # 3回目の受信では待ち時間の4倍から8倍まで後回しにする
+    cooldown = retry.DEFAULT_COOLDOWN_SECONDS
+    assert 4 * cooldown <= sqs_client.changes[0]["VisibilityTimeout"] <= 8 * cooldown
+
+
+def fail_first_post(runtime_client, monkeypatch):
+    sqs_client = VisibilityClient()
+    monkeypatch.setattr(
+        handler.clients,
+        "get_client",
+        lambda service, **kwargs: sqs_client if service == "sqs" else runtime_client,
+    )
+    monkeypatch.setattr(handler, "post_message_to_channel", post_message_to_channel)
+    retry.set_retrier("Slack", make_retrier("Slack", max_attempts=1)[0])
+    slack_client = SequenceSlackClient(
+        slack.SlackResponse(503, {}, {"ok": False}),
+        slack.SlackResponse(200, {}, {"ok": True, "ts": "1.2"}),
+    )
+    monkeypatch.setattr(handler.slack, "get_slack_client", lambda: slack_client)
+    return sqs_client, slack_client
+
+
+def test_failed_post_keeps_answer_for_redelivery(runtime_client, monkeypatch):
+    sqs_client, slack_client = fail_first_post(runtime_client, monkeypatch)
+    record = make_sqs_record("m1", "hello")
+
+    first = handler.main({"Records": [record]}, {})
+    assert first == {"batchItemFailures": [{"itemIdentifier": "m1"}]}
+    assert len(sqs_client.changes) == 1
+
+    # 再配信ではFlowを呼ばずに、生成済みの回答を投稿する
+    second = handler.main({"Records": [record]}, {})
+    assert second == {"batchItemFailures": []}
+    assert runtime_client.inputs == ["hello"]
+    assert slack_client.calls[-1][1]["text"] == "answer: hello"
+
+    # 投稿し終えた回答は記録から消える
+    flow_key = idempotency.make_flow_key(
+        "C123456", json.loads(record["body"])["event"]["event_ts"]
+    )
+    store = idempotency.get_idempotency_store()
+    store.release(flow_key)
+    assert store.claim_with_pending(flow_key) == (True, None)
+
+
+def test_failed_post_is_not_kept_for_opted_out_channels(runtime_client, monkeypatch):
+    monkeypatch.setenv("RESPONSE_CACHE_OPTOUT_CHANNELS", "C123456")
+    fail_first_post(runtime_client, monkeypatch)
+    record = make_sqs_record("m1", "hello")
+
+    handler.main({"Records": [record]}, {})
+    handler.main({"Records": [record]}, {})
+
+    # 回答を保存しないチャンネルでは、再配信で回答を生成し直す
+    assert runtime_client.inputs == ["hello", "hello"]
@@ -0,0 +1,119 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bedrock_bot_common import clients, slack
+from tests.unit.fakes import FakeClock
+
+
+class SlackSinkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        payload = json.loads(self.rfile.read(length))
+        self.server.requests.append(
+            (self.path, self.headers["Authorization"], payload, self.client_address)
+        )
+        body = json.dumps({"ok": True, "ts": "1700000000.000200"}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def slack_sink():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlackSinkHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_api_call_posts_json_with_bearer_token(slack_sink):
+    client = slack.SlackClient(f"http://127.0.0.1:{slack_sink.server_port}/api/")
+    res = client.api_call("chat.postMessage", {"channel": "C1", "text": "hi"}, "xoxb")
+    assert res.ok
+    assert res.data["ts"] == "1700000000.000200"
+    path, authorization, payload, _ = slack_sink.requests[0]
+    assert path == "/api/chat.postMessage"
+    assert authorization == "Bearer xoxb"
+    assert payload == {"channel": "C1", "text": "hi"}
+
+
+def test_api_call_reuses_keep_alive_connection(slack_sink):
+    client = slack.SlackClient(f"http://127.0.0.1:{slack_sink.server_port}/api/")
+    for i in range(5):
+        client.api_call("chat.postMessage", {"text": str(i)}, "xoxb")
+    client_addresses = {request[3] for request in slack_sink.requests}
+    assert len(slack_sink.requests) == 5
+    assert len(client_addresses) == 1
+
+
+def test_api_call_reconnects_when_pooled_connection_is_closed(slack_sink):
+    client = slack.SlackClient(f"http://127.0.0.1:{slack_sink.server_port}/api/")
+    client.api_call("chat.postMessage", {"text": "first"}, "xoxb")
+    # プールに戻った接続をサーバー側切断と同じ状態にする
+    pooled = client._pool.get_nowait()
+    pooled.sock.close()
+    client._pool.put_nowait(pooled)
+    res = client.api_call("chat.postMessage", {"text": "second"}, "xoxb")
+    assert res.ok
+    assert [request[2]["text"] for request in slack_sink.requests] == [
+        "first",
+        "second",
+    ]
+
+
+def test_message_streamer_throttles_updates():
+    clock = FakeClock()
+    updates = []
+    streamer = slack.MessageStreamer(updates.append, interval=1.0, clock=clock)
+
+    streamer.push("a")
+    clock.now = 0.5
+    streamer.push("ab")
+    assert updates == []
+
+    clock.now = 1.2
+    streamer.push("abc")
+    clock.now = 1.5
+    streamer.push("abcd")
+    assert updates == ["abc"]
+
+    streamer.flush()
+    assert updates == ["abc", "abcd"]
+    streamer.flush("abcd")
+    assert streamer.update_count == 2
+
+
+def test_get_slack_client_is_shared(monkeypatch):
+    slack.reset()
+    assert slack.get_slack_client() is slack.get_slack_client()
+    slack.reset()
+
+
+def test_get_client_is_created_once(monkeypatch):
+    created = []
+    monkeypatch.setattr(
+        "boto3.client",
+        lambda service_name, **kwargs: created.append((service_name, kwargs))
+        or object(),
+    )
+    clients.reset()
+    first = clients.get_client("sqs")
+    assert clients.get_client("sqs") is first
+    assert len(created) == 1
+    config = created[0][1]["config"]
+    assert config.tcp_keepalive is True
+    assert config.retries == {"mode": "standard", "max_attempts": 3}
+    clients.reset()
@@ -0,0 +1,157 @@
+import time
+
+from botocore.exceptions import NoCredentialsError
+
+from bedrock_bot_common import chunker
+from lambda_module.sqs import handler
+from tests.unit.fakes import make_record
+
+# フィクスチャで差し替える前の実装
+post_message_to_channel = handler.post_message_to_channel
+
+
+def test_main_processes_every_record(runtime_client):
+    event = {"Records": [make_record(f"m{i}", f"question {i}") for i in range(3)]}
+    response = handler.main(event, {})
+    assert response == {"batchItemFailures": []}
+    assert sorted(runtime_client.inputs) == ["question 0", "question 1", "question 2"]
+    assert len(runtime_client.posted) == 3
+
+
+def test_main_reports_only_failed_records(runtime_client):
+    event = {
+        "Records": [
+            make_record("m1", "hello"),
+            make_record("m2", "broken"),
+            make_record("m3", "world"),
+        ]
+    }
+    response = handler.main(event, {})
+    assert response == {"batchItemFailures": [{"itemIdentifier": "m2"}]}
+    assert sorted(message for _, message in runtime_client.posted) == [
+        "answer: hello",
+        "answer: world",
+    ]
+
+
+def test_main_invokes_flows_concurrently_up_to_the_cap(runtime_client, monkeypatch):
+    runtime_client.latency = 0.1
+    monkeypatch.setenv("FLOW_MAX_CONCURRENCY", "3")
+    event = {"Records": [make_record(f"m{i}", f"question {i}") for i in range(6)]}
+
+    start = time.monotonic()
+    response = handler.main(event, {})
+    elapsed = time.monotonic() - start
+
+    assert response == {"batchItemFailures": []}
+    assert runtime_client.max_active == 3
+    # 6件 / 同時3件 = 2ラウンド分の時間で終わる
+    assert elapsed < 0.1 * 6
+
+
+def test_main_fails_whole_batch_without_ssm_parameters(runtime_client, monkeypatch):
+    def raise_client_error():
+        raise handler.ClientError(
+            {"Error": {"Code": "ParameterNotFound", "Message": "missing"}},
+            "GetParameters",
+        )
+
+    monkeypatch.setattr(handler, "get_ssm_parameters", raise_client_error)
+    event = {"Records": [make_record("m1", "hello"), make_record("m2", "world")]}
+    response = handler.main(event, {})
+    assert response == {
+        "batchItemFailures": [{"itemIdentifier": "m1"}, {"itemIdentifier": "m2"}]
+    }
+    assert runtime_client.inputs == []
+
+
+def test_main_streams_placeholder_then_updates(runtime_client, monkeypatch):
+    calls = []
+
+    class FakeSlackClient:
+        def api_call(self, method, payload, access_token):
+            calls.append((method, payload))
+            return handler.slack.SlackResponse(
+                200, {}, {"ok": True, "ts": "1700000000.000200"}
+            )
+
+    monkeypatch.setenv("SLACK_STREAMING_MODE", "true")
+    monkeypatch.setenv("SLACK_STREAM_UPDATE_INTERVAL", "0")
+    monkeypatch.setattr(handler, "post_message_to_channel", post_message_to_channel)
+    monkeypatch.setattr(handler.slack, "get_slack_client", lambda: FakeSlackClient())
+
+    response = handler.main({"Records": [make_record("m1", "hello")]}, {})
+
+    assert response == {"batchItemFailures": []}
+    assert [method for method, _ in calls] == [
+        "chat.postMessage",
+        "chat.update",
+        "chat.update",
+    ]
+    assert calls[0][1]["text"] == handler.STREAMING_PLACEHOLDER
+    assert calls[1][1]["text"] == f"{handler.STREAMING_PLACEHOLDER} (PromptNode)"
+    assert calls[2][1] == {
+        "channel": "C123456",
+        "ts": "1700000000.000200",
+        "text": "answer: hello",
+    }
+
+
+def test_streaming_updates_replace_blocks_with_block_kit(runtime_client, monkeypatch):
+    calls = []
+
+    class FakeSlackClient:
+        def api_call(self, method, payload, access_token):
+            calls.append((method, payload))
+            return handler.slack.SlackResponse(
+                200, {}, {"ok": True, "ts": "1700000000.000200"}
+            )
+
+    monkeypatch.setenv("SLACK_STREAMING_MODE", "true")
+    monkeypatch.setenv("SLACK_STREAM_UPDATE_INTERVAL", "0")
+    monkeypatch.setenv("SLACK_BLOCK_KIT", "true")
+    monkeypatch.setattr(handler, "post_message_to_channel", post_message_to_channel)
+    monkeypatch.setattr(handler.slack, "get_slack_client", lambda: FakeSlackClient())
+
+    handler.main({"Records": [make_record("m1", "hello")]}, {})
+
+    assert calls[0][1]["blocks"] == chunker.make_blocks(handler.STREAMING_PLACEHOLDER)
+    # プレースホルダーのblocksが残らないよう、更新でもblocksを置き換える
+    assert calls[-1] == (
+        "chat.update",
+        {
+            "channel": "C123456",
+            "ts": "1700000000.000200",
+            "text": "answer: hello",
+            "blocks": chunker.make_blocks("answer: hello"),
+        },
+    )
+
+
+def test_streaming_placeholder_is_deleted_on_botocore_errors(
+    runtime_client, monkeypatch
+):
+    calls = []
+
+    class FakeSlackClient:
+        def api_call(self, method, payload, access_token):
+            calls.append((method, payload))
+            return handler.slack.SlackResponse(
+                200, {}, {"ok": True, "ts": "1700000000.000200"}
+            )
+
+    def no_credentials(**kwargs):
+        raise NoCredentialsError()
+
+    monkeypatch.setenv("SLACK_STREAMING_MODE", "true")
+    monkeypatch.setattr(handler, "post_message_to_channel", post_message_to_channel)
+    monkeypatch.setattr(handler.slack, "get_slack_client", lambda: FakeSlackClient())
+    monkeypatch.setattr(runtime_client, "invoke_flow", no_credentials)
+
+    response = handler.main({"Records": [make_record("m1", "hello")]}, {})
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "m1"}]}
+    assert calls[-1] == (
+        "chat.delete",
+        {"channel": "C123456", "ts": "1700000000.000200"},
+    )
@@ -0,0 +1,28 @@
+from bedrock_bot import stack_outputs
+
+
+class FakeCloudFormationClient:
+    def __init__(self):
+        self.requested = []
+
+    def describe_stacks(self, StackName):
+        self.requested.append(StackName)
+        return {
+            "Stacks": [
+                {
+                    "Outputs": [
+                        {"OutputKey": "QueueUrl", "OutputValue": "https://queue"},
+                        {"OutputKey": "ApiFunctionName", "OutputValue": "api"},
+                    ]
+                }
+            ]
+        }
+
+
+def test_get_stack_outputs_maps_keys_to_values():
+    client = FakeCloudFormationClient()
+    outputs = stack_outputs.get_stack_outputs(
+        stack_outputs.DEFAULT_STACK_NAME, client=client
+    )
+    assert outputs == {"QueueUrl": "https://queue", "ApiFunctionName": "api"}
+    assert client.requested == ["BedrockBotStack"]